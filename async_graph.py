@@ -0,0 +1,119 @@
+"""
+以 Neo4j 非同步驅動程式存取知識圖譜
+所有請求共用同一個 driver（內建連線池），等待資料庫時只佔用協程、不佔用執行緒；
+Cypher 檢索流程與直接查詢都透過這裡執行
+"""
+import asyncio
+import time
+from typing import List, Optional
+
+from neo4j import AsyncGraphDatabase, RoutingControl
+from neo4j.exceptions import ServiceUnavailable, SessionExpired
+
+from config import NEO4J_POOL_SIZE, NEO4J_ACQUIRE_TIMEOUT
+from cypher_params import parameterize, plan_cache_stats
+
+# 結構描述（供 Cypher 生成提示詞使用）的快取秒數
+SCHEMA_TTL = 600
+
+NODE_PROPERTIES_QUERY = """
+CALL db.schema.nodeTypeProperties() YIELD nodeLabels, propertyName, propertyTypes
+RETURN nodeLabels, propertyName, propertyTypes
+"""
+
+RELATIONSHIPS_QUERY = """
+MATCH (a)-[r]->(b)
+WITH DISTINCT labels(a) AS source, type(r) AS type, labels(b) AS target
+RETURN source, type, target LIMIT 100
+"""
+
+# 連線層級的錯誤才回報斷路器；查詢語法錯誤等不代表資料庫異常
+CONNECTION_ERRORS = (ServiceUnavailable, SessionExpired, OSError)
+
+
+class AsyncNeo4jGraph:
+    """非同步的知識圖譜查詢介面（第一次使用時才建立 driver）"""
+
+    def __init__(self, url: str, username: str, password: str, database: str,
+                 breaker=None, pool_size: int = NEO4J_POOL_SIZE,
+                 acquire_timeout: float = NEO4J_ACQUIRE_TIMEOUT):
+        self.url = url
+        self.database = database
+        self.breaker = breaker
+        self._auth = (username, password)
+        self._pool_size = pool_size
+        self._acquire_timeout = acquire_timeout
+        self._driver = None
+        self._schema: Optional[str] = None
+        self._schema_at = 0.0
+        self._schema_lock = asyncio.Lock()
+
+    @property
+    def driver(self):
+        if self._driver is None:
+            self._driver = AsyncGraphDatabase.driver(
+                self.url,
+                auth=self._auth,
+                max_connection_pool_size=self._pool_size,
+                connection_acquisition_timeout=self._acquire_timeout,
+            )
+        return self._driver
+
+    async def _execute(self, cypher: str, params: dict):
+        try:
+            return await self.driver.execute_query(
+                cypher, params, database_=self.database, routing_=RoutingControl.READ
+            )
+        except CONNECTION_ERRORS:
+            if self.breaker:
+                self.breaker.record_failure()
+            raise
+
+    async def verify(self):
+        """確認資料庫可連線（使用連線池中的連線）"""
+        await self.driver.verify_connectivity()
+
+    async def query(self, cypher: str, params: Optional[dict] = None) -> List[dict]:
+        """執行唯讀查詢；未提供參數時先將字串常值參數化以共用執行計畫快取"""
+        if params is None:
+            cypher, params = parameterize(cypher)
+        records, summary, _ = await self._execute(cypher, params)
+        plan_cache_stats.record(cypher, summary.result_available_after or 0)
+        return [record.data() for record in records]
+
+    async def explain(self, cypher: str):
+        """取得參數化後查詢的執行計畫（只規劃不執行）"""
+        template, params = parameterize(cypher)
+        result = await self._execute(f"EXPLAIN {template}", params)
+        return result.summary.plan
+
+    async def get_schema(self) -> str:
+        """節點屬性與關係的結構描述（格式與 Neo4jGraph.schema 相同），快取 SCHEMA_TTL 秒"""
+        async with self._schema_lock:
+            if self._schema is None or time.monotonic() - self._schema_at > SCHEMA_TTL:
+                self._schema = await self._build_schema()
+                self._schema_at = time.monotonic()
+            return self._schema
+
+    async def _build_schema(self) -> str:
+        properties = await self.query(NODE_PROPERTIES_QUERY, {})
+        relationships = await self.query(RELATIONSHIPS_QUERY, {})
+        labels = {}
+        for row in properties:
+            for label in row["nodeLabels"]:
+                if row["propertyName"]:
+                    types = "/".join(t.replace("String", "STRING") for t in row["propertyTypes"] or [])
+                    labels.setdefault(label, []).append(f"{row['propertyName']}: {types}")
+        lines = ["Node properties:"]
+        lines += [f"{label} {{{', '.join(props)}}}" for label, props in sorted(labels.items())]
+        lines.append("The relationships:")
+        for row in relationships:
+            for source in row["source"]:
+                for target in row["target"]:
+                    lines.append(f"(:{source})-[:{row['type']}]->(:{target})")
+        return "\n".join(lines)
+
+    async def close(self):
+        if self._driver is not None:
+            await self._driver.close()
+            self._driver = None
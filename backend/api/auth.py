@@ -9,12 +9,13 @@ from models.schemas import (
     LoginRequest, AnonymousLoginRequest, AdminLoginRequest, DoctorLoginRequest, LoginResponse
 )
 from config import ADMIN_PASSWORD
+from utils.state_store import Namespace, state_store
 
 router = APIRouter(prefix="/api/auth", tags=["auth"])
 
 
-# In-memory user sessions (upgrade to database in production)
-active_users = {}
+# Logged-in users, shared between workers when STATE_BACKEND=sqlite
+active_users = Namespace(state_store, "active_users")
 
 
 @router.post("/login", response_model=LoginResponse)
@@ -136,6 +137,7 @@ async def doctor_login(request: DoctorLoginRequest):
 @router.get("/verify/{user_id}")
 async def verify_user(user_id: str):
     """Verify if user is logged in"""
-    if user_id in active_users:
-        return {"valid": True, "user": active_users[user_id]}
+    user = active_users.get(user_id)
+    if user is not None:
+        return {"valid": True, "user": user}
     return {"valid": False}
@@ -2,8 +2,8 @@
 Chat API endpoints
 Handles chat sessions and messaging
 """
-from fastapi import APIRouter, HTTPException, Query
-from typing import List
+from fastapi import APIRouter, Header, HTTPException, Query, Response, WebSocket, WebSocketDisconnect
+from typing import List, Optional
 from timeit import default_timer as timer
 import sys
 import os
@@ -17,10 +17,30 @@ from models.schemas import (
     CreateSessionRequest, UpdateSessionRequest
 )
 from utils.session_manager import session_manager
+from utils.state_store import store_epoch
+from utils.http_cache import make_etag, not_modified
+from api.profile import profiles
+from services.request_coalescer import stream_coalescer
+from services.scheduler import scheduler, SchedulerOverloaded
+from services.session_titler import session_titler
+from services.sse import sse_streams
+from services.ws_channel import ChatChannel, ChannelClosed
 
 router = APIRouter(prefix="/api", tags=["chat"])
 
 
+def admit_request(session):
+    """Admit a chat request into the LLM scheduler, or reject it with 503 + Retry-After"""
+    try:
+        return scheduler.admit(session.user_id, session.doctor)
+    except SchedulerOverloaded as e:
+        raise HTTPException(
+            status_code=503,
+            detail=e.reason,
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+
 @router.post("/sessions")
 async def create_session(user_id: str = Query(...), doctor: str = Query(None)):
     """Create a new chat session"""
@@ -38,8 +58,13 @@ async def create_session(user_id: str = Query(...), doctor: str = Query(None)):
 
 
 @router.get("/sessions")
-async def get_sessions(user_id: str = Query(...), doctor: str = Query(None)) -> List[dict]:
-    """Get all sessions for a user"""
+async def get_sessions(response: Response, user_id: str = Query(...), doctor: str = Query(None),
+                       if_none_match: Optional[str] = Header(None)) -> List[dict]:
+    """Get all sessions for a user (304 when the list hasn't changed since the client's ETag)"""
+    etag = make_etag("sessions", user_id, session_manager.get_user_version(user_id))
+    cached = not_modified(if_none_match, etag, response)
+    if cached:
+        return cached
     sessions = session_manager.get_user_sessions(user_id)
     return [
         {
@@ -54,11 +79,14 @@ async def get_sessions(user_id: str = Query(...), doctor: str = Query(None)) ->
 
 
 @router.get("/sessions/{session_id}")
-async def get_session(session_id: str):
+async def get_session(session_id: str, response: Response, if_none_match: Optional[str] = Header(None)):
     """Get a specific session"""
     session = session_manager.get_session(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
+    cached = not_modified(if_none_match, make_etag("session", session.id, session.version), response)
+    if cached:
+        return cached
     
     return {
         "id": session.id,
@@ -87,62 +115,103 @@ async def delete_session(session_id: str, user_id: str):
     return {"success": True, "message": "Session deleted"}
 
 
+def patient_for(session: ChatSession):
+    """
+    The session owner's retrieval context (CKD stage, allergies) from their stored profile, or None.
+    Profiles are read through the state store's cache, so this adds no round trip to the answer
+    """
+    return backend_logic.PatientContext.from_profile(profiles.get(session.user_id))
+
+
+def coalescing_key(message: str, patient) -> str:
+    """Identical questions share a run only between patients whose profiles lead to the same answer"""
+    return message if patient is None else f"{message}\n{patient.key}"
+
+
+def admit_unless_shared(session: ChatSession, message: str):
+    """
+    Admit a request into the scheduler unless it needs no pipeline slot of its own
+    (a precomputed FAQ answer, or the same question already in flight); returns (ticket, faq_hit)
+    """
+    patient = patient_for(session)
+    # 已設定分期的病人只使用同一分期的回答；有過敏原的病人可能不適用通用回答（改走個人化查詢），保守地佔用名額
+    faq_hit = (backend_logic.faq_store.matches(message, patient.ckd_stage if patient else None)
+               and not (patient and patient.allergies))
+    ticket = None
+    if not faq_hit and not stream_coalescer.is_in_flight(coalescing_key(message, patient)):
+        ticket = admit_request(session)
+    return ticket, faq_hit
+
+
+async def answer_events(message: str, session: ChatSession, ticket=None, faq_hit: bool = False):
+    """
+    Events of the shared answer engine for one request, consumed by every chat endpoint.
+    Waits for a scheduler slot (reporting the queue position) and shares the run with identical
+    in-flight questions; closing the iterator cancels the run once no other subscriber is left.
+    Retrieval and generation are personalized with the session owner's profile
+    """
+    pipeline_started = False
+    patient = patient_for(session)
+    
+    async def run_pipeline():
+        """等待排程名額（回報排隊位置）後執行查詢流程"""
+        nonlocal pipeline_started
+        pipeline_started = True
+        slot = ticket
+        try:
+            if slot is None and not faq_hit:
+                slot = scheduler.admit(session.user_id, session.doctor)
+            if slot is not None:
+                async for position in slot.wait():
+                    yield {
+                        "type": "status",
+                        "content": f"目前排隊中，前方還有 {position - 1} 位，請稍候...",
+                        "queue_position": position
+                    }
+            async for event in backend_logic.query_graph_two_stage_stream(message, patient=patient):
+                yield event
+        except SchedulerOverloaded as e:
+            yield {"type": "error", "content": f"系統忙碌中，請於 {e.retry_after} 秒後再試。"}
+        finally:
+            if slot is not None:
+                slot.release()
+    
+    # 相同問題同時進行時共用同一次查詢與生成
+    events = stream_coalescer.subscribe(
+        coalescing_key(message, patient), run_pipeline, on_join=ticket.release if ticket else None
+    )
+    try:
+        async for event in events:
+            yield event
+    finally:
+        # 關閉訂閱；若已無其他訂閱者，共用的查詢流程會被取消
+        await events.aclose()
+        if ticket and not pipeline_started:
+            ticket.release()
+
+
 @router.post("/chat/message", response_model=SendMessageResponse)
 async def send_message(request: SendMessageRequest):
-    """Send a message and get response"""
+    """Send a message and get the aggregated response of the streaming answer engine"""
     session = session_manager.get_session(request.session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    # Add user message to history
-    session_manager.add_message(request.session_id, "user", request.message)
+    ticket, faq_hit = admit_unless_shared(session, request.message)
     
-    # Auto-rename session if it's the first message
-    if session.name is None and len(session.history) == 1:
-        try:
-            rename = backend_logic.llm_chinese.invoke(
-                f"請用一句話為以下對話命名，作為標題：\n使用者：{request.message}"
-            ).content.strip().replace('"', '').replace("'", "")
-            session_manager.update_session_name(request.session_id, rename)
-        except Exception as e:
-            print(f"Auto-rename failed: {e}")
+    # Add user message to history
+    session = session_manager.add_message(request.session_id, "user", request.message)
+    session_titler.name_new_session(session)
     
-    # Process the question using backend logic
     start = timer()
-    try:
-        # Use backend function
-        result, b_databaseProblem = backend_logic.query_graph_two_stage(request.message)
-        
-        # Check result
-        if b_databaseProblem:
-            firstResult = "資料庫連結異常，請稍後再試。"
-        elif not result:
-            firstResult = "系統無法處理您的問題，請稍後再試。"
-        elif 'result' not in result or not result['result']:
-            firstResult = "目前找不到相關資訊，請嘗試用不同的方式再次提問。"
-        else:
-            firstResult = result['result']
-        
-        # Generate detailed response (collect from async generator)
-        detail = ""
-        async for chunk in backend_logic.conclusionAnswer(firstResult, request.message):
-            detail += chunk
-        
-        # Generate outline (collect from async generator)
-        outline = ""
-        async for chunk in backend_logic.concise_outline(detail, request.message):
-            outline += chunk
-        
-    except Exception as e:
-        print(f"Error processing question: {e}")
-        outline = "系統發生錯誤"
-        detail = "系統發生錯誤，請稍後再試。"
-    
+    answer = await backend_logic.aggregate_answer(answer_events(request.message, session, ticket, faq_hit))
     processing_time = timer() - start
     
     # Add assistant response to history
-    response_content = {"outline": outline, "detail": detail}
+    response_content = {"outline": answer["outline"], "detail": answer["detail"]}
     session_manager.add_message(request.session_id, "assistant", response_content)
+    if len(session.history) == 1:
+        session_titler.refine_later(request.session_id, request.message, backend_logic.generate_session_title)
     
     return SendMessageResponse(
         success=True,
@@ -164,107 +233,220 @@ async def voice_input(audio_data: str):
 
 
 
+async def recorded_answer_events(message: str, session: ChatSession, ticket=None,
+                                 faq_hit: bool = False, session_title: str = None):
+    """
+    回答事件（串流傳輸共用）：新對話先送出標題；完整回答在 done 時寫入歷史記錄，
+    不受前端連線中斷影響
+    """
+    events = answer_events(message, session, ticket, faq_hit)
+    entered = False
+    try:
+        if session_title:
+            yield {"type": "title", "content": session_title}
+        # 進入 answer_events 之後，排程名額由它負責釋放
+        entered = True
+        async for event in events:
+            if event["type"] == "done":
+                # 保存完整回答到歷史記錄
+                response_content = {"outline": event["outline"], "detail": event["detail"]}
+                session_manager.add_message(session.id, "assistant", response_content)
+                if session_title:
+                    session_titler.refine_later(session.id, message, backend_logic.generate_session_title)
+            yield event
+    finally:
+        await events.aclose()
+        if ticket and not entered:
+            ticket.release()
+
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",  # 禁用 nginx 緩衝
+}
+
+
 @router.post("/chat/message/stream")
 async def send_message_stream(request: SendMessageRequest):
-    """Send a message and get streaming response using Server-Sent Events"""
-    import json
+    """
+    Send a message and get a streaming response using Server-Sent Events.
+    The X-Stream-ID response header identifies the stream for resuming via /chat/stream/{stream_id}
+    """
     from fastapi.responses import StreamingResponse
     
     session = session_manager.get_session(request.session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    # Add user message to history
-    session_manager.add_message(request.session_id, "user", request.message)
+    # 常見問題有預先產生的回答、或相同問題已在處理中時，不另外佔用排程名額
+    ticket, faq_hit = admit_unless_shared(session, request.message)
     
-    # Auto-rename session if it's the first message (使用第一個問題)
-    if session.name is None and len(session.history) == 1:
-        # 直接使用第一個問題作為會話名稱，限制長度避免太長
-        session_name = request.message[:30] + ('...' if len(request.message) > 30 else '')
-        session_manager.update_session_name(request.session_id, session_name)
-        print(f"會話已命名為: {session_name}")
+    # Add user message to history
+    session = session_manager.add_message(request.session_id, "user", request.message)
     
-    async def event_generator():
-        """生成 SSE 事件"""
-        outline_text = ""
-        detail_text = ""
-        
-        try:
-            async for event in backend_logic.query_graph_two_stage_stream(request.message):
-                # 收集數據
-                if event["type"] == "outline_chunk":
-                    outline_text += event["content"]
-                elif event["type"] == "detail_chunk":
-                    detail_text += event["content"]
-                elif event["type"] == "done":
-                    outline_text = event["outline"]
-                    detail_text = event["detail"]
-                    
-                    # 保存完整回答到歷史記錄
-                    response_content = {
-                        "outline": outline_text,
-                        "detail": detail_text
-                    }
-                    session_manager.add_message(
-                        request.session_id,
-                        "assistant",
-                        response_content
-                    )
-                
-                # 格式化為 SSE 格式
-                sse_data = f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
-                yield sse_data
-                
-        except Exception as e:
-            error_event = {"type": "error", "content": f"系統發生錯誤：{str(e)}"}
-            yield f"data: {json.dumps(error_event, ensure_ascii=False)}\n\n"
+    # 第一個問題：立即以擷取式標題命名，並在串流開頭推送給前端
+    session_title = session_titler.name_new_session(session)
     
+    # 前端中斷連線後保留一段時間供續傳，沒有續傳才取消上游查詢與生成
+    stream = sse_streams.open(recorded_answer_events(request.message, session, ticket, faq_hit, session_title))
     return StreamingResponse(
-        event_generator(),
+        stream.read(),
         media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no",  # 禁用 nginx 緩衝
-        }
+        headers={**SSE_HEADERS, "X-Stream-ID": stream.id}
     )
 
 
-@router.get("/doctor/patients")
-async def get_doctor_patients(doctor: str = Query(...)):
-    """Get patient list for a doctor"""
-    sessions = session_manager.get_sessions_by_doctor(doctor)
+@router.get("/chat/stream/{stream_id}")
+async def resume_message_stream(stream_id: str, last_event_id: Optional[str] = Header(None)):
+    """Resume an answer stream after a dropped connection, replaying the frames after Last-Event-ID"""
+    from fastapi.responses import StreamingResponse
     
-    # 提取唯一病患
-    patients = {}
-    for session in sessions:
-        user_id = session.user_id
-        if user_id and user_id not in patients:
-            # 從user_id提取病患名稱和email (格式: name_email)
-            parts = user_id.split('_', 1)  # Split only on first underscore
-            name = parts[0] if len(parts) > 0 else user_id
-            email = parts[1] if len(parts) > 1 else ""
-            
-            patients[user_id] = {
-                "user_id": user_id,
-                "name": name,
-                "email": email,  # 新增：病患email
-                "session_count": 0,
-                "last_activity": session.updated_at.isoformat()
-            }
-        
-        if user_id:
-            patients[user_id]["session_count"] += 1
-            # 更新最後活動時間
-            if session.updated_at.isoformat() > patients[user_id]["last_activity"]:
-                patients[user_id]["last_activity"] = session.updated_at.isoformat()
+    stream = sse_streams.get(stream_id)
+    if stream is None:
+        raise HTTPException(status_code=404, detail="Stream not found or expired")
+    try:
+        last_id = int(last_event_id or 0)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
+    sse_streams.resumed += 1
+    return StreamingResponse(stream.read(last_id), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@router.websocket("/chat/ws")
+async def chat_websocket(websocket: WebSocket):
+    """
+    Multiplexed chat over one WebSocket connection.
+    Client events: {"type": "send", "request_id", "session_id", "message"} and {"type": "cancel", "request_id"}.
+    Server events carry the request_id: status, title, token (section + content), done and error
+    """
+    await websocket.accept()
+    channel = ChatChannel(websocket)
+    try:
+        while True:
+            try:
+                command = await websocket.receive_json()
+            except ValueError:
+                await channel.send({"type": "error", "content": "Invalid JSON"})
+                continue
+            request_id = str(command.get("request_id") or "")
+            if command.get("type") == "send":
+                await _start_channel_message(channel, request_id, command)
+            elif command.get("type") == "cancel":
+                if channel.cancel(request_id):
+                    await channel.send({"type": "status", "request_id": request_id, "content": "cancelled"})
+            else:
+                await channel.send({"type": "error", "request_id": request_id, "content": "Unknown event type"})
+    except (WebSocketDisconnect, ChannelClosed):
+        pass
+    finally:
+        await channel.close()
+
+
+async def _start_channel_message(channel: ChatChannel, request_id: str, command: dict):
+    """Validate a WebSocket send event and start its answer on the channel"""
+    message = (command.get("message") or "").strip()
+    session_id = command.get("session_id")
+    if not request_id or not message or not session_id:
+        await channel.send({"type": "error", "request_id": request_id,
+                            "content": "send requires request_id, session_id and message"})
+        return
+    if channel.is_active(request_id) or channel.full:
+        await channel.send({"type": "error", "request_id": request_id,
+                            "content": "Too many concurrent requests on this connection"})
+        return
+    session = session_manager.get_session(session_id)
+    if not session:
+        await channel.send({"type": "error", "request_id": request_id, "content": "Session not found"})
+        return
+    try:
+        ticket, faq_hit = admit_unless_shared(session, message)
+    except HTTPException as e:
+        await channel.send({"type": "error", "request_id": request_id, "session_id": session_id,
+                            "content": e.detail, "retry_after": int(e.headers["Retry-After"])})
+        return
     
-    return list(patients.values())
+    session = session_manager.add_message(session_id, "user", message)
+    session_title = session_titler.name_new_session(session)
+    channel.start(
+        request_id,
+        recorded_answer_events(message, session, ticket, faq_hit, session_title),
+        on_abort=ticket.release if ticket else None,
+        session_id=session_id
+    )
+
+
+@router.get("/doctor/patients")
+async def get_doctor_patients(response: Response, doctor: str = Query(...),
+                              if_none_match: Optional[str] = Header(None)):
+    """Get patient list for a doctor (served from the materialized dashboard aggregates)"""
+    stats = session_manager.get_doctor_stats(doctor)
+    cached = not_modified(if_none_match, make_etag("patients", doctor, stats["version"]), response)
+    if cached:
+        return cached
+    return [
+        {
+            "user_id": patient["user_id"],
+            "name": patient["name"],
+            "email": patient["email"],
+            "session_count": patient["session_count"],
+            "last_activity": patient["last_activity"]
+        }
+        for patient in stats["patients"].values()
+    ]
+
+
+@router.get("/doctor/dashboard")
+async def get_doctor_dashboard(
+    response: Response,
+    doctor: str = Query(...),
+    since: Optional[str] = Query(None, description="Cursor (<epoch>:<version>) from the previous response; only changes after it are returned"),
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Dashboard aggregates for a doctor (patient count, session count, last activity, question volume).
+    Poll with If-None-Match for a 304 when nothing changed, and with ?since=<cursor> for a delta.
+    A cursor from another store epoch (versions restarted) gets a full response
+    """
+    stats = session_manager.get_doctor_stats(doctor)
+    cached = not_modified(if_none_match, make_etag("dashboard", doctor, stats["version"], since), response)
+    if cached:
+        return cached
+    
+    epoch = store_epoch()
+    since_epoch, _, since_version = (since or "").partition(":")
+    known = int(since_version) if since_epoch == epoch and since_version.isdigit() else None
+    full = known is None or known > stats["version"]
+    patients = [
+        patient for patient in stats["patients"].values()
+        if full or patient["version"] > known
+    ]
+    return {
+        "doctor": doctor,
+        "version": stats["version"],
+        "cursor": f"{epoch}:{stats['version']}",
+        "full": full,
+        "totals": {
+            "patient_count": len(stats["patients"]),
+            "session_count": stats["session_count"],
+            "question_count": stats["question_count"],
+            "last_activity": stats["last_activity"]
+        },
+        "patients": patients,
+        "removed": [] if full else [
+            user_id for user_id, version in stats["removed"].items() if version > known
+        ]
+    }
 
 
 @router.get("/doctor/sessions")
-async def get_doctor_sessions(doctor: str = Query(...)):
-    """Get all sessions for a specific doctor, grouped by patient"""
+async def get_doctor_sessions(response: Response, doctor: str = Query(...), include_history: bool = Query(True),
+                              if_none_match: Optional[str] = Header(None)):
+    """Get all sessions for a specific doctor, grouped by patient (include_history=false sends message counts only)"""
+    version = session_manager.get_doctor_stats(doctor)["version"]
+    cached = not_modified(if_none_match, make_etag("doctor-sessions", doctor, version, include_history), response)
+    if cached:
+        return cached
     sessions = session_manager.get_sessions_by_doctor(doctor)
     
     # 按病患分組
@@ -273,13 +455,17 @@ async def get_doctor_sessions(doctor: str = Query(...)):
         user_id = session.user_id
         if user_id not in patients:
             patients[user_id] = []
-        patients[user_id].append({
+        summary = {
             "id": session.id,
             "name": session.name,
-            "history": session.history,
             "created_at": session.created_at.isoformat(),
             "updated_at": session.updated_at.isoformat()
-        })
+        }
+        if include_history:
+            summary["history"] = session.history
+        else:
+            summary["message_count"] = len(session.history)
+        patients[user_id].append(summary)
     
     return {
         "doctor": doctor,
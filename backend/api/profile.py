@@ -2,34 +2,45 @@
 Profile API endpoints
 Handles patient profile management
 """
-from fastapi import APIRouter, HTTPException
+from typing import Optional
+
+from fastapi import APIRouter, Header, Response
 from models.schemas import PatientProfile
+from utils.http_cache import make_etag, not_modified
+from utils.state_store import Namespace, state_store
 
 router = APIRouter(prefix="/api/profile", tags=["profile"])
 
-# In-memory profile storage (upgrade to database in production)
-profiles = {}
+# Profile storage, shared between workers when STATE_BACKEND=sqlite
+# (each stored profile carries a "version" counter used for its ETag)
+profiles = Namespace(state_store, "profiles")
 
 
 @router.get("/{user_id}", response_model=PatientProfile)
-async def get_profile(user_id: str):
-    """Get patient profile"""
-    if user_id not in profiles:
+async def get_profile(user_id: str, response: Response, if_none_match: Optional[str] = Header(None)):
+    """Get patient profile (304 when unchanged since the client's ETag)"""
+    data = profiles.get(user_id)
+    cached = not_modified(if_none_match, make_etag("profile", user_id, data["version"] if data else 0), response)
+    if cached:
+        return cached
+    if data is None:
         # Return default profile
         return PatientProfile(
             name="",
             doctor="",
-            doctor_email="",
+            patient_email="",
             patient_id="",
             ckd_stage=1,
             weight=60.0,
             allergies=""
         )
-    return profiles[user_id]
+    return PatientProfile(**data)
 
 
 @router.put("/{user_id}", response_model=PatientProfile)
 async def update_profile(user_id: str, profile: PatientProfile):
     """Update patient profile"""
-    profiles[user_id] = profile
+    profiles.update_item(
+        user_id, lambda old: {**profile.model_dump(), "version": (old or {}).get("version", 0) + 1}
+    )
     return profile
@@ -6,3 +6,81 @@ DB_URL = os.getenv("HOSPITAL_DB_URL")
 N8N_WEBHOOK_URL = os.getenv("N8N_WEBHOOK_URL")
 # 管理員密碼
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "123456789")
+
+# 問題相關性門檻（低於 REJECT 直接拒答，介於兩者之間視為邊界問題）
+RELEVANCE_ACCEPT_THRESHOLD = float(os.getenv("RELEVANCE_ACCEPT_THRESHOLD", "0.6"))
+RELEVANCE_REJECT_THRESHOLD = float(os.getenv("RELEVANCE_REJECT_THRESHOLD", "0.35"))
+
+# Ollama 連線設定
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "8"))
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "120"))
+
+# 對話請求排程（同時執行的 LLM 流程數、等待佇列長度、每位使用者同時請求上限）
+SCHEDULER_MAX_CONCURRENCY = int(os.getenv("SCHEDULER_MAX_CONCURRENCY", "2"))
+SCHEDULER_MAX_QUEUE = int(os.getenv("SCHEDULER_MAX_QUEUE", "32"))
+SCHEDULER_MAX_PER_USER = int(os.getenv("SCHEDULER_MAX_PER_USER", "2"))
+
+# 共享狀態儲存（memory: 單一 worker；sqlite: 多 worker 共用本機 SQLite 檔案）
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+STATE_DB_FILE = os.getenv("STATE_DB_FILE", "shared_state.db")
+STATE_CACHE_TTL = float(os.getenv("STATE_CACHE_TTL", "1.0"))
+
+# 回答模式：refine（鏈先生成草稿再整合）/ direct（略過草稿，直接以檢索內容串流詳細回答）
+#           / structured（略過草稿，單次生成同時輸出大綱與詳細說明）
+ANSWER_MODE = os.getenv("ANSWER_MODE", "refine")
+
+# 請求總期限與各階段時間預算（秒）；逾時時降級回答，而不是無限等待 Ollama / Neo4j
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "90"))
+STAGE_TIMEOUTS = {
+    "connect": float(os.getenv("STAGE_TIMEOUT_CONNECT", "5")),
+    "retrieval_english": float(os.getenv("STAGE_TIMEOUT_RETRIEVAL_ENGLISH", "25")),
+    "retrieval_chinese": float(os.getenv("STAGE_TIMEOUT_RETRIEVAL_CHINESE", "20")),
+    "direct_query": float(os.getenv("STAGE_TIMEOUT_DIRECT_QUERY", "5")),
+    "detail": float(os.getenv("STAGE_TIMEOUT_DETAIL", "45")),
+    "outline": float(os.getenv("STAGE_TIMEOUT_OUTLINE", "15")),
+    "structured": float(os.getenv("STAGE_TIMEOUT_STRUCTURED", "55")),
+}
+
+# 斷路器：最近 BREAKER_WINDOW 次呼叫中失敗率達門檻（且至少 BREAKER_MIN_CALLS 次）即斷路，
+# 斷路 BREAKER_RESET_TIMEOUT 秒後放行一個試探請求，試探失敗時冷卻時間加倍（上限 BREAKER_MAX_RESET_TIMEOUT）
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "15"))
+BREAKER_MAX_RESET_TIMEOUT = float(os.getenv("BREAKER_MAX_RESET_TIMEOUT", "120"))
+
+# 常見問題回答庫（由 backend/scripts/build_faq_store.py 產生）；問題正規化後與收錄問法相同即直接回答。
+# FAQ_MATCH_THRESHOLD 只用於離線分群：相似度達門檻且數字、否定詞與食物 / 數量名詞相同的問法才併為同一題
+FAQ_STORE_FILE = os.getenv("FAQ_STORE_FILE", "faq_answers.bin")
+FAQ_MATCH_THRESHOLD = float(os.getenv("FAQ_MATCH_THRESHOLD", "0.92"))
+
+# Neo4j 非同步 driver 連線池大小與取得連線的等待上限（秒）
+NEO4J_POOL_SIZE = int(os.getenv("NEO4J_POOL_SIZE", "50"))
+NEO4J_ACQUIRE_TIMEOUT = float(os.getenv("NEO4J_ACQUIRE_TIMEOUT", "5"))
+
+# 問題翻譯快取：記憶體最多保留的翻譯數，超過的寫入磁碟檔
+TRANSLATION_CACHE_SIZE = int(os.getenv("TRANSLATION_CACHE_SIZE", "512"))
+TRANSLATION_CACHE_FILE = os.getenv("TRANSLATION_CACHE_FILE", "translation_cache.jsonl")
+
+# 對話命名：extractive（以第一個問題擷取標題，不呼叫模型）/ llm（先擷取，回答完成後於背景以模型改寫）
+SESSION_TITLE_MODE = os.getenv("SESSION_TITLE_MODE", "extractive")
+SESSION_TITLE_MAX_LENGTH = int(os.getenv("SESSION_TITLE_MAX_LENGTH", "30"))
+
+# SSE 傳輸：token 合併成一個 frame 的時間窗（秒）與字數上限、閒置心跳間隔（秒）、
+# 每個串流保留供 Last-Event-ID 續傳的 frame 數、斷線後等待續傳的秒數、完成後保留的秒數
+SSE_COALESCE_INTERVAL = float(os.getenv("SSE_COALESCE_INTERVAL", "0.05"))
+SSE_COALESCE_MAX_CHARS = int(os.getenv("SSE_COALESCE_MAX_CHARS", "256"))
+SSE_HEARTBEAT_INTERVAL = float(os.getenv("SSE_HEARTBEAT_INTERVAL", "15"))
+SSE_REPLAY_FRAMES = int(os.getenv("SSE_REPLAY_FRAMES", "1024"))
+SSE_RESUME_GRACE = float(os.getenv("SSE_RESUME_GRACE", "15"))
+SSE_STREAM_TTL = float(os.getenv("SSE_STREAM_TTL", "120"))
+
+# WebSocket 對話通道：每個連線同時進行的回答數、待送出事件佇列長度、佇列滿時等待前端讀取的秒數（逾時即斷線）
+WS_MAX_INFLIGHT = int(os.getenv("WS_MAX_INFLIGHT", "4"))
+WS_SEND_QUEUE = int(os.getenv("WS_SEND_QUEUE", "256"))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "30"))
+
+# 回應大於此大小（bytes）時以 gzip 壓縮（答案串流不壓縮）
+GZIP_MINIMUM_SIZE = int(os.getenv("GZIP_MINIMUM_SIZE", "1024"))
@@ -5,6 +5,12 @@ Entry point for the CKD Chatbot backend API
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from api import auth, chat, profile, admin, doctor_auth
+from services.request_coalescer import stream_coalescer
+from services.scheduler import scheduler
+from services.session_titler import session_titler
+from services.sse import sse_streams
+from utils.http_cache import SelectiveGZipMiddleware
+from config import GZIP_MINIMUM_SIZE
 
 # Create FastAPI app
 app = FastAPI(
@@ -31,6 +37,14 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Stream-ID", "ETag"],
+)
+
+# Compress larger JSON responses; answer streams stay uncompressed so frames aren't buffered
+app.add_middleware(
+    SelectiveGZipMiddleware,
+    minimum_size=GZIP_MINIMUM_SIZE,
+    exclude_paths=("/api/chat/message/stream", "/api/chat/stream/")
 )
 
 # Register API routers
@@ -41,6 +55,24 @@ app.include_router(admin.router)
 app.include_router(doctor_auth.router)
 
 
+@app.on_event("startup")
+async def warm_up_llms():
+    """Load both Ollama models before the first request arrives"""
+    await chat.backend_logic.warm_up_models()
+
+
+@app.on_event("shutdown")
+async def close_graph_driver():
+    """Close the shared async Neo4j driver and its connection pool"""
+    await chat.backend_logic.async_graph.close()
+
+
+@app.on_event("shutdown")
+def flush_translation_cache():
+    """Persist in-memory question translations so they survive a restart"""
+    chat.backend_logic.translation_cache.flush()
+
+
 @app.get("/")
 async def root():
     """API root endpoint"""
@@ -54,7 +86,21 @@ async def root():
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy"}
+    return {
+        "status": "healthy",
+        "llm": chat.backend_logic.llm_health(),
+        "cancellation": chat.backend_logic.cancellation_stats,
+        "timeouts": chat.backend_logic.timeout_stats,
+        "breakers": chat.backend_logic.breaker_health(),
+        "faq": chat.backend_logic.faq_store.stats(),
+        "cypher": chat.backend_logic.guard_stats(),
+        "plan_cache": chat.backend_logic.plan_cache_stats.snapshot(),
+        "translation": chat.backend_logic.translation_cache.stats(),
+        "coalescer": stream_coalescer.stats(),
+        "scheduler": scheduler.stats(),
+        "titler": session_titler.stats(),
+        "sse": sse_streams.stats()
+    }
 
 
 if __name__ == "__main__":
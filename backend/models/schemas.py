@@ -48,6 +48,7 @@ class ChatSession(BaseModel):
     updated_at: datetime
     doctor: Optional[str] = None  # 新增: 記錄醫師名稱
     user_id: Optional[str] = None  # 新增: 記錄病患ID
+    version: int = 0  # 每次修改遞增，用於 ETag
 
 
 class CreateSessionRequest(BaseModel):
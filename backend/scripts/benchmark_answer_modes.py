@@ -0,0 +1,132 @@
+"""
+回答模式效能 / 品質比較腳本
+以相同問題分別執行 refine / direct / structured 等回答模式，比較首字延遲（TTFT）、總耗時與 LLM 耗時，
+並以簡單指標（大綱點數、詳細說明長度、與 refine 回答的字元雙字組相似度）粗略比較回答品質
+
+用法：
+    python benchmark_answer_modes.py --rounds 2 --modes refine structured --output results.jsonl
+"""
+import argparse
+import asyncio
+import json
+import sys
+import os
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from core_logic import query_graph_two_stage_stream, llm_pool
+
+QUESTIONS = [
+    "慢性腎臟病患者飲食要注意什麼？",
+    "eGFR 是什麼意思？",
+    "腎功能檢查有哪些項目？",
+    "洗腎的方式有哪些？",
+    "腎臟病患者每天蛋白質要吃多少？",
+]
+
+ANSWER_MODES = ("refine", "direct", "structured")
+
+
+def llm_seconds():
+    """目前所有模型累計的呼叫耗時"""
+    return sum(stats.total_seconds for stats in llm_pool.stats.values())
+
+
+def llm_calls():
+    """目前所有模型累計的呼叫次數"""
+    return sum(stats.calls for stats in llm_pool.stats.values())
+
+
+def outline_points(outline):
+    """大綱的列點數（非空白行）"""
+    return len([line for line in outline.splitlines() if line.strip()])
+
+
+def bigram_similarity(a, b):
+    """兩段文字的字元雙字組 Dice 相似度，作為與基準回答內容重疊程度的粗略指標"""
+    def bigrams(text):
+        text = "".join(text.split())
+        return {text[i:i + 2] for i in range(len(text) - 1)}
+    grams_a, grams_b = bigrams(a), bigrams(b)
+    if not grams_a or not grams_b:
+        return 0.0
+    return 2 * len(grams_a & grams_b) / (len(grams_a) + len(grams_b))
+
+
+async def run_once(question, answer_mode):
+    start = time.perf_counter()
+    llm_before = llm_seconds()
+    calls_before = llm_calls()
+    first_token = None
+    outline = detail = ""
+    async for event in query_graph_two_stage_stream(question, answer_mode=answer_mode):
+        if event["type"] in ("detail_chunk", "outline_chunk") and first_token is None:
+            first_token = time.perf_counter() - start
+        if event["type"] == "done":
+            outline, detail = event["outline"], event["detail"]
+        if event["type"] == "error":
+            print(f"  [錯誤] {event['content']}")
+    total = time.perf_counter() - start
+    return {
+        "question": question,
+        "mode": answer_mode,
+        "ttft": first_token or total,
+        "total": total,
+        "llm_seconds": llm_seconds() - llm_before,
+        "llm_calls": llm_calls() - calls_before,
+        "outline": outline,
+        "detail": detail,
+        "outline_points": outline_points(outline),
+        "detail_length": len(detail),
+    }
+
+
+async def main(rounds, modes, output):
+    await llm_pool.warm_up()
+    samples = {answer_mode: [] for answer_mode in modes}
+    baseline = {}
+    for _ in range(rounds):
+        for question in QUESTIONS:
+            for answer_mode in modes:
+                sample = await run_once(question, answer_mode)
+                if answer_mode == "refine":
+                    baseline[question] = sample["detail"]
+                if question in baseline:
+                    sample["similarity"] = bigram_similarity(sample["detail"], baseline[question])
+                samples[answer_mode].append(sample)
+                print(f"  [{answer_mode:<10}] TTFT {sample['ttft']:6.2f}s  總計 {sample['total']:6.2f}s  "
+                      f"LLM {sample['llm_seconds']:6.2f}s  {question}")
+                if output:
+                    with open(output, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(sample, ensure_ascii=False) + "\n")
+
+    print("\n" + "=" * 96)
+    print(f"{'模式':<12}{'平均 TTFT':>10}{'平均總計':>10}{'LLM 秒數':>10}{'LLM 呼叫':>10}"
+          f"{'大綱點數':>10}{'詳細長度':>10}{'相似度':>10}")
+    for answer_mode, rows in samples.items():
+        count = len(rows)
+
+        def average(key):
+            values = [row[key] for row in rows if key in row]
+            return sum(values) / len(values) if values else float("nan")
+
+        print(f"{answer_mode:<12}{average('ttft'):>9.2f}s{average('total'):>9.2f}s"
+              f"{average('llm_seconds'):>9.2f}s{average('llm_calls'):>10.1f}"
+              f"{average('outline_points'):>10.1f}{average('detail_length'):>10.0f}"
+              f"{average('similarity'):>10.2f}  (n={count})")
+    print("=" * 96)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="回答模式效能 / 品質比較")
+    parser.add_argument("--rounds", type=int, default=1, help="每個問題重複執行的次數")
+    parser.add_argument("--modes", nargs="+", choices=ANSWER_MODES, default=list(ANSWER_MODES),
+                        help="要比較的回答模式（相似度以 refine 為基準）")
+    parser.add_argument("--output", help="將每次執行結果以 JSONL 附加寫入此檔案")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("回答模式效能 / 品質比較")
+    print("=" * 60)
+    asyncio.run(main(args.rounds, args.modes, args.output))
@@ -0,0 +1,101 @@
+"""
+提示詞前綴重用效能比較腳本
+比較舊版「每個階段各自帶完整指示的單一提示詞」與新版「固定 system 訊息 + 變動 human 訊息」
+兩種送法下，Ollama 回報的 prompt 處理 token 數（prompt_eval_count）與處理時間（prompt_eval_duration）。
+詳細回答與大綱兩個階段交替呼叫，模擬實際請求流程；命中 KV cache 的前綴不會被重新處理
+
+用法：
+    python benchmark_prompt_prefix.py [rounds]
+"""
+import asyncio
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from langchain_core.messages import HumanMessage
+from core_logic import llm_chinese, llm_pool, chat_messages, DETAIL_TEMPLATE, OUTLINE_TEMPLATE
+
+# 改版前的提示詞：指示文字與各階段內容混在同一段，且詳細回答 / 大綱的開頭不同
+LEGACY_DETAIL_TEMPLATE = """你是一位腎臟健康衛教醫生，請根據下方系統提供的腎臟衛教回應進行整合，僅能根據提供的資訊回答：
+- 不可自我介紹（如「作為醫生...」等開場白）。
+- 不可要求使用者提供更多資訊。
+- 不可給出與 context 無關的泛泛建議。
+- 若資訊不足，請根據現有資訊盡量給出有幫助的建議，或簡要歸納 context 內容。
+- 若 context 完全無法回答，才簡短說明目前無法提供具體建議。
+請保持專業性以及語句清楚明瞭，務必使用繁體中文作答。
+
+提供的資訊：
+{firstResult}
+
+使用者問題：{question}
+有幫助的回答："""
+
+LEGACY_OUTLINE_TEMPLATE = """你是一位腎臟健康衛教醫生，請將系統提供的腎臟衛教回應，濃縮成簡短、易懂的大綱列點（3點以內），每點不超過15字，避免冗長解釋。請勿重複問題。請務必使用繁體中文作答。
+
+提供的資訊：
+{firstResult}
+
+使用者問題：{question}
+大綱列點：
+"""
+
+SAMPLES = [
+    ("慢性腎臟病患者飲食要注意什麼？",
+     "- 低鹽飲食：建議：每日鈉攝取量控制在 2000 毫克以下\n- 蛋白質攝取：建議：依腎功能分期調整，避免過量"),
+    ("eGFR 是什麼意思？",
+     "- eGFR：估算腎絲球過濾率，用來評估腎臟功能；影響：數值越低代表腎功能越差"),
+    ("洗腎的方式有哪些？",
+     "- 血液透析：每週約三次至醫院透析\n- 腹膜透析：可在家中進行，利用腹膜過濾"),
+]
+
+
+def legacy_messages(template, context, question):
+    return [HumanMessage(content=template.format(firstResult=context, question=question))]
+
+
+def prefix_messages(template, context, question):
+    return chat_messages(template.format(firstResult=context, question=question))
+
+
+LAYOUTS = {
+    "legacy": (legacy_messages, LEGACY_DETAIL_TEMPLATE, LEGACY_OUTLINE_TEMPLATE),
+    "prefix": (prefix_messages, DETAIL_TEMPLATE, OUTLINE_TEMPLATE),
+}
+
+
+async def measure(messages):
+    """只生成少量 token，回傳 (prompt_eval_count, prompt_eval 秒數)"""
+    response = await llm_chinese.bind(num_predict=8).ainvoke(messages)
+    metadata = response.response_metadata or {}
+    return metadata.get("prompt_eval_count") or 0, (metadata.get("prompt_eval_duration") or 0) / 1e9
+
+
+async def main(rounds):
+    await llm_pool.warm_up()
+    results = {}
+    for layout, (build, detail_template, outline_template) in LAYOUTS.items():
+        print(f"\n送法: {layout}")
+        print("-" * 60)
+        samples = []
+        for _ in range(rounds):
+            for question, context in SAMPLES:
+                for stage, template in (("detail", detail_template), ("outline", outline_template)):
+                    tokens, seconds = await measure(build(template, context, question))
+                    samples.append((tokens, seconds))
+                    print(f"  {stage:<8} prompt_eval {tokens:5d} tokens  {seconds * 1000:8.1f} ms  {question}")
+        count = len(samples)
+        results[layout] = [sum(values) / count for values in zip(*samples)]
+
+    print("\n" + "=" * 60)
+    print(f"{'送法':<10}{'平均處理 tokens':>18}{'平均處理時間':>18}")
+    for layout, (tokens, seconds) in results.items():
+        print(f"{layout:<10}{tokens:>18.1f}{seconds * 1000:>16.1f}ms")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("提示詞前綴重用效能比較")
+    print("=" * 60)
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 3))
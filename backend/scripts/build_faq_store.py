@@ -0,0 +1,137 @@
+"""
+常見問題回答庫建置腳本
+從 questions_log.jsonl 找出高頻問題群組，逐一跑完整查詢流程，檢核通過的大綱 / 詳細回答寫入新版本回答庫。
+線上服務會在檔案替換後自動載入新版本。
+
+知識圖譜更新後需要重建，可用 --if-graph-changed 排程執行（圖譜指紋與回答庫相同時直接結束）：
+    0 3 * * * cd /path/to/CKD_chatbot/backend && ../venv/bin/python scripts/build_faq_store.py --if-graph-changed
+
+用法：
+    python build_faq_store.py [--top 20] [--min-count 3] [--dry-run]
+"""
+import argparse
+import asyncio
+import json
+import sys
+import os
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.abspath(os.path.join(BACKEND_DIR, '..')))
+
+from config import FAQ_STORE_FILE
+from core_logic import connectNeo4j, query_graph_two_stage_stream, llm_pool
+from faq_store import cluster_questions, graph_fingerprint, read_header, write_store
+from kidney_relevance import classify_question
+from patient_context import mentioned_stage
+
+# 出現這些字句的回答代表查詢或生成失敗，不收錄
+FAILURE_PHRASES = [
+    "目前找不到相關資訊",
+    "系統發生錯誤",
+    "系統無法處理",
+    "資料庫連結異常",
+    "無法提供具體建議",
+    "模型服務忙碌中",
+]
+MIN_DETAIL_LENGTH = 40
+
+
+def load_questions(log_file):
+    questions = []
+    if not os.path.exists(log_file):
+        return questions
+    with open(log_file, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                questions.append(json.loads(line)["question"])
+            except (ValueError, KeyError):
+                continue
+    return questions
+
+
+def vet_answer(done):
+    """檢核回答，回傳不收錄的原因（空字串代表通過）"""
+    if done is None:
+        return "流程未完成"
+    if done.get("degraded"):
+        return f"回答經過降級: {', '.join(done['degraded'])}"
+    outline, detail = done.get("outline", "").strip(), done.get("detail", "").strip()
+    if not outline or not detail:
+        return "大綱或詳細回答為空"
+    if len(detail) < MIN_DETAIL_LENGTH:
+        return "詳細回答過短"
+    for phrase in FAILURE_PHRASES:
+        if phrase in outline or phrase in detail:
+            return f"包含失敗訊息「{phrase}」"
+    return ""
+
+
+async def answer_question(question):
+    """以完整流程（refine 模式、不查回答庫）產生回答，回傳 done 事件"""
+    done = None
+    async for event in query_graph_two_stage_stream(question, answer_mode="refine", use_faq_store=False):
+        if event["type"] == "error":
+            print(f"  [錯誤] {event['content']}")
+            return None
+        if event["type"] == "done":
+            done = event
+    return done
+
+
+async def main(args):
+    graph = connectNeo4j()
+    if graph is None:
+        print("無法連線到 Neo4j，停止建置")
+        return 1
+    fingerprint = graph_fingerprint(graph)
+    previous = read_header(args.output)
+
+    if args.if_graph_changed and previous and previous["graph_fingerprint"] == fingerprint:
+        print(f"知識圖譜未變動，沿用回答庫版本 {previous['version']}")
+        return 0
+
+    clusters = [
+        cluster for cluster in cluster_questions(load_questions(args.log))
+        if cluster["count"] >= args.min_count and classify_question(cluster["question"]).is_related
+    ][:args.top]
+    print(f"共 {len(clusters)} 個高頻問題群組")
+
+    await llm_pool.warm_up()
+    entries = []
+    for cluster in clusters:
+        print(f"\n[{cluster['count']:>4} 次] {cluster['question']}（{len(cluster['variants'])} 種問法）")
+        done = await answer_question(cluster["question"])
+        reason = vet_answer(done)
+        if reason:
+            print(f"  不收錄：{reason}")
+            continue
+        print(f"  大綱：{done['outline'][:60]}")
+        entries.append({
+            "question": cluster["question"],
+            "variants": cluster["variants"],
+            "count": cluster["count"],
+            "outline": done["outline"].strip(),
+            "detail": done["detail"].strip(),
+            # 問題針對特定分期時標記，已設定分期的病人只會命中同一分期的回答
+            "ckd_stage": mentioned_stage(cluster["question"]),
+        })
+
+    if args.dry_run:
+        print(f"\n[dry-run] 通過檢核 {len(entries)} 題，未寫入檔案")
+        return 0
+
+    version = (previous["version"] + 1) if previous else 1
+    write_store(args.output, entries, fingerprint, version)
+    print(f"\n回答庫版本 {version} 已寫入 {args.output}（{len(entries)} 題）")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="建置常見問題回答庫")
+    parser.add_argument("--log", default=os.path.join(BACKEND_DIR, "questions_log.jsonl"), help="問題紀錄檔")
+    parser.add_argument("--output", default=os.path.join(BACKEND_DIR, FAQ_STORE_FILE), help="回答庫輸出路徑")
+    parser.add_argument("--top", type=int, default=20, help="最多收錄的問題群組數")
+    parser.add_argument("--min-count", type=int, default=3, help="群組至少出現的次數")
+    parser.add_argument("--if-graph-changed", action="store_true", help="知識圖譜未變動時不重建")
+    parser.add_argument("--dry-run", action="store_true", help="只顯示檢核結果，不寫入檔案")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,109 @@
+"""
+Request coalescing (single-flight) for identical in-flight questions
+Concurrent requests with the same normalized question share one pipeline run,
+and its events are fanned out to every subscriber
+"""
+import asyncio
+import re
+import unicodedata
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+
+def normalize_question(question: str) -> str:
+    """Normalize question text so trivially different duplicates share a key"""
+    text = unicodedata.normalize("NFKC", question or "").lower()
+    text = re.sub(r"\s+", "", text)
+    return text.rstrip("?？!！。.,，~～")
+
+
+class _Flight:
+    """One in-flight pipeline run and the events it has produced so far"""
+
+    def __init__(self):
+        self.events: List[dict] = []
+        self.done = False
+        self.subscribers = 0
+        self.condition = asyncio.Condition()
+        self.task: asyncio.Task = None
+
+
+class StreamCoalescer:
+    """Share one upstream event stream between concurrent identical requests"""
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self.runs = 0
+        self.coalesced = 0
+
+    async def _produce(self, key: str, flight: _Flight, factory: Callable[[], AsyncIterator[dict]]):
+        try:
+            async for event in factory():
+                async with flight.condition:
+                    flight.events.append(event)
+                    flight.condition.notify_all()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            async with flight.condition:
+                flight.events.append({"type": "error", "content": f"系統發生錯誤：{str(e)}"})
+        finally:
+            # Late arrivals after this point start a fresh run
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            flight.done = True
+            async with flight.condition:
+                flight.condition.notify_all()
+
+    def is_in_flight(self, question: str) -> bool:
+        return normalize_question(question) in self._flights
+
+    async def subscribe(self, question: str, factory: Callable[[], AsyncIterator[dict]],
+                        on_join: Optional[Callable[[], None]] = None) -> AsyncIterator[dict]:
+        """
+        Yield the events for `question`, joining an identical in-flight run if there is one.
+        Subscribers that join late first receive the events already produced.
+        `on_join` is called when the factory is not used because an existing run was joined.
+        """
+        key = normalize_question(question)
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight()
+            self._flights[key] = flight
+            flight.task = asyncio.create_task(self._produce(key, flight, factory))
+            self.runs += 1
+        else:
+            self.coalesced += 1
+            if on_join:
+                on_join()
+
+        flight.subscribers += 1
+        index = 0
+        try:
+            while True:
+                async with flight.condition:
+                    await flight.condition.wait_for(lambda: index < len(flight.events) or flight.done)
+                    batch = flight.events[index:]
+                    finished = flight.done
+                index += len(batch)
+                for event in batch:
+                    yield event
+                if finished and index >= len(flight.events):
+                    break
+        finally:
+            flight.subscribers -= 1
+            # Nobody is listening any more: stop the upstream work
+            if flight.subscribers == 0 and not flight.done and flight.task:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._flights),
+            "runs": self.runs,
+            "coalesced": self.coalesced,
+        }
+
+
+# Global coalescer instance
+stream_coalescer = StreamCoalescer()
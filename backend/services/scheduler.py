@@ -0,0 +1,209 @@
+"""
+Admission control and fair-share scheduling for LLM-bound chat requests
+Limits how many pipelines run concurrently, queues the rest with round-robin
+fairness across doctors and their patients, and sheds load when the queue is full
+"""
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Optional
+
+from config import SCHEDULER_MAX_CONCURRENCY, SCHEDULER_MAX_QUEUE, SCHEDULER_MAX_PER_USER
+
+
+class SchedulerOverloaded(Exception):
+    """Raised when a request cannot be admitted; carries a Retry-After hint in seconds"""
+
+    def __init__(self, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class Ticket:
+    """A request's place in the scheduler; granted once it holds a pipeline slot"""
+
+    def __init__(self, scheduler: "FairScheduler", user_id: str, doctor: str):
+        self.scheduler = scheduler
+        self.user_id = user_id or "anonymous"
+        self.doctor = doctor or "anonymous"
+        self.granted = False
+        self.released = False
+        self.granted_at: Optional[float] = None
+        self.enqueued_at = time.monotonic()
+        self._changed = asyncio.Event()
+
+    def position(self) -> int:
+        """1-based position in the queue (0 once granted)"""
+        return 0 if self.granted else self.scheduler.position_of(self)
+
+    async def wait(self) -> AsyncIterator[int]:
+        """Yield the queue position whenever it changes, returning once a slot is granted"""
+        last = None
+        while not self.granted:
+            # Clear before reading the position: a grant that arrives while the consumer is
+            # suspended at the yield below sets the event again, so the wait returns at once
+            self._changed.clear()
+            position = self.position()
+            if position != last:
+                last = position
+                yield position
+            await self._changed.wait()
+
+    async def acquire(self):
+        """Wait for a slot without reporting queue positions"""
+        async for _ in self.wait():
+            pass
+
+    def release(self):
+        """Give up the slot (or the queue place); safe to call more than once"""
+        if not self.released:
+            self.released = True
+            self.scheduler._release(self)
+
+    async def __aenter__(self):
+        try:
+            await self.acquire()
+        except BaseException:
+            # Cancelled (e.g. client disconnected) while still queued
+            self.release()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class FairScheduler:
+    """Bounded work queue served round-robin by doctor, then by patient"""
+
+    def __init__(self, max_concurrency: int = SCHEDULER_MAX_CONCURRENCY,
+                 max_queue: int = SCHEDULER_MAX_QUEUE, max_per_user: int = SCHEDULER_MAX_PER_USER):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self.running = 0
+        self.admitted = 0
+        self.shed = 0
+        # doctor -> user -> deque[Ticket]
+        self._queues: "OrderedDict[str, OrderedDict[str, deque]]" = OrderedDict()
+        self._per_user = {}
+        # Grant sequence number of the last slot given to each doctor / user
+        self._served_doctor = {}
+        self._served_user = {}
+        self._grants = 0
+        self._avg_service_time = 10.0
+
+    @property
+    def queued(self) -> int:
+        return sum(len(q) for users in self._queues.values() for q in users.values())
+
+    def admit(self, user_id: str, doctor: str) -> Ticket:
+        """Admit a request or raise SchedulerOverloaded; a granted ticket must be released"""
+        ticket = Ticket(self, user_id, doctor)
+        if self._per_user.get(ticket.user_id, 0) >= self.max_per_user:
+            self.shed += 1
+            raise SchedulerOverloaded(self._retry_after(1), "Too many concurrent requests for this user")
+        if self.running >= self.max_concurrency and self.queued >= self.max_queue:
+            self.shed += 1
+            raise SchedulerOverloaded(self._retry_after(self.queued), "Server is busy")
+
+        self.admitted += 1
+        self._per_user[ticket.user_id] = self._per_user.get(ticket.user_id, 0) + 1
+        self._queues.setdefault(ticket.doctor, OrderedDict()).setdefault(ticket.user_id, deque()).append(ticket)
+        self._dispatch()
+        return ticket
+
+    def _retry_after(self, waiting: int) -> int:
+        return max(1, math.ceil((waiting + 1) / self.max_concurrency * self._avg_service_time))
+
+    @staticmethod
+    def _pick(queues, served_doctor, served_user):
+        """Choose the least recently served doctor, then that doctor's least recently served patient"""
+        doctor = min(queues, key=lambda d: served_doctor.get(d, -1))
+        users = queues[doctor]
+        user_id = min(users, key=lambda u: served_user.get(u, -1))
+        return doctor, user_id
+
+    def _grant_order(self):
+        """Order in which currently queued tickets would be granted"""
+        queues = OrderedDict(
+            (doctor, OrderedDict((user, deque(q)) for user, q in users.items()))
+            for doctor, users in self._queues.items()
+        )
+        served_doctor = dict(self._served_doctor)
+        served_user = dict(self._served_user)
+        grants = self._grants
+        while queues:
+            doctor, user_id = self._pick(queues, served_doctor, served_user)
+            grants += 1
+            served_doctor[doctor] = served_user[user_id] = grants
+            users = queues[doctor]
+            yield users[user_id].popleft()
+            if not users[user_id]:
+                del users[user_id]
+            if not users:
+                del queues[doctor]
+
+    def position_of(self, ticket: Ticket) -> int:
+        for index, queued in enumerate(self._grant_order(), start=1):
+            if queued is ticket:
+                return index
+        return 0
+
+    def _notify_waiting(self):
+        for users in self._queues.values():
+            for queue in users.values():
+                for waiting in queue:
+                    waiting._changed.set()
+
+    def _dispatch(self):
+        while self.running < self.max_concurrency and self._queues:
+            doctor, user_id = self._pick(self._queues, self._served_doctor, self._served_user)
+            self._grants += 1
+            self._served_doctor[doctor] = self._served_user[user_id] = self._grants
+            users = self._queues[doctor]
+            ticket = users[user_id].popleft()
+            if not users[user_id]:
+                del users[user_id]
+            if not users:
+                del self._queues[doctor]
+            ticket.granted = True
+            ticket.granted_at = time.monotonic()
+            ticket._changed.set()
+            self.running += 1
+        self._notify_waiting()
+
+    def _release(self, ticket: Ticket):
+        self._per_user[ticket.user_id] -= 1
+        if not self._per_user[ticket.user_id]:
+            del self._per_user[ticket.user_id]
+        if ticket.granted:
+            self.running -= 1
+            service_time = time.monotonic() - ticket.granted_at
+            self._avg_service_time = 0.8 * self._avg_service_time + 0.2 * service_time
+        else:
+            users = self._queues.get(ticket.doctor, {})
+            queue = users.get(ticket.user_id)
+            if queue and ticket in queue:
+                queue.remove(ticket)
+                if not queue:
+                    del users[ticket.user_id]
+                if not users:
+                    self._queues.pop(ticket.doctor, None)
+        self._dispatch()
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "running": self.running,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "avg_service_time": round(self._avg_service_time, 2),
+        }
+
+
+# Global scheduler instance
+scheduler = FairScheduler()
@@ -0,0 +1,87 @@
+"""
+Session titling off the answer's critical path
+The first question gets an instant extractive title; when SESSION_TITLE_MODE is "llm",
+a background task refines it with the model after the first answer has been delivered
+"""
+import asyncio
+import re
+import unicodedata
+from typing import Awaitable, Callable, Optional, Set
+
+from config import SESSION_TITLE_MODE, SESSION_TITLE_MAX_LENGTH
+from utils.session_manager import session_manager
+
+# 開頭常見的客套 / 發語詞，不放進標題
+LEADING_FILLERS = ("請問一下", "請問", "我想請問", "我想問", "想請教", "請教", "醫生", "醫師", "你好", "您好")
+_SENTENCE_END = re.compile(r"[。？！?!\n]")
+
+
+def extractive_title(message: str, max_length: int = SESSION_TITLE_MAX_LENGTH) -> str:
+    """Title from the first sentence of the question, without greetings and trailing punctuation"""
+    text = re.sub(r"\s+", " ", unicodedata.normalize("NFKC", message or "")).strip()
+    stripped = True
+    while stripped:
+        stripped = False
+        for filler in LEADING_FILLERS:
+            if text.startswith(filler) and len(text) > len(filler):
+                text = text[len(filler):].lstrip(" ,，、:：")
+                stripped = True
+    first_sentence = _SENTENCE_END.split(text, 1)[0].strip() or text
+    title = first_sentence.rstrip("?？!！。.,，~～ ")
+    if len(title) > max_length:
+        title = title[:max_length] + "..."
+    return title or "新對話"
+
+
+class SessionTitler:
+    """Names new sessions instantly and optionally refines the name in the background"""
+
+    def __init__(self, mode: str = SESSION_TITLE_MODE):
+        self.mode = mode
+        self.refined = 0
+        self.failed = 0
+        self._tasks: Set[asyncio.Task] = set()
+
+    def name_new_session(self, session) -> Optional[str]:
+        """Give a session its extractive title on its first message; returns the title, or None if not applicable"""
+        if session.name is not None or len(session.history) != 1:
+            return None
+        title = extractive_title(session.history[0]["content"])
+        session_manager.update_session_name(session.id, title)
+        return title
+
+    def refine_later(self, session_id: str, message: str, generate: Callable[[str], Awaitable[str]]):
+        """Schedule a model-generated title once the first answer is out (llm mode only)"""
+        if self.mode != "llm":
+            return
+        task = asyncio.ensure_future(self._refine(session_id, message, generate))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _refine(self, session_id: str, message: str, generate: Callable[[str], Awaitable[str]]):
+        extracted = extractive_title(message)
+        try:
+            title = (await generate(message)).strip().strip('"\'「」“”')
+        except Exception as e:
+            self.failed += 1
+            print(f"Background titling failed: {e}")
+            return
+        if not title:
+            return
+        session = session_manager.get_session(session_id)
+        # Keep a name the user has changed in the meantime
+        if session is None or session.name != extracted:
+            return
+        session_manager.update_session_name(session_id, title[:SESSION_TITLE_MAX_LENGTH])
+        self.refined += 1
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "pending": len(self._tasks),
+            "refined": self.refined,
+            "failed": self.failed,
+        }
+
+
+session_titler = SessionTitler()
@@ -0,0 +1,234 @@
+"""
+Server-Sent Events transport for chat answers
+Token chunks are coalesced into frames over a short time / size window and encoded once;
+every frame gets an id and is kept in a per-stream replay buffer, so a client that reconnects
+with Last-Event-ID resumes where it left off. Idle streams (e.g. waiting in the scheduler queue)
+send heartbeat comments so proxies don't drop them
+"""
+import asyncio
+import time
+import uuid
+from collections import deque
+from itertools import islice
+from typing import AsyncIterator, Deque, Dict, Optional, Tuple
+
+try:
+    import orjson
+
+    def dumps_event(event: dict) -> bytes:
+        return orjson.dumps(event)
+except ImportError:
+    import json
+
+    def dumps_event(event: dict) -> bytes:
+        return json.dumps(event, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+from config import (
+    SSE_COALESCE_INTERVAL, SSE_COALESCE_MAX_CHARS, SSE_HEARTBEAT_INTERVAL,
+    SSE_REPLAY_FRAMES, SSE_RESUME_GRACE, SSE_STREAM_TTL
+)
+
+HEARTBEAT = b": ping\n\n"
+CHUNK_TYPES = ("outline_chunk", "detail_chunk")
+
+
+def encode_frame(event: dict, event_id: Optional[int] = None) -> bytes:
+    """Encode one event as an SSE frame"""
+    prefix = f"id: {event_id}\n".encode() if event_id is not None else b""
+    return prefix + b"data: " + dumps_event(event) + b"\n\n"
+
+
+async def coalesce_chunks(events: AsyncIterator[dict], interval: float = SSE_COALESCE_INTERVAL,
+                          max_chars: int = SSE_COALESCE_MAX_CHARS) -> AsyncIterator[dict]:
+    """
+    Merge consecutive chunks of the same type until the window closes, the merged chunk is large
+    enough or a non-chunk event arrives; a stalled model still gets its pending text flushed on time
+    """
+    iterator = events.__aiter__()
+    pending: Optional[dict] = None
+    window_ends = 0.0
+    next_event: Optional[asyncio.Future] = None
+    try:
+        while True:
+            try:
+                if pending is None:
+                    event = await iterator.__anext__()
+                else:
+                    # Wait for the next event only until the window closes, without cancelling the read
+                    next_event = asyncio.ensure_future(iterator.__anext__())
+                    await asyncio.wait({next_event}, timeout=max(window_ends - time.monotonic(), 0))
+                    if not next_event.done():
+                        yield pending
+                        pending = None
+                    event = await next_event
+                    next_event = None
+            except StopAsyncIteration:
+                break
+            if event.get("type") in CHUNK_TYPES:
+                if pending is not None and pending["type"] == event["type"]:
+                    pending["content"] += event["content"]
+                else:
+                    if pending is not None:
+                        yield pending
+                    pending = dict(event)
+                    window_ends = time.monotonic() + interval
+                if len(pending["content"]) >= max_chars:
+                    yield pending
+                    pending = None
+                continue
+            if pending is not None:
+                yield pending
+                pending = None
+            yield event
+        if pending is not None:
+            yield pending
+    finally:
+        if next_event is not None and not next_event.done():
+            next_event.cancel()
+            try:
+                await next_event
+            except BaseException:
+                pass
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+class SSEStream:
+    """One answer's frames, produced independently of the client connections reading it"""
+
+    def __init__(self, events: AsyncIterator[dict], interval: float = SSE_COALESCE_INTERVAL,
+                 max_chars: int = SSE_COALESCE_MAX_CHARS, max_frames: int = SSE_REPLAY_FRAMES):
+        self.id = uuid.uuid4().hex
+        self.done = False
+        self.finished_at: Optional[float] = None
+        self.listeners = 0
+        self.frames_sent = 0
+        self.events_in = 0
+        self._interval = interval
+        self._max_chars = max_chars
+        self._frames: Deque[Tuple[int, bytes]] = deque(maxlen=max_frames)
+        self._next_id = 1
+        self._changed = asyncio.Condition()
+        self._cancel_handle: Optional[asyncio.TimerHandle] = None
+        self._task = asyncio.ensure_future(self._produce(events))
+
+    async def _append(self, event: dict):
+        async with self._changed:
+            self._frames.append((self._next_id, encode_frame(event, self._next_id)))
+            self._next_id += 1
+            self.frames_sent += 1
+            self._changed.notify_all()
+
+    async def _produce(self, events: AsyncIterator[dict]):
+        async def counted():
+            try:
+                async for event in events:
+                    self.events_in += 1
+                    yield event
+            finally:
+                await events.aclose()
+
+        coalesced = coalesce_chunks(counted(), self._interval, self._max_chars)
+        try:
+            async for event in coalesced:
+                await self._append(event)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self._append({"type": "error", "content": f"系統發生錯誤：{str(e)}"})
+        finally:
+            await coalesced.aclose()
+            self.done = True
+            self.finished_at = time.monotonic()
+            async with self._changed:
+                self._changed.notify_all()
+
+    def _frames_after(self, last_id: int):
+        """Buffered frames newer than last_id (ids are consecutive, so slice instead of scanning)"""
+        if not self._frames:
+            return []
+        start = max(last_id - self._frames[0][0] + 1, 0)
+        return list(islice(self._frames, start, None))
+
+    async def read(self, last_event_id: int = 0) -> AsyncIterator[bytes]:
+        """Frames after last_event_id (replayed from the buffer, then live), with heartbeats while idle"""
+        self.listeners += 1
+        if self._cancel_handle is not None:
+            self._cancel_handle.cancel()
+            self._cancel_handle = None
+        last_id = last_event_id
+        try:
+            while True:
+                frames = self._frames_after(last_id)
+                for frame_id, frame in frames:
+                    last_id = frame_id
+                    yield frame
+                if frames:
+                    continue
+                if self.done:
+                    return
+                idle = False
+                async with self._changed:
+                    if not self._frames_after(last_id) and not self.done:
+                        try:
+                            await asyncio.wait_for(self._changed.wait(), SSE_HEARTBEAT_INTERVAL)
+                        except asyncio.TimeoutError:
+                            idle = True
+                if idle:
+                    yield HEARTBEAT
+        finally:
+            self.listeners -= 1
+            if self.listeners == 0 and not self.done:
+                # Give the client a moment to reconnect before cancelling the answer
+                self.cancel_later()
+
+    def cancel_later(self):
+        """Cancel the answer after SSE_RESUME_GRACE seconds unless a reader attaches first"""
+        self._cancel_handle = asyncio.get_running_loop().call_later(SSE_RESUME_GRACE, self.cancel)
+
+    def cancel(self):
+        if self.listeners == 0 and not self._task.done():
+            print(f"SSE stream {self.id} abandoned, cancelling its pipeline")
+            self._task.cancel()
+
+
+class SSEStreamRegistry:
+    """Open streams by id, kept for SSE_STREAM_TTL seconds after they finish so clients can resume"""
+
+    def __init__(self):
+        self._streams: Dict[str, SSEStream] = {}
+        self.resumed = 0
+
+    def open(self, events: AsyncIterator[dict]) -> SSEStream:
+        self._expire()
+        stream = SSEStream(events)
+        self._streams[stream.id] = stream
+        # A client that disconnects before the response body starts never reads; the first read() disarms this
+        stream.cancel_later()
+        return stream
+
+    def get(self, stream_id: str) -> Optional[SSEStream]:
+        self._expire()
+        return self._streams.get(stream_id)
+
+    def _expire(self):
+        now = time.monotonic()
+        for stream_id, stream in list(self._streams.items()):
+            if stream.done and now - stream.finished_at > SSE_STREAM_TTL:
+                del self._streams[stream_id]
+
+    def stats(self) -> dict:
+        streams = list(self._streams.values())
+        events_in = sum(s.events_in for s in streams)
+        frames = sum(s.frames_sent for s in streams)
+        return {
+            "open_streams": sum(1 for s in streams if not s.done),
+            "buffered_streams": len(streams),
+            "listeners": sum(s.listeners for s in streams),
+            "resumed": self.resumed,
+            "events_per_frame": round(events_in / frames, 2) if frames else None,
+        }
+
+
+sse_streams = SSEStreamRegistry()
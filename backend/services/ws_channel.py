@@ -0,0 +1,115 @@
+"""
+WebSocket chat channel
+One connection carries several concurrent answers (e.g. a doctor dashboard following multiple
+patients' sessions). Every outgoing event is tagged with the client's request_id; chunks are
+coalesced like the SSE transport and sent as "token" events. A bounded outbox gives backpressure:
+answers pause while the client is behind, and a client that stops reading is disconnected
+"""
+import asyncio
+from typing import AsyncIterator, Callable, Dict, Optional
+
+from config import WS_MAX_INFLIGHT, WS_SEND_QUEUE, WS_SEND_TIMEOUT
+from services.sse import CHUNK_TYPES, coalesce_chunks, dumps_event
+
+
+class ChannelClosed(Exception):
+    """The client stopped reading and the connection was closed"""
+
+
+class ChatChannel:
+    """Multiplexes answer event streams over one WebSocket connection"""
+
+    def __init__(self, websocket, max_inflight: int = WS_MAX_INFLIGHT,
+                 queue_size: int = WS_SEND_QUEUE, send_timeout: float = WS_SEND_TIMEOUT):
+        self.websocket = websocket
+        self.max_inflight = max_inflight
+        self.send_timeout = send_timeout
+        self.closed = False
+        self._outbox: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._answers: Dict[str, asyncio.Task] = {}
+        self._writer = asyncio.ensure_future(self._write())
+
+    @property
+    def full(self) -> bool:
+        return len(self._answers) >= self.max_inflight
+
+    def is_active(self, request_id: str) -> bool:
+        return request_id in self._answers
+
+    async def send(self, event: dict):
+        """Queue an event for the client; waits while the outbox is full (flow control)"""
+        if self.closed:
+            raise ChannelClosed()
+        try:
+            await asyncio.wait_for(self._outbox.put(event), self.send_timeout)
+        except asyncio.TimeoutError:
+            print("WebSocket client is not reading, closing the connection")
+            await self.close(code=1008)
+            raise ChannelClosed() from None
+
+    async def _write(self):
+        try:
+            while True:
+                event = await self._outbox.get()
+                await self.websocket.send_text(dumps_event(event).decode("utf-8"))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Connection already gone; the receive loop notices and closes the channel
+            print(f"WebSocket send failed: {e}")
+
+    def start(self, request_id: str, events: AsyncIterator[dict], on_abort: Optional[Callable[[], None]] = None, **tags):
+        """
+        Forward one answer's events, tagged with request_id and any extra fields.
+        on_abort runs if the answer is cancelled before it starts (e.g. to release its scheduler ticket)
+        """
+        started = []
+        task = asyncio.ensure_future(self._forward(request_id, events, tags, started))
+        self._answers[request_id] = task
+
+        def finished(_):
+            self._answers.pop(request_id, None)
+            if not started and on_abort is not None:
+                on_abort()
+        task.add_done_callback(finished)
+
+    async def _forward(self, request_id: str, events: AsyncIterator[dict], tags: dict, started: list):
+        started.append(True)
+        coalesced = coalesce_chunks(events)
+        try:
+            async for event in coalesced:
+                if event.get("type") in CHUNK_TYPES:
+                    event = {"type": "token", "section": event["type"][:-len("_chunk")], "content": event["content"]}
+                await self.send({**event, "request_id": request_id, **tags})
+        except (asyncio.CancelledError, ChannelClosed):
+            pass
+        except Exception as e:
+            try:
+                await self.send({"type": "error", "request_id": request_id, "content": f"系統發生錯誤：{str(e)}", **tags})
+            except ChannelClosed:
+                pass
+        finally:
+            # Closing the engine's iterator cancels the pipeline once no other subscriber is left
+            await coalesced.aclose()
+
+    def cancel(self, request_id: str) -> bool:
+        task = self._answers.get(request_id)
+        if task is None:
+            return False
+        task.cancel()
+        return True
+
+    async def close(self, code: Optional[int] = None):
+        if self.closed:
+            return
+        self.closed = True
+        current = asyncio.current_task()
+        for task in list(self._answers.values()):
+            if task is not current:
+                task.cancel()
+        self._writer.cancel()
+        if code is not None:
+            try:
+                await self.websocket.close(code=code)
+            except Exception:
+                pass
@@ -0,0 +1,63 @@
+"""
+Tests for the dependency circuit breaker
+Run from the backend directory: python -m pytest tests
+"""
+import os
+import sys
+import time
+import unittest
+
+# Backend directory first so every test shares backend/config.py; root modules (circuit_breaker) after it
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from circuit_breaker import CircuitBreaker, CLOSED, HALF_OPEN, OPEN
+
+
+def tripped_breaker() -> CircuitBreaker:
+    breaker = CircuitBreaker("test", failure_rate=0.5, min_calls=2, window=4, reset_timeout=0.05)
+    breaker.record_failure()
+    breaker.record_failure()
+    return breaker
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def test_trips_after_failure_rate(self):
+        breaker = tripped_breaker()
+        self.assertEqual(breaker.state, OPEN)
+        self.assertTrue(breaker.is_open())
+        self.assertFalse(breaker.allow())
+
+    def test_is_open_does_not_take_the_probe(self):
+        breaker = tripped_breaker()
+        time.sleep(0.06)
+        # Fast-fail checks in the half-open state leave the probe to the real call
+        self.assertFalse(breaker.is_open())
+        self.assertFalse(breaker.is_open())
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, HALF_OPEN)
+
+    def test_real_call_takes_the_probe(self):
+        breaker = tripped_breaker()
+        time.sleep(0.06)
+        self.assertFalse(breaker.is_open())
+        breaker.start_call()
+        # Other requests fast-fail while the probe is in flight
+        self.assertTrue(breaker.is_open())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertFalse(breaker.is_open())
+
+    def test_failed_probe_doubles_the_cooldown(self):
+        breaker = tripped_breaker()
+        time.sleep(0.06)
+        breaker.start_call()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, OPEN)
+        self.assertAlmostEqual(breaker.reset_timeout, 0.1)
+        self.assertTrue(breaker.is_open())
+
+
+if __name__ == "__main__":
+    unittest.main()
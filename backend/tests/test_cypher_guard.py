@@ -0,0 +1,62 @@
+"""
+Tests for the Cypher validation layer
+Run from the backend directory: python -m pytest tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from cypher_guard import CypherRejected, validate_cypher
+
+
+def checked(query: str) -> str:
+    return validate_cypher(query)[0]
+
+
+class ValidateCypherTest(unittest.TestCase):
+
+    def assertRejected(self, query: str, reason: str):
+        with self.assertRaises(CypherRejected) as raised:
+            validate_cypher(query)
+        self.assertEqual(raised.exception.reason, reason)
+
+    def test_bounds_variable_length_relationships(self):
+        self.assertEqual(checked("MATCH (a)-[r:包含*]->(b) RETURN b"),
+                         "MATCH (a)-[r:包含*1..3]->(b) RETURN b LIMIT 10")
+        self.assertEqual(checked("MATCH (a)<-[*2]-(b) RETURN b LIMIT 5"),
+                         "MATCH (a)<-[*2..2]-(b) RETURN b LIMIT 5")
+
+    def test_leaves_list_expressions_and_strings_alone(self):
+        self.assertEqual(checked("MATCH (n:Diet) RETURN [x IN n.tags | x*2] AS t LIMIT 5"),
+                         "MATCH (n:Diet) RETURN [x IN n.tags | x*2] AS t LIMIT 5")
+        self.assertEqual(checked('MATCH (a)-[:R {name: "a*b"}]->(b) RETURN b LIMIT 5'),
+                         'MATCH (a)-[:R {name: "a*b"}]->(b) RETURN b LIMIT 5')
+
+    def test_replaces_parameter_or_large_limit(self):
+        self.assertEqual(checked("MATCH (n) RETURN n LIMIT $limit"), "MATCH (n) RETURN n LIMIT 10")
+        self.assertEqual(checked("MATCH (n) RETURN n LIMIT 50"), "MATCH (n) RETURN n LIMIT 10")
+        self.assertEqual(checked("MATCH (n) RETURN n SKIP 2 LIMIT 3"), "MATCH (n) RETURN n SKIP 2 LIMIT 3")
+        self.assertEqual(checked("MATCH (n) WITH n LIMIT 100 RETURN n"),
+                         "MATCH (n) WITH n LIMIT 100 RETURN n LIMIT 10")
+
+    def test_identifiers_named_like_write_clauses_are_allowed(self):
+        checked("MATCH (n) RETURN n.set AS load, n.call LIMIT 5")
+        checked("MATCH (n) WITH n AS set RETURN set.name LIMIT 5")
+        checked("MATCH (n) RETURN {set: 1} AS m LIMIT 5")
+        checked('MATCH (n) WHERE n.name CONTAINS "create" RETURN n LIMIT 5')
+
+    def test_rejects_write_clauses(self):
+        self.assertRejected("MATCH (n) SET n.x = 1 RETURN n", "write_clause:SET")
+        self.assertRejected("MATCH (n) DETACH DELETE n", "write_clause:DETACH")
+        self.assertRejected('LOAD CSV FROM "file:///x" AS row RETURN row', "write_clause:LOAD")
+        self.assertRejected("MATCH (n) CALL { WITH n RETURN n AS m } RETURN m", "write_clause:CALL")
+
+    def test_rejects_cartesian_product(self):
+        self.assertRejected("MATCH (a:Diet), (b:Drug) RETURN a, b", "cartesian_product")
+
+
+if __name__ == "__main__":
+    unittest.main()
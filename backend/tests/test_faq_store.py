@@ -0,0 +1,66 @@
+"""
+Tests for the FAQ answer store
+Run from the backend directory: python -m pytest tests
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+# Backend directory first so every test shares backend/config.py; root modules (faq_store) after it
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from faq_store import FAQStore, cluster_questions, write_store
+
+
+class ClusterQuestionsTest(unittest.TestCase):
+
+    def assertSeparate(self, a: str, b: str):
+        clusters = cluster_questions([a, a, b])
+        self.assertEqual(len(clusters), 2, clusters)
+
+    def test_merges_trivial_variants(self):
+        clusters = cluster_questions(["透析病人一天可以喝多少水", "透析病人一天可以喝多少水呢", "透析病人 一天可以喝多少水？"])
+        self.assertEqual(len(clusters), 1)
+        self.assertEqual(clusters[0]["count"], 3)
+
+    def test_keeps_different_stages_apart(self):
+        self.assertSeparate("慢性腎臟病第三期飲食要注意什麼", "慢性腎臟病第五期飲食要注意什麼")
+
+    def test_keeps_different_foods_apart(self):
+        self.assertSeparate("透析病人一天可以喝多少水", "透析病人一天可以喝多少牛奶")
+        self.assertSeparate("腎臟病人可以吃蛋嗎", "腎臟病人可以吃蛋白質嗎")
+
+    def test_keeps_negations_apart(self):
+        self.assertSeparate("可以喝水嗎", "不可以喝水嗎")
+
+
+class FAQStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".bin")
+        os.close(handle)
+        write_store(self.path, [{
+            "question": "慢性腎臟病第三期飲食要注意什麼",
+            "variants": ["慢性腎臟病第三期飲食要注意什麼"],
+            "outline": "大綱", "detail": "詳細",
+        }], graph_fingerprint="test", version=1)
+        self.store = FAQStore(self.path)
+
+    def tearDown(self):
+        self.store._close()
+        os.remove(self.path)
+
+    def test_exact_hit_after_normalization(self):
+        answer = self.store.lookup("慢性腎臟病 第三期飲食要注意什麼？")
+        self.assertEqual(answer["detail"], "詳細")
+        self.assertEqual(answer["version"], 1)
+
+    def test_similar_question_is_not_served(self):
+        self.assertFalse(self.store.matches("慢性腎臟病第五期飲食要注意什麼"))
+        self.assertIsNone(self.store.lookup("慢性腎臟病第五期飲食要注意什麼"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+"""
+Tests for profile-aware retrieval filtering
+Run from the backend directory: python -m pytest tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+try:
+    from patient_context import PatientContext, mentioned_stage
+except ImportError:  # context_format needs langchain
+    PatientContext = None
+
+
+@unittest.skipIf(PatientContext is None, "langchain is not installed")
+class PatientContextTest(unittest.TestCase):
+
+    def patient(self, **profile) -> "PatientContext":
+        return PatientContext.from_profile({"ckd_stage": 3, **profile})
+
+    def test_allergen_does_not_match_inside_other_words(self):
+        egg = self.patient(allergies="蛋, egg")
+        self.assertFalse(egg.is_unsafe("低蛋白飲食：每日蛋白質0.8克/公斤"))
+        self.assertFalse(egg.is_unsafe("eggplant is fine"))
+        self.assertTrue(egg.is_unsafe("雞蛋：優質蛋白質來源，可多吃"))
+        self.assertTrue(egg.is_unsafe("eat two eggs daily"))
+
+    def test_caution_must_apply_to_the_allergen(self):
+        peanut = self.patient(allergies="花生")
+        self.assertTrue(peanut.is_unsafe("花生：可適量食用；避免高鉀水果"))
+        self.assertTrue(peanut.is_unsafe("避免花生；花生醬可多吃"))
+        self.assertFalse(peanut.is_unsafe("堅果類：避免花生等高磷食物"))
+        self.assertFalse(peanut.is_unsafe("花生：過敏者避免食用"))
+
+    def test_stage_matching_records_come_first(self):
+        ranked = self.patient().filter_records(["第5期需透析", "一般建議", "CKD stage 3 控制蛋白質"])
+        self.assertEqual(ranked, ["CKD stage 3 控制蛋白質", "一般建議", "第5期需透析"])
+
+    def test_key_covers_every_prompt_field(self):
+        self.assertNotEqual(self.patient(weight=55).key, self.patient(weight=70).key)
+
+    def test_faq_answers_must_match_the_stage(self):
+        patient = self.patient()
+        self.assertFalse(patient.accepts_faq({"outline": "", "detail": "", "ckd_stage": None}))
+        self.assertFalse(patient.accepts_faq({"outline": "", "detail": "", "ckd_stage": 5}))
+        self.assertTrue(patient.accepts_faq({"outline": "", "detail": "", "ckd_stage": 3}))
+
+    def test_mentioned_stage(self):
+        self.assertEqual(mentioned_stage("慢性腎臟病第三期飲食要注意什麼"), 3)
+        self.assertIsNone(mentioned_stage("第3期和第4期差在哪"))
+        self.assertIsNone(mentioned_stage("eGFR 是什麼"))
+
+
+if __name__ == "__main__":
+    unittest.main()
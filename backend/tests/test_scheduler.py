@@ -0,0 +1,105 @@
+"""
+Tests for the fair-share scheduler
+Run from the backend directory: python -m pytest tests
+"""
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services.scheduler import FairScheduler, SchedulerOverloaded
+
+
+class FairSchedulerTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_grant_during_yield_is_not_lost(self):
+        """A slot granted while the consumer is suspended at a position event still ends the wait"""
+        scheduler = FairScheduler(max_concurrency=1, max_queue=4, max_per_user=4)
+        a = scheduler.admit("patient-a", "doctor")
+        b = scheduler.admit("patient-b", "doctor")
+        self.assertTrue(a.granted)
+        self.assertFalse(b.granted)
+
+        positions = []
+
+        async def consume():
+            async for position in b.wait():
+                positions.append(position)
+                # Slow consumer: the grant happens before it asks for the next event
+                await asyncio.sleep(0.01)
+
+        consumer = asyncio.ensure_future(consume())
+        await asyncio.sleep(0)
+        a.release()
+        await asyncio.wait_for(consumer, 1)
+
+        self.assertEqual(positions, [1])
+        self.assertTrue(b.granted)
+        self.assertEqual(scheduler.running, 1)
+        b.release()
+        self.assertEqual(scheduler.running, 0)
+
+    async def test_reports_queue_position_until_granted(self):
+        scheduler = FairScheduler(max_concurrency=1, max_queue=4, max_per_user=4)
+        running = scheduler.admit("patient-a", "doctor-1")
+        first = scheduler.admit("patient-b", "doctor-2")
+        second = scheduler.admit("patient-c", "doctor-3")
+
+        positions = []
+
+        async def consume():
+            async for position in second.wait():
+                positions.append(position)
+
+        consumer = asyncio.ensure_future(consume())
+        await asyncio.sleep(0)
+        running.release()
+        await asyncio.sleep(0)
+        first.release()
+        await asyncio.wait_for(consumer, 1)
+
+        self.assertEqual(positions, [2, 1])
+        self.assertTrue(second.granted)
+
+    async def test_round_robin_between_doctors(self):
+        scheduler = FairScheduler(max_concurrency=1, max_queue=8, max_per_user=8)
+        running = scheduler.admit("patient-a", "doctor-1")
+        busy = [scheduler.admit("patient-a", "doctor-1") for _ in range(2)]
+        other = scheduler.admit("patient-b", "doctor-2")
+
+        running.release()
+        self.assertTrue(other.granted)
+        self.assertFalse(any(ticket.granted for ticket in busy))
+
+    async def test_sheds_load_when_queue_is_full(self):
+        scheduler = FairScheduler(max_concurrency=1, max_queue=1, max_per_user=4)
+        scheduler.admit("patient-a", "doctor")
+        scheduler.admit("patient-b", "doctor")
+        with self.assertRaises(SchedulerOverloaded) as raised:
+            scheduler.admit("patient-c", "doctor")
+        self.assertGreaterEqual(raised.exception.retry_after, 1)
+        self.assertEqual(scheduler.shed, 1)
+
+    async def test_cancelled_waiter_gives_up_its_place(self):
+        scheduler = FairScheduler(max_concurrency=1, max_queue=4, max_per_user=4)
+        running = scheduler.admit("patient-a", "doctor")
+        queued = scheduler.admit("patient-b", "doctor")
+
+        async def use():
+            async with queued:
+                pass
+
+        task = asyncio.ensure_future(use())
+        await asyncio.sleep(0)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertEqual(scheduler.queued, 0)
+        running.release()
+        self.assertEqual(scheduler.running, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+"""
+Tests for the resumable SSE streams
+Run from the backend directory: python -m pytest tests
+"""
+import asyncio
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services.sse import SSEStreamRegistry
+
+
+async def endless_answer():
+    while True:
+        yield {"type": "status", "content": "..."}
+        await asyncio.sleep(0.01)
+
+
+@mock.patch("services.sse.SSE_RESUME_GRACE", 0.05)
+class SSEStreamTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_stream_never_read_is_cancelled(self):
+        """A client that disconnects before the body starts iterating still cancels the pipeline"""
+        stream = SSEStreamRegistry().open(endless_answer())
+        await asyncio.sleep(0.1)
+        self.assertTrue(stream._task.cancelled())
+
+    async def test_reader_attaching_within_the_grace_keeps_the_stream(self):
+        stream = SSEStreamRegistry().open(endless_answer())
+        frames = stream.read()
+        await frames.__anext__()
+        await asyncio.sleep(0.1)
+        self.assertFalse(stream._task.done())
+        await frames.aclose()
+        await asyncio.sleep(0.1)
+        self.assertTrue(stream._task.cancelled())
+
+
+if __name__ == "__main__":
+    unittest.main()
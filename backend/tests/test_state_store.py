@@ -0,0 +1,61 @@
+"""
+Tests for the shared state store backends
+Run from the backend directory: python -m pytest tests
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.state_store import CachedStore, InMemoryStore, Namespace, SQLiteStore
+
+
+class InMemoryStoreTest(unittest.TestCase):
+
+    def test_keeps_objects_without_serializing(self):
+        sessions = Namespace(InMemoryStore(), "sessions")
+        sessions["a"] = {"history": []}
+        stored = sessions["a"]
+
+        def append(data):
+            data["history"].append({"role": "user", "content": "hi"})
+            return data
+        self.assertIs(sessions.update_item("a", append), stored)
+        self.assertEqual(sessions["a"]["history"], [{"role": "user", "content": "hi"}])
+
+    def test_none_from_update_skips_the_write(self):
+        counters = Namespace(InMemoryStore(), "counters")
+        self.assertIsNone(counters.update_item("missing", lambda value: None))
+        self.assertNotIn("missing", counters)
+
+
+class SQLiteStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+
+    def tearDown(self):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def test_round_trips_json_values(self):
+        profiles = Namespace(CachedStore(SQLiteStore(self.path)), "profiles")
+        profiles["u"] = {"name": "王小明", "ckd_stage": 3}
+        self.assertEqual(profiles["u"], {"name": "王小明", "ckd_stage": 3})
+        # Another worker sees the value through its own connection
+        other = Namespace(SQLiteStore(self.path), "profiles")
+        self.assertEqual(dict(other.items()), {"u": {"name": "王小明", "ckd_stage": 3}})
+
+    def test_update_item_applies_to_the_stored_value(self):
+        counters = Namespace(SQLiteStore(self.path), "counters")
+        for _ in range(3):
+            counters.update_item("n", lambda value: (value or 0) + 1)
+        self.assertEqual(counters["n"], 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
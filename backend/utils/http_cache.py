@@ -0,0 +1,62 @@
+"""
+HTTP caching helpers
+Version-based ETags with If-None-Match handling for polled read endpoints, and gzip
+compression for large responses (streaming answer endpoints are left uncompressed)
+"""
+import hashlib
+from typing import Iterable, Optional
+
+from fastapi import Response
+from starlette.middleware.gzip import GZipMiddleware
+
+from utils.state_store import store_epoch
+
+
+def make_etag(*parts) -> str:
+    """
+    Weak ETag from version counters (weak: the same data may be sent gzipped or not);
+    hashed so non-ASCII ids such as patient names stay valid header values
+    """
+    key = "-".join(str(part) for part in (store_epoch(),) + parts)
+    return 'W/"' + hashlib.sha1(key.encode("utf-8")).hexdigest()[:20] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """True if the If-None-Match header lists this ETag (weak comparison) or is "*" """
+    if not if_none_match:
+        return False
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if (candidate[2:] if candidate.startswith("W/") else candidate) == opaque:
+            return True
+    return False
+
+
+def not_modified(if_none_match: Optional[str], etag: str, response: Response) -> Optional[Response]:
+    """
+    Return a 304 response when the client already has this version; otherwise set the ETag
+    (with Cache-Control: no-cache so browsers revalidate on every poll) and return None
+    """
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
+class SelectiveGZipMiddleware:
+    """GZip responses above minimum_size, except excluded paths (compression would buffer SSE frames)"""
+
+    def __init__(self, app, minimum_size: int = 1024, exclude_paths: Iterable[str] = ()):
+        self.app = app
+        self.gzip = GZipMiddleware(app, minimum_size=minimum_size)
+        self.exclude_paths = tuple(exclude_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and not scope["path"].startswith(self.exclude_paths):
+            await self.gzip(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
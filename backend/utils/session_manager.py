@@ -1,25 +1,51 @@
 """
 Session management utilities
-Handles in-memory session storage for chat conversations
+Handles session storage for chat conversations (in-process or shared between workers)
 """
 import uuid
 from datetime import datetime
-from typing import Dict, Optional, List
+from typing import Optional, List
 from backend.models.schemas import ChatSession
+from utils.state_store import Namespace, state_store
 
 
 class SessionManager:
-    """Manages chat sessions in memory"""
-    
-    def __init__(self):
-        self.sessions: Dict[str, ChatSession] = {}
-        self.user_sessions: Dict[str, List[str]] = {}  # user_id -> [session_ids]
-    
+    """Manages chat sessions in the shared state store"""
+
+    def __init__(self, store=state_store):
+        self.sessions = Namespace(store, "sessions")
+        self.user_sessions = Namespace(store, "user_sessions")  # user_id -> [session_ids]
+        self.doctor_stats = Namespace(store, "doctor_stats")  # doctor -> dashboard aggregates
+        self.user_versions = Namespace(store, "user_versions")  # user_id -> version of the user's session list
+
+    def _update(self, session_id: str, mutate) -> Optional[ChatSession]:
+        """Atomically apply `mutate` to the stored session data in place and bump its version"""
+        def apply(data):
+            if data is None:
+                return None
+            mutate(data)
+            data["updated_at"] = datetime.now().isoformat()
+            data["version"] = data.get("version", 0) + 1
+            return data
+        data = self.sessions.update_item(session_id, apply)
+        if not data:
+            return None
+        self._bump_user_version(data.get("user_id"))
+        return ChatSession(**data)
+
+    def _bump_user_version(self, user_id: Optional[str]):
+        if user_id:
+            self.user_versions.update_item(user_id, lambda version: (version or 0) + 1)
+
+    def get_user_version(self, user_id: str) -> int:
+        """Version of a user's session list; changes whenever any of their sessions does"""
+        return self.user_versions.get(user_id, 0)
+
     def create_session(self, user_id: str, doctor: str = None) -> ChatSession:
         """Create a new chat session"""
         session_id = str(uuid.uuid4())
         now = datetime.now()
-        
+
         session = ChatSession(
             id=session_id,
             name=None,
@@ -29,58 +55,162 @@ class SessionManager:
             doctor=doctor,      # 記錄醫師
             user_id=user_id     # 記錄病患
         )
-        
-        self.sessions[session_id] = session
-        
-        if user_id not in self.user_sessions:
-            self.user_sessions[user_id] = []
-        self.user_sessions[user_id].append(session_id)
-        
+
+        self.sessions[session_id] = session.model_dump(mode="json")
+        self.user_sessions.update_item(user_id, lambda ids: (ids or []) + [session_id])
+        self._bump_user_version(user_id)
+
+        def count_session(stats):
+            patient = stats["patients"].get(user_id)
+            if patient is None:
+                patient = stats["patients"][user_id] = _new_patient(user_id)
+                stats["removed"].pop(user_id, None)
+            patient["session_count"] += 1
+            stats["session_count"] += 1
+            _touch(stats, patient, session.created_at)
+        self._update_doctor_stats(doctor, count_session)
+
         return session
-    
+
     def get_session(self, session_id: str) -> Optional[ChatSession]:
         """Get a session by ID"""
-        return self.sessions.get(session_id)
-    
+        data = self.sessions.get(session_id)
+        return ChatSession(**data) if data else None
+
     def get_user_sessions(self, user_id: str) -> List[ChatSession]:
         """Get all sessions for a user"""
         session_ids = self.user_sessions.get(user_id, [])
-        return [self.sessions[sid] for sid in session_ids if sid in self.sessions]
-    
+        sessions = [self.get_session(sid) for sid in session_ids]
+        return [s for s in sessions if s is not None]
+
     def update_session_name(self, session_id: str, name: str) -> bool:
         """Update session name"""
-        session = self.sessions.get(session_id)
-        if session:
-            session.name = name
-            session.updated_at = datetime.now()
-            return True
-        return False
-    
+        def rename(data):
+            data["name"] = name
+        session = self._update(session_id, rename)
+        if session is None:
+            return False
+
+        def mark_renamed(stats):
+            patient = stats["patients"].get(session.user_id)
+            if patient is not None:
+                patient["version"] = stats["version"] + 1
+        self._update_doctor_stats(session.doctor, mark_renamed)
+        return True
+
     def delete_session(self, session_id: str, user_id: str) -> bool:
         """Delete a session"""
-        if session_id in self.sessions:
+        data = self.sessions.get(session_id)
+        if data is not None:
             del self.sessions[session_id]
             if user_id in self.user_sessions:
-                self.user_sessions[user_id] = [
-                    sid for sid in self.user_sessions[user_id] if sid != session_id
-                ]
+                self.user_sessions.update_item(
+                    user_id, lambda ids: [sid for sid in ids or [] if sid != session_id]
+                )
+            self._bump_user_version(user_id)
+
+            def uncount_session(stats):
+                stats["session_count"] = max(stats["session_count"] - 1, 0)
+                patient = stats["patients"].get(data.get("user_id"))
+                if patient is not None:
+                    patient["session_count"] -= 1
+                    if patient["session_count"] <= 0:
+                        del stats["patients"][patient["user_id"]]
+                        stats["removed"][patient["user_id"]] = stats["version"] + 1
+                    else:
+                        patient["version"] = stats["version"] + 1
+            self._update_doctor_stats(data.get("doctor"), uncount_session)
             return True
         return False
-    
-    def add_message(self, session_id: str, role: str, content: str | dict):
-        """Add a message to session history"""
-        session = self.sessions.get(session_id)
-        if session:
-            session.history.append({"role": role, "content": content})
-            session.updated_at = datetime.now()
-    
+
+    def add_message(self, session_id: str, role: str, content: str | dict) -> Optional[ChatSession]:
+        """Add a message to session history; returns the updated session"""
+        def append(data):
+            data["history"].append({"role": role, "content": content})
+        session = self._update(session_id, append)
+
+        if session is not None:
+            def count_message(stats):
+                patient = stats["patients"].get(session.user_id)
+                if patient is None:
+                    return
+                if role == "user":
+                    patient["question_count"] += 1
+                    stats["question_count"] += 1
+                _touch(stats, patient, session.updated_at)
+            self._update_doctor_stats(session.doctor, count_message)
+        return session
+
     def get_sessions_by_doctor(self, doctor: str) -> List[ChatSession]:
         """Get all sessions for a specific doctor (for future doctor admin features)"""
         return [
-            session for session in self.sessions.values()
-            if session.doctor == doctor
+            ChatSession(**data) for data in self.sessions.values()
+            if data.get("doctor") == doctor
         ]
 
+    def get_doctor_stats(self, doctor: str) -> dict:
+        """
+        Materialized dashboard aggregates for a doctor: totals plus per-patient session count,
+        question count and last activity. Every change bumps "version"; patients carry the version
+        of their last change and "removed" maps patients without sessions left to their removal version
+        """
+        stats = self.doctor_stats.get(doctor)
+        if stats is None:
+            # Build inside the atomic update so a concurrent build or increment on another worker is not overwritten
+            stats = self.doctor_stats.update_item(
+                doctor, lambda current: current if current is not None else self._build_doctor_stats(doctor)
+            )
+        return stats
+
+    def _build_doctor_stats(self, doctor: str) -> dict:
+        """Full scan used once per doctor when no aggregates exist yet (e.g. sessions from an older deployment)"""
+        stats = _empty_stats()
+        for session in self.get_sessions_by_doctor(doctor):
+            patient = stats["patients"].setdefault(session.user_id, _new_patient(session.user_id))
+            questions = sum(1 for message in session.history if message.get("role") == "user")
+            patient["session_count"] += 1
+            patient["question_count"] += questions
+            stats["session_count"] += 1
+            stats["question_count"] += questions
+            _touch(stats, patient, session.updated_at)
+        stats["version"] = 1
+        return stats
+
+    def _update_doctor_stats(self, doctor: Optional[str], mutate):
+        """Apply an incremental change to a doctor's aggregates and bump their version"""
+        if not doctor:
+            return
+
+        def apply(stats):
+            if stats is None:
+                # The first build already reflects the change that triggered it
+                stats = self._build_doctor_stats(doctor)
+            else:
+                mutate(stats)
+            stats["version"] += 1
+            return stats
+        self.doctor_stats.update_item(doctor, apply)
+
+
+def _empty_stats() -> dict:
+    return {"version": 0, "session_count": 0, "question_count": 0, "last_activity": None,
+            "patients": {}, "removed": {}}
+
+
+def _new_patient(user_id: str) -> dict:
+    # user_id 格式: name_email（只在第一次出現時拆解）
+    name, _, email = (user_id or "").partition("_")
+    return {"user_id": user_id, "name": name or user_id, "email": email,
+            "session_count": 0, "question_count": 0, "last_activity": None, "version": 0}
+
+
+def _touch(stats: dict, patient: dict, when: datetime):
+    """Record activity at `when` and mark the patient as changed in the upcoming version"""
+    activity = when.isoformat()
+    patient["last_activity"] = max(patient["last_activity"] or activity, activity)
+    stats["last_activity"] = max(stats["last_activity"] or activity, activity)
+    patient["version"] = stats["version"] + 1
+
 
 # Global session manager instance
 session_manager = SessionManager()
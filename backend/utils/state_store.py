@@ -0,0 +1,225 @@
+"""
+Shared state storage
+Key-value namespaces for login state, profiles and chat sessions that can live
+in-process (single worker) or in a local SQLite file shared by several uvicorn
+workers, with a short-lived read-through cache in front
+"""
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from config import STATE_BACKEND, STATE_DB_FILE, STATE_CACHE_TTL
+
+
+class InMemoryStore:
+    """
+    Process-local storage holding the Python objects themselves (no serialization).
+    Values handed out are live: change them only through update(), which may mutate them in place
+    """
+
+    def __init__(self):
+        self._data: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.RLock()
+
+    def get(self, namespace: str, key: str) -> Any:
+        return self._data.get(namespace, {}).get(key)
+
+    def set(self, namespace: str, key: str, value: Any):
+        with self._lock:
+            self._data.setdefault(namespace, {})[key] = value
+
+    def delete(self, namespace: str, key: str) -> bool:
+        with self._lock:
+            return self._data.get(namespace, {}).pop(key, None) is not None
+
+    def items(self, namespace: str) -> Iterator[Tuple[str, Any]]:
+        return iter(list(self._data.get(namespace, {}).items()))
+
+    def update(self, namespace: str, key: str, fn: Callable[[Any], Any]) -> Any:
+        """Atomically replace a value with fn(old); returning None from fn leaves it unchanged"""
+        with self._lock:
+            new = fn(self.get(namespace, key))
+            if new is not None:
+                self.set(namespace, key, new)
+            return new
+
+
+class SQLiteStore:
+    """
+    Storage in a local SQLite file (WAL mode) shared by all workers on the host; values are stored as JSON text.
+    Calls are synchronous and run on the caller's thread (the event loop for the async endpoints), and a
+    write waits up to the 5 s busy timeout for another worker's transaction: meant for low write rates
+    (logins, profile edits, chat messages), not for high-frequency counters
+    """
+
+    def __init__(self, db_file: str = STATE_DB_FILE):
+        self.db_file = db_file
+        self._local = threading.local()
+        conn = self._get_connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS kv (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+        ''')
+        conn.commit()
+
+    def _get_connection(self):
+        """One connection per thread, kept open for the life of the thread"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, namespace: str, key: str) -> Any:
+        row = self._get_connection().execute(
+            'SELECT value FROM kv WHERE namespace = ? AND key = ?', (namespace, key)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, namespace: str, key: str, value: Any):
+        self._get_connection().execute(
+            'INSERT OR REPLACE INTO kv (namespace, key, value) VALUES (?, ?, ?)',
+            (namespace, key, json.dumps(value, ensure_ascii=False))
+        )
+
+    def delete(self, namespace: str, key: str) -> bool:
+        cursor = self._get_connection().execute(
+            'DELETE FROM kv WHERE namespace = ? AND key = ?', (namespace, key)
+        )
+        return cursor.rowcount > 0
+
+    def items(self, namespace: str) -> Iterator[Tuple[str, Any]]:
+        rows = self._get_connection().execute(
+            'SELECT key, value FROM kv WHERE namespace = ?', (namespace,)
+        ).fetchall()
+        return ((key, json.loads(value)) for key, value in rows)
+
+    def update(self, namespace: str, key: str, fn: Callable[[Any], Any]) -> Any:
+        """Atomically replace a value with fn(old) inside a write transaction"""
+        conn = self._get_connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            new = fn(self.get(namespace, key))
+            if new is not None:
+                self.set(namespace, key, new)
+            conn.execute("COMMIT")
+            return new
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+
+class CachedStore:
+    """Read-through cache in front of a store; entries expire after `ttl` seconds"""
+
+    def __init__(self, backend, ttl: float = STATE_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self._cache: Dict[Tuple[str, str], Tuple[float, Any]] = {}
+
+    def get(self, namespace: str, key: str) -> Any:
+        entry = self._cache.get((namespace, key))
+        now = time.monotonic()
+        if entry and entry[0] > now:
+            return entry[1]
+        value = self.backend.get(namespace, key)
+        # Misses are not cached so a login made on another worker is visible immediately
+        if value is not None:
+            self._cache[(namespace, key)] = (now + self.ttl, value)
+        return value
+
+    def set(self, namespace: str, key: str, value: Any):
+        self.backend.set(namespace, key, value)
+        self._cache[(namespace, key)] = (time.monotonic() + self.ttl, value)
+
+    def delete(self, namespace: str, key: str) -> bool:
+        self._cache.pop((namespace, key), None)
+        return self.backend.delete(namespace, key)
+
+    def items(self, namespace: str) -> Iterator[Tuple[str, Any]]:
+        return self.backend.items(namespace)
+
+    def update(self, namespace: str, key: str, fn: Callable[[Any], Any]) -> Any:
+        new = self.backend.update(namespace, key, fn)
+        if new is not None:
+            self._cache[(namespace, key)] = (time.monotonic() + self.ttl, new)
+        return new
+
+
+class Namespace:
+    """
+    Dict-like view over one namespace of the shared store. Values must be JSON-serializable;
+    treat values read from it as read-only and change them through update_item()
+    """
+
+    def __init__(self, store, name: str):
+        self.store = store
+        self.name = name
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self.store.get(self.name, key)
+        return value if value is not None else default
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.store.get(self.name, key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value: Any):
+        self.store.set(self.name, key, value)
+
+    def __delitem__(self, key: str):
+        if not self.store.delete(self.name, key):
+            raise KeyError(key)
+
+    def __contains__(self, key: str) -> bool:
+        return self.store.get(self.name, key) is not None
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        return self.store.items(self.name)
+
+    def values(self) -> Iterator[Any]:
+        for _, value in self.items():
+            yield value
+
+    def update_item(self, key: str, fn: Callable[[Any], Any]) -> Any:
+        """
+        Atomically apply fn to the current value (None if missing); fn returning None skips the write.
+        fn may mutate the value it is given and return it
+        """
+        return self.store.update(self.name, key, fn)
+
+
+def create_state_store(backend: str = STATE_BACKEND):
+    """Build the configured store: "memory" for a single worker, "sqlite" for multi-worker deployments"""
+    if backend == "sqlite":
+        return CachedStore(SQLiteStore())
+    return InMemoryStore()
+
+
+# Global shared state store
+state_store = create_state_store()
+
+_epoch: Optional[str] = None
+
+
+def store_epoch() -> str:
+    """
+    Identifier of the state store's lifetime. Version counters restart from zero with a new
+    in-memory store (e.g. after a restart), so anything handed to clients that carries a version
+    (ETags, delta cursors) must carry the epoch too
+    """
+    global _epoch
+    if _epoch is None:
+        _epoch = Namespace(state_store, "meta").update_item("epoch", lambda epoch: epoch or uuid.uuid4().hex[:8])
+    return _epoch
@@ -0,0 +1,139 @@
+"""
+外部相依服務（Neo4j、Ollama）的斷路器
+以最近幾次呼叫的失敗率判斷服務是否異常；斷路（open）期間請求直接快速失敗，
+冷卻時間過後進入半開（half_open），一次只放行一個試探請求，成功才恢復，失敗則加倍冷卻時間
+"""
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+from config import (
+    BREAKER_FAILURE_RATE, BREAKER_MIN_CALLS, BREAKER_WINDOW,
+    BREAKER_RESET_TIMEOUT, BREAKER_MAX_RESET_TIMEOUT,
+)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """單一相依服務的斷路器（執行緒安全）"""
+
+    def __init__(self, name: str, failure_rate: float = BREAKER_FAILURE_RATE,
+                 min_calls: int = BREAKER_MIN_CALLS, window: int = BREAKER_WINDOW,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT,
+                 max_reset_timeout: float = BREAKER_MAX_RESET_TIMEOUT):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.base_reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.opened_at: Optional[float] = None
+        self.rejected = 0
+        self.trips = 0
+        self._outcomes = deque(maxlen=window)
+        self._probe_started: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _current_state(self, now: float) -> str:
+        if self.state == OPEN and now - self.opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+            self._probe_started = None
+        return self.state
+
+    def allow(self) -> bool:
+        """是否放行這次請求；斷路中回傳 False，半開時只放行一個試探請求"""
+        now = time.monotonic()
+        with self._lock:
+            state = self._current_state(now)
+            if state == CLOSED:
+                return True
+            # 試探請求卡住太久（超過冷卻時間）時允許再試探一次
+            if state == HALF_OPEN and (self._probe_started is None
+                                       or now - self._probe_started >= self.reset_timeout):
+                self._probe_started = now
+                return True
+            self.rejected += 1
+            return False
+
+    def is_open(self) -> bool:
+        """
+        快速失敗用的檢查：斷路中、或半開且試探請求進行中時回傳 True。
+        與 allow() 不同，不佔用半開時唯一的試探名額（試探由實際呼叫開始時的 start_call() 取得）
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self.state == CLOSED:
+                return False
+            if self.state == OPEN:
+                blocked = now - self.opened_at < self.reset_timeout
+            else:
+                blocked = self._probe_started is not None and now - self._probe_started < self.reset_timeout
+            if blocked:
+                self.rejected += 1
+            return blocked
+
+    def start_call(self):
+        """實際呼叫開始時呼叫：半開狀態下由這次呼叫擔任試探請求，其他請求在結果出來前快速失敗"""
+        now = time.monotonic()
+        with self._lock:
+            if self._current_state(now) == HALF_OPEN and (self._probe_started is None
+                                                         or now - self._probe_started >= self.reset_timeout):
+                self._probe_started = now
+
+    def retry_after(self) -> float:
+        """距離下次試探的秒數"""
+        with self._lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(self.opened_at + self.reset_timeout - time.monotonic(), 0.0)
+
+    def record_success(self):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                print(f"斷路器恢復: {self.name}")
+                self.state = CLOSED
+                self.reset_timeout = self.base_reset_timeout
+                self._outcomes.clear()
+            self._outcomes.append(True)
+
+    def record_failure(self):
+        now = time.monotonic()
+        with self._lock:
+            if self.state == HALF_OPEN:
+                # 試探失敗：重新斷路並加倍冷卻時間，避免持續打擾恢復中的服務
+                self.reset_timeout = min(self.reset_timeout * 2, self.max_reset_timeout)
+                self._trip(now)
+                return
+            if self.state == OPEN:
+                return
+            self._outcomes.append(False)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate:
+                self._trip(now)
+
+    def _trip(self, now: float):
+        self.state = OPEN
+        self.opened_at = now
+        self._probe_started = None
+        self.trips += 1
+        print(f"斷路器開啟: {self.name}（{self.reset_timeout:.0f}s 後試探）")
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            state = self._current_state(now)
+            outcomes = list(self._outcomes)
+            retry_after = max(self.opened_at + self.reset_timeout - now, 0.0) if state == OPEN else 0.0
+        return {
+            "state": state,
+            "failure_rate": round(outcomes.count(False) / len(outcomes), 3) if outcomes else 0.0,
+            "recent_calls": len(outcomes),
+            "trips": self.trips,
+            "rejected": self.rejected,
+            "retry_after": round(retry_after, 1),
+        }
@@ -5,4 +5,51 @@ DB_URL = os.getenv("HOSPITAL_DB_URL")
 # n8n Webhook
 N8N_WEBHOOK_URL = os.getenv("N8N_WEBHOOK_URL")
 # 管理員密碼
-ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "123456789") 
\ No newline at end of file
+ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "123456789") 
+
+# 問題相關性門檻（低於 REJECT 直接拒答，介於兩者之間視為邊界問題）
+RELEVANCE_ACCEPT_THRESHOLD = float(os.getenv("RELEVANCE_ACCEPT_THRESHOLD", "0.6"))
+RELEVANCE_REJECT_THRESHOLD = float(os.getenv("RELEVANCE_REJECT_THRESHOLD", "0.35"))
+
+# Ollama 連線設定
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "8"))
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "120"))
+
+# 回答模式：refine（鏈先生成草稿再整合）/ direct（略過草稿，直接以檢索內容串流詳細回答）
+#           / structured（略過草稿，單次生成同時輸出大綱與詳細說明）
+ANSWER_MODE = os.getenv("ANSWER_MODE", "refine")
+
+# 請求總期限與各階段時間預算（秒）；逾時時降級回答，而不是無限等待 Ollama / Neo4j
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "90"))
+STAGE_TIMEOUTS = {
+    "connect": float(os.getenv("STAGE_TIMEOUT_CONNECT", "5")),
+    "retrieval_english": float(os.getenv("STAGE_TIMEOUT_RETRIEVAL_ENGLISH", "25")),
+    "retrieval_chinese": float(os.getenv("STAGE_TIMEOUT_RETRIEVAL_CHINESE", "20")),
+    "direct_query": float(os.getenv("STAGE_TIMEOUT_DIRECT_QUERY", "5")),
+    "detail": float(os.getenv("STAGE_TIMEOUT_DETAIL", "45")),
+    "outline": float(os.getenv("STAGE_TIMEOUT_OUTLINE", "15")),
+    "structured": float(os.getenv("STAGE_TIMEOUT_STRUCTURED", "55")),
+}
+
+# 斷路器：最近 BREAKER_WINDOW 次呼叫中失敗率達門檻（且至少 BREAKER_MIN_CALLS 次）即斷路，
+# 斷路 BREAKER_RESET_TIMEOUT 秒後放行一個試探請求，試探失敗時冷卻時間加倍（上限 BREAKER_MAX_RESET_TIMEOUT）
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "15"))
+BREAKER_MAX_RESET_TIMEOUT = float(os.getenv("BREAKER_MAX_RESET_TIMEOUT", "120"))
+
+# 常見問題回答庫（由 backend/scripts/build_faq_store.py 產生）；問題正規化後與收錄問法相同即直接回答。
+# FAQ_MATCH_THRESHOLD 只用於離線分群：相似度達門檻且數字、否定詞與食物 / 數量名詞相同的問法才併為同一題
+FAQ_STORE_FILE = os.getenv("FAQ_STORE_FILE", "faq_answers.bin")
+FAQ_MATCH_THRESHOLD = float(os.getenv("FAQ_MATCH_THRESHOLD", "0.92"))
+
+# Neo4j 非同步 driver 連線池大小與取得連線的等待上限（秒）
+NEO4J_POOL_SIZE = int(os.getenv("NEO4J_POOL_SIZE", "50"))
+NEO4J_ACQUIRE_TIMEOUT = float(os.getenv("NEO4J_ACQUIRE_TIMEOUT", "5"))
+
+# 問題翻譯快取：記憶體最多保留的翻譯數，超過的寫入磁碟檔
+TRANSLATION_CACHE_SIZE = int(os.getenv("TRANSLATION_CACHE_SIZE", "512"))
+TRANSLATION_CACHE_FILE = os.getenv("TRANSLATION_CACHE_FILE", "translation_cache.jsonl")
@@ -0,0 +1,91 @@
+"""
+Neo4j 查詢結果的精簡序列化
+只保留回答需要的屬性（name / description / guideline / impact），並去除重複節點，
+取代以 str(item) 直接把整筆紀錄塞進提示詞的做法
+"""
+from typing import Any, Iterable, List
+
+from langchain.prompts.prompt import PromptTemplate
+from langchain_core.messages import BaseMessage
+from langchain_core.prompts import ChatPromptTemplate
+
+# 依序輸出的屬性與標籤；name 作為行首標題
+CONTEXT_PROPERTIES = [
+    ("description", ""),
+    ("guideline", "建議："),
+    ("impact", "影響："),
+]
+
+
+def _format_node(node: dict) -> str:
+    """將單一節點的屬性投影成一行文字；沒有任何相關屬性時回傳空字串"""
+    parts = []
+    for key, label in CONTEXT_PROPERTIES:
+        value = node.get(key)
+        if value not in (None, "", []):
+            parts.append(f"{label}{_flatten(value)}")
+    name = node.get("name")
+    if name:
+        return f"{_flatten(name)}：{'；'.join(parts)}" if parts else _flatten(name)
+    return "；".join(parts)
+
+
+def _flatten(value: Any) -> str:
+    if isinstance(value, (list, tuple)):
+        return "、".join(_flatten(v) for v in value if v not in (None, ""))
+    return " ".join(str(value).split())
+
+
+def _iter_values(value: Any):
+    """展開紀錄中的巢狀結構，逐一產生節點 dict 或純量值"""
+    if isinstance(value, dict):
+        if any(key in value for key in ("name",) + tuple(k for k, _ in CONTEXT_PROPERTIES)):
+            yield value
+        else:
+            for inner in value.values():
+                yield from _iter_values(inner)
+    elif isinstance(value, (list, tuple)):
+        for inner in value:
+            yield from _iter_values(inner)
+    elif value not in (None, ""):
+        yield value
+
+
+def format_record_lines(records: Iterable[Any]) -> List[str]:
+    """將 Neo4j 紀錄轉成去重後的精簡文字行（保留原本出現順序）"""
+    lines = []
+    seen = set()
+    for record in records or []:
+        for value in _iter_values(record):
+            line = _format_node(value) if isinstance(value, dict) else _flatten(value)
+            key = "".join(line.split())
+            if key and key not in seen:
+                seen.add(key)
+                lines.append(line)
+    return lines
+
+
+def format_records(records: Iterable[Any]) -> str:
+    """將 Neo4j 紀錄轉成提示詞用的精簡文字，每個節點一行"""
+    return "\n".join(f"- {line}" for line in format_record_lines(records))
+
+
+def _compact_context(kwargs: dict) -> dict:
+    context = kwargs.get("context")
+    if isinstance(context, (list, tuple)):
+        kwargs["context"] = format_records(context)
+    return kwargs
+
+
+class CompactContextPromptTemplate(PromptTemplate):
+    """格式化前先將 context 中的原始 Neo4j 紀錄轉為精簡文字，供 GraphCypherQAChain 的 QA 步驟使用"""
+
+    def format(self, **kwargs: Any) -> str:
+        return super().format(**_compact_context(kwargs))
+
+
+class CompactContextChatPromptTemplate(ChatPromptTemplate):
+    """聊天訊息版本（固定 system 訊息 + 變動的 human 訊息），同樣先精簡 context"""
+
+    def format_messages(self, **kwargs: Any) -> List[BaseMessage]:
+        return super().format_messages(**_compact_context(kwargs))
@@ -1,9 +1,22 @@
 import os
-from langchain_community.graphs import Neo4jGraph
-from langchain.chains import GraphCypherQAChain
+import asyncio
+import threading
 from langchain.prompts.prompt import PromptTemplate
-from langchain_community.chat_models import ChatOllama
-from config import DB_URL
+from langchain_core.messages import HumanMessage, SystemMessage
+from config import DB_URL, ANSWER_MODE
+from kidney_relevance import classify_question
+from token_budget import TokenBudgetManager, PromptUsage, count_tokens
+from context_format import CompactContextChatPromptTemplate, CompactContextPromptTemplate, format_record_lines, format_records
+from llm_client import llm_pool
+from structured_answer import SectionStreamParser, fallback_outline
+from deadline import Deadline, StageTimeout, timeout_stats
+from circuit_breaker import CircuitBreaker
+from faq_store import FAQStore
+from cypher_guard import extract_cypher, guard_cypher, guard_stats
+from async_graph import AsyncNeo4jGraph
+from translation_cache import TranslationCache
+from cypher_params import ParameterizedNeo4jGraph, plan_cache_stats
+from patient_context import PatientContext
 
 # Neo4j configuration
 neo4j_url = DB_URL if DB_URL else 'bolt://10.250.80.84:7688'
@@ -12,20 +25,27 @@ neo4j_password = '12345678'
 neo4j_database = 'kidneyhealthdatabase'
 
 # Initialize LLMs
-llm_english = ChatOllama(
-    model="llama3.1:8b",
+LLM_NUM_CTX = 2048
+LLM_NUM_PREDICT = 512
+
+# 透過共用連線池建立模型（keep_alive 與連線數見 config）
+llm_english = llm_pool.chat_model(
+    "llama3.1:8b",
     temperature=0.1,
-    num_predict=512,
-    num_ctx=2048
+    num_predict=LLM_NUM_PREDICT,
+    num_ctx=LLM_NUM_CTX
 )
 
-llm_chinese = ChatOllama(
-    model="kenneth85/llama-3-taiwan",
+llm_chinese = llm_pool.chat_model(
+    "kenneth85/llama-3-taiwan",
     temperature=0.1,
-    num_predict=512,
-    num_ctx=2048
+    num_predict=LLM_NUM_PREDICT,
+    num_ctx=LLM_NUM_CTX
 )
 
+# 提示詞 token 預算（依模型 num_ctx 裁切檢索內容）
+budget_manager = TokenBudgetManager(LLM_NUM_CTX, LLM_NUM_PREDICT)
+
 # Prompts
 cypher_generation_template_english = """Generate Neo4j Cypher query for kidney health questions.
 
@@ -66,23 +86,29 @@ question_translation_prompt = PromptTemplate(
     input_variables=["chinese_question"]
 )
 
-CYPHER_QA_TEMPLATE_CHINESE = """你是一位腎臟健康衛教助理，根據提供的英文資訊，協助使用者以簡單、清楚的方式理解與腎臟健康有關的問題。
-請以溫和、有條理的語氣進行回答，就像是在與人自然對話。
-請不要提到「根據提供的資訊」這類語句，也避免重複問題本身。
-請保持專業性，說話可以溫和易懂，但是也需保持專業性。
-請務必使用繁體中文作答。
-嚴禁自我介紹、嚴禁要求使用者提供更多資訊、嚴禁給出與 context 無關的泛泛建議。若 context 不足，請根據現有資訊盡量給出有幫助的建議，或簡要歸納 context 內容。若 context 完全無法回答，才簡短說明目前無法提供具體建議。
+# 固定的 system 指示：QA、詳細回答、大綱與結構化回答共用同一段文字，
+# 讓 Ollama 在不同請求與階段之間都能重用這段前綴的 KV cache；各階段的差異只放在 human 訊息
+SYSTEM_PROMPT = """你是一位腎臟健康衛教醫生，協助使用者以簡單、清楚的方式理解與腎臟健康有關的問題，僅能根據系統提供的資訊回答：
+- 不可自我介紹（如「作為醫生...」等開場白）。
+- 不可要求使用者提供更多資訊。
+- 不可給出與 context 無關的泛泛建議。
+- 不要提到「根據提供的資訊」這類語句，也避免重複問題本身。
+- 若資訊不足，請根據現有資訊盡量給出有幫助的建議，或簡要歸納 context 內容。
+- 若 context 完全無法回答，才簡短說明目前無法提供具體建議。
+請以溫和、有條理的語氣回答，保持專業性以及語句清楚明瞭，務必使用繁體中文作答。"""
+
+CYPHER_QA_TEMPLATE_CHINESE = """請根據下方提供的英文資訊，以繁體中文回答使用者問題。
 
 提供的英文資訊：
 {context}
 
 使用者問題：{question}
-有幫助的回答：
-"""
+有幫助的回答："""
 
-qa_prompt_chinese = PromptTemplate(
-    input_variables=["context", "question"], template=CYPHER_QA_TEMPLATE_CHINESE
-)
+qa_prompt_chinese = CompactContextChatPromptTemplate.from_messages([
+    ("system", SYSTEM_PROMPT),
+    ("human", CYPHER_QA_TEMPLATE_CHINESE),
+])
 
 cypher_generation_template = """你是 Neo4j 專家，將中文問題轉換成 Cypher 查詢語法。
 
@@ -126,30 +152,214 @@ CYPHER_QA_TEMPLATE = """你是一位腎臟健康衛教助理，根據提供的
 有幫助的回答：
 """
 
-qa_prompt = PromptTemplate(
+qa_prompt = CompactContextPromptTemplate(
     input_variables=["context", "question"], template=CYPHER_QA_TEMPLATE
 )
 
+DETAIL_TEMPLATE = """請整合下方系統提供的腎臟衛教回應，給出完整、有條理的詳細回答。
+
+提供的資訊：
+{firstResult}
+
+使用者問題：{question}
+有幫助的回答："""
+
+STRUCTURED_TEMPLATE = """請根據下方系統提供的腎臟衛教資訊回答使用者問題，並嚴格依照以下格式輸出，先寫大綱再寫詳細說明：
+【大綱】
+（簡短、易懂的大綱列點，3點以內，每點不超過15字）
+【詳細說明】
+（完整、有條理的詳細說明）
+
+提供的資訊：
+{firstResult}
+
+使用者問題：{question}
+"""
+
+OUTLINE_TEMPLATE = """請將下方系統提供的腎臟衛教回應，濃縮成簡短、易懂的大綱列點（3點以內），每點不超過15字，避免冗長解釋。
+
+提供的資訊：
+{firstResult}
+
+使用者問題：{question}
+大綱列點：
+"""
+
+def chat_messages(prompt):
+    """組成固定 system 訊息 + 變動 human 訊息，讓模型伺服器重用 system 前綴的 KV cache"""
+    return [SystemMessage(content=SYSTEM_PROMPT), HumanMessage(content=prompt)]
+
+async def warm_up_models():
+    """啟動時預先載入模型，避免第一位使用者遇到冷啟動"""
+    await llm_pool.warm_up()
+
+def llm_health():
+    """回傳模型連線與延遲統計"""
+    return llm_pool.health()
+
+class PipelineCancelled(Exception):
+    """使用者中斷連線，停止後續查詢與生成"""
+
+
+class CancellationToken:
+    """跨執行緒的取消旗標，於查詢流程各階段之間檢查"""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise PipelineCancelled()
+
+
+# 因使用者中斷而省下的生成量（以尚未生成的 num_predict 上限估算）
+cancellation_stats = {"cancelled_requests": 0, "tokens_saved": 0}
+
+def record_cancellation(stage, generated_tokens=0):
+    """記錄在某階段被取消的請求，估算省下的 token 數"""
+    remaining_generations = {"retrieval": 2, "detail": 2, "outline": 1, "structured": 1}.get(stage, 0)
+    saved = max(remaining_generations * LLM_NUM_PREDICT - generated_tokens, 0)
+    cancellation_stats["cancelled_requests"] += 1
+    cancellation_stats["tokens_saved"] += saved
+    print(f"使用者已中斷連線，於「{stage}」階段停止，約省下 {saved} tokens")
+    return saved
+
+# 常見問題預先產生的回答（離線重建，命中時不必查詢與生成）
+faq_store = FAQStore()
+
+# Neo4j 斷路器：資料庫異常時直接回傳 None，不必每次都等連線逾時
+neo4j_breaker = CircuitBreaker("neo4j")
+
+# 相依服務斷路時的快速失敗訊息
+DATABASE_UNAVAILABLE_MESSAGE = "資料庫連結異常，請稍後再試。"
+LLM_UNAVAILABLE_MESSAGE = "目前模型服務忙碌中，請稍後再試。"
+
 def connectNeo4j():
+    """同步連線（離線腳本計算圖譜指紋等用途）；線上查詢使用 aconnect_neo4j"""
+    if not neo4j_breaker.allow():
+        print(f"Neo4j 斷路中，{neo4j_breaker.retry_after():.0f}s 後重試")
+        return None
     try:
-        graph = Neo4jGraph(url=neo4j_url,
-                           username=neo4j_user,
-                           password=neo4j_password,
-                           database=neo4j_database)
+        # 查詢前將字串常值參數化，讓相同結構的查詢共用執行計畫快取
+        graph = ParameterizedNeo4jGraph(url=neo4j_url,
+                                        username=neo4j_user,
+                                        password=neo4j_password,
+                                        database=neo4j_database)
     except:
+        neo4j_breaker.record_failure()
         graph = None
+    else:
+        neo4j_breaker.record_success()
     return graph
 
-def translate_question_to_english(chinese_question):
-    """將中文問題翻譯成英文"""
-    formatted_prompt = question_translation_prompt.format(chinese_question=chinese_question)
-    translation = llm_chinese.invoke(formatted_prompt)
-    return translation.content.strip()
+# 非同步 driver 的共用連線池；檢索流程與直接查詢都透過它存取資料庫
+async_graph = AsyncNeo4jGraph(neo4j_url, neo4j_user, neo4j_password, neo4j_database, breaker=neo4j_breaker)
 
-def query_graph_two_stage(user_input):
-    """兩階段RAG查詢：中文檢索 + 中文回答"""
+async def aconnect_neo4j():
+    """確認資料庫可連線並回傳共用的非同步查詢介面；斷路中或連線失敗時回傳 None"""
+    if not neo4j_breaker.allow():
+        print(f"Neo4j 斷路中，{neo4j_breaker.retry_after():.0f}s 後重試")
+        return None
+    try:
+        await async_graph.verify()
+    except Exception as e:
+        print(f"Neo4j 連線失敗: {e}")
+        neo4j_breaker.record_failure()
+        return None
+    neo4j_breaker.record_success()
+    return async_graph
+
+def dependency_unavailable():
+    """
+    Ollama 斷路中時回傳快速失敗訊息，否則回傳 None（Neo4j 由 aconnect_neo4j 判斷）。
+    只檢查狀態，不佔用半開試探名額；試探由實際的模型呼叫取得（LLMStats 呼叫開始時）
+    """
+    if llm_pool.breaker.is_open():
+        print(f"Ollama 斷路中，{llm_pool.breaker.retry_after():.0f}s 後重試")
+        return LLM_UNAVAILABLE_MESSAGE
+    return None
+
+def breaker_health():
+    """回傳各相依服務的斷路器狀態"""
+    return {"neo4j": neo4j_breaker.snapshot(), "ollama": llm_pool.breaker.snapshot()}
+
+# 問題翻譯快取（記憶體 LRU，淘汰項目寫入磁碟）
+translation_cache = TranslationCache()
+
+async def translate_question_to_english(chinese_question):
+    """將中文問題翻譯成英文（只取第一行，去除模型可能加上的引號）"""
+    formatted_prompt = question_translation_prompt.format(chinese_question=chinese_question)
+    translation = await llm_chinese.ainvoke(formatted_prompt)
+    lines = [line.strip() for line in translation.content.strip().splitlines() if line.strip()]
+    return lines[0].strip('"“”「」') if lines else ""
+
+def english_retrieval_question(user_input):
+    """
+    英文檢索使用的問題：快取中有翻譯時附上英文翻譯（保留原文供模型搜尋中文字詞）；
+    沒有時在背景翻譯（與檢索同時進行、不等待），這次直接使用原文，之後的相同問題即可命中快取
+    """
+    english_question = translation_cache.get(user_input)
+    if english_question is None:
+        translation_cache.translate_in_background(user_input, translate_question_to_english)
+        return user_input
+    return f"{english_question}\nOriginal question: {user_input}"
+
+# 檢索用的 Cypher 查詢筆數上限（與原 GraphCypherQAChain 的 top_k 相同）
+CYPHER_TOP_K = 10
+
+async def run_cypher_qa(llm, cypher_prompt, user_input, generate_answer=True, cypher_question=None, patient=None):
+    """
+    以非同步方式執行 Cypher 檢索流程（取代 GraphCypherQAChain）：
+    生成 Cypher → 檢查 / 修正 / 估計成本 → 查詢 → QA 生成（generate_answer=False 時改回傳精簡後的檢索內容）
+    cypher_question 為生成 Cypher 用的問題（預設同 user_input），QA 一律回答原問題。
+    patient（PatientContext）不為 None 時，檢索內容依病人分期 / 過敏原篩選排序，QA 問題附上病人資料。
+    回傳與原本鏈相同格式的 {"result", "intermediate_steps"}
+    """
+    schema = await async_graph.get_schema()
+    response = await llm.ainvoke(cypher_prompt.format(schema=schema, question=cypher_question or user_input))
+    generated_cypher = extract_cypher(response.content)
+    print(f"產生的 Cypher: {generated_cypher}")
+
+    cypher = await guard_cypher(generated_cypher, async_graph)
+    records = await async_graph.query(cypher) if cypher else []
+    if patient is not None:
+        # 先篩選排序再取前 CYPHER_TOP_K 筆，符合病人分期的內容不會被截掉
+        records = patient.filter_records(records)
+    context = records[:CYPHER_TOP_K]
+    steps = [{"query": cypher or generated_cypher}, {"context": context}]
+
+    if not generate_answer:
+        return {"result": format_records(context), "intermediate_steps": steps}
+    question = patient.personalize_question(user_input) if patient is not None else user_input
+    answer = await llm.ainvoke(qa_prompt_chinese.format_messages(context=context, question=question))
+    return {"result": answer.content, "intermediate_steps": steps}
+
+async def query_graph_two_stage(user_input, cancel_token=None, generate_answer=True, deadline=None, patient=None,
+                                graph=None):
+    """
+    兩階段RAG查詢：中文檢索 + 中文回答（generate_answer=False 時只檢索不生成草稿回答）
+    deadline 限制各階段時間：英文檢索逾時改試中文檢索，剩餘時間不足時略過中文檢索直接改用直接查詢
+    patient：病人資料（PatientContext），用於篩選排序檢索內容
+    graph：呼叫端已確認可連線的圖譜（不必再次連線確認）；None 時自行連線
+    """
+    cancel_token = cancel_token or CancellationToken()
+    deadline = deadline or Deadline()
+    # 後續生成回答至少需要保留的時間
+    answer_reserve = deadline.stage_timeouts.get("outline", 0)
     b_databaseProblem = False
-    graph = connectNeo4j()
+    if graph is None:
+        try:
+            graph = await deadline.run_async("connect", aconnect_neo4j())
+        except StageTimeout:
+            neo4j_breaker.record_failure()
+            graph = None
     if graph is None:
         b_databaseProblem = True
         return {}, b_databaseProblem
@@ -208,18 +418,18 @@ def query_graph_two_stage(user_input):
         query_strategy = get_query_strategy(user_input)
         print(f"查詢策略: {query_strategy}")
 
-        # 第一階段：使用英文模型進行查詢（快取鏈）
+        # 第一階段：使用英文模型進行查詢
+        cancel_token.raise_if_cancelled()
         print("使用英文模型進行查詢...")
-        chain_english = GraphCypherQAChain.from_llm(
-            llm=llm_english,
-            graph=graph,
-            verbose=True,
-            return_intermediate_steps=True,
-            allow_dangerous_requests=True,
-            cypher_prompt=cypher_prompt_english,
-            qa_prompt=qa_prompt_chinese
-        )
-        result = chain_english({"query": user_input})
+        try:
+            result = await deadline.run_async(
+                "retrieval_english",
+                run_cypher_qa(llm_english, cypher_prompt_english, user_input, generate_answer,
+                              cypher_question=english_retrieval_question(user_input), patient=patient)
+            )
+        except StageTimeout as timeout:
+            print(f"英文模型檢索逾時: {timeout}")
+            result = {}
         print(f"英文模型檢索結果: {bool(result)}")
 
         # 檢查結果是否有效
@@ -227,25 +437,27 @@ def query_graph_two_stage(user_input):
             print("英文模型檢索成功，返回結果")
             return result, b_databaseProblem
 
-        # 如果英文模型結果無效，嘗試中文模型（快取鏈）
-        print("英文模型檢索無效，嘗試中文模型檢索...")
-        chain_chinese = GraphCypherQAChain.from_llm(
-            llm=llm_chinese,
-            graph=graph,
-            verbose=True,
-            return_intermediate_steps=True,
-            allow_dangerous_requests=True,
-            cypher_prompt=cypher_prompt,
-            qa_prompt=qa_prompt_chinese
-        )
-        result = chain_chinese({"query": user_input})
-        print(f"中文模型檢索結果: {bool(result)}")
-
-        if is_valid_result(result):
-            print("中文模型檢索成功，返回結果")
-            return result, b_databaseProblem
+        # 如果英文模型結果無效，嘗試中文模型；剩餘時間不足時直接略過
+        cancel_token.raise_if_cancelled()
+        if deadline.allows("retrieval_chinese", reserve=answer_reserve):
+            print("英文模型檢索無效，嘗試中文模型檢索...")
+            try:
+                result = await deadline.run_async(
+                    "retrieval_chinese", run_cypher_qa(llm_chinese, cypher_prompt, user_input, generate_answer, patient=patient)
+                )
+            except StageTimeout as timeout:
+                print(f"中文模型檢索逾時: {timeout}")
+                result = {}
+            print(f"中文模型檢索結果: {bool(result)}")
+
+            if is_valid_result(result):
+                print("中文模型檢索成功，返回結果")
+                return result, b_databaseProblem
+        else:
+            print(f"剩餘時間不足（{deadline.remaining():.1f}s），略過中文模型檢索")
 
         # 若仍無效，嘗試更廣泛的直接查詢
+        cancel_token.raise_if_cancelled()
         print("嘗試更廣泛的搜尋...")
         try:
             if query_strategy == "test":
@@ -259,12 +471,22 @@ def query_graph_two_stage(user_input):
             else:
                 direct_query = "MATCH (c:Category) RETURN c LIMIT 10"
             print(f"執行直接查詢: {direct_query}")
-            direct_result = graph.query(direct_query)
+            direct_result = await deadline.run_async("direct_query", graph.query(direct_query))
             if direct_result and len(direct_result) > 0:
                 print(f"直接查詢成功，找到 {len(direct_result)} 個結果")
-                context = [str(item) for item in direct_result]
+                context = format_record_lines(direct_result)
+                priority = None
+                if patient is not None:
+                    context = patient.filter_records(context)
+                    priority = patient.stage_priority
+                # 依問題排序（有病人資料時符合分期者優先）、去重並裁切到詳細回答階段的 context 預算內
+                budget = budget_manager.context_budget(DETAIL_TEMPLATE, system=SYSTEM_PROMPT, question=user_input)
+                fitted_context, dropped = budget_manager.fit_items(
+                    context, user_input, budget, separator="\n\n", priority=priority
+                )
+                print(f"直接查詢內容裁切: 保留 {len(context) - dropped} 筆，捨棄 {dropped} 筆")
                 return {
-                    "result": "根據您的問題，我找到了相關的資訊。請查看以下內容：\n\n" + "\n\n".join(context[:5]),
+                    "result": "根據您的問題，我找到了相關的資訊。請查看以下內容：\n\n" + fitted_context,
                     "intermediate_steps": [{"context": context, "cypher": direct_query}]
                 }, b_databaseProblem
             else:
@@ -274,84 +496,56 @@ def query_graph_two_stage(user_input):
             print(f"直接查詢失敗: {direct_error}")
             return {"result": "目前找不到相關資訊，請嘗試用不同的方式再次提問。"}, b_databaseProblem
 
+    except PipelineCancelled:
+        print("查詢已取消")
+        raise
     except Exception as e:
         print(f"兩階段查詢失敗: {e}")
         try:
+            cancel_token.raise_if_cancelled()
+            if not deadline.allows("retrieval_chinese", reserve=answer_reserve):
+                print(f"剩餘時間不足（{deadline.remaining():.1f}s），略過回退查詢")
+                return {"result": "目前找不到相關資訊，請嘗試用不同的方式再次提問。"}, b_databaseProblem
             print("嘗試回退到原始查詢方法...")
-            chain = GraphCypherQAChain.from_llm(
-                llm=llm_chinese,
-                graph=graph,
-                verbose=True,
-                return_intermediate_steps=True,
-                allow_dangerous_requests=True,
-                cypher_prompt=cypher_prompt,
-                qa_prompt=qa_prompt_chinese
+            result = await deadline.run_async(
+                "retrieval_chinese", run_cypher_qa(llm_chinese, cypher_prompt, user_input, generate_answer, patient=patient)
             )
-            result = chain({"query": user_input})
             print(f"回退查詢成功: {bool(result)}")
             return result, b_databaseProblem
+        except PipelineCancelled:
+            print("查詢已取消")
+            raise
         except Exception as fallback_error:
             print(f"回退查詢也失敗: {fallback_error}")
             return {"result": "系統發生錯誤，請稍後再試。"}, b_databaseProblem
 
-async def conclusionAnswer(firstResult, question):
-    """串流版本的詳細回答生成"""
-    answer_prompt = PromptTemplate(
-        input_variables=["firstResult", "question"],
-        template="""你是一位腎臟健康衛教醫生，請根據下方系統提供的腎臟衛教回應進行整合，僅能根據提供的資訊回答：
-- 不可自我介紹（如「作為醫生...」等開場白）。
-- 不可要求使用者提供更多資訊。
-- 不可給出與 context 無關的泛泛建議。
-- 若資訊不足，請根據現有資訊盡量給出有幫助的建議，或簡要歸納 context 內容。
-- 若 context 完全無法回答，才簡短說明目前無法提供具體建議。
-請保持專業性以及語句清楚明瞭，務必使用繁體中文作答。
-
-            提供的資訊：
-            {firstResult}
+async def generate_session_title(question):
+    """以模型為對話產生標題（由背景工作在第一個回答完成後呼叫）"""
+    response = await llm_chinese.ainvoke(f"請用一句話為以下對話命名，作為標題：\n使用者：{question}")
+    return response.content.strip().replace('"', '').replace("'", "")
 
-            使用者問題：{question}
-            有幫助的回答：
-            """)
-    formatted_prompt = answer_prompt.format(firstResult=firstResult, question=question)
-    
-    # 使用串流方式生成回答
-    for chunk in llm_chinese.stream(formatted_prompt):
-        if hasattr(chunk, 'content') and chunk.content:
-            yield chunk.content
-
-async def concise_outline(firstResult, question):
-    """串流版本的大綱生成"""
-    outline_prompt = PromptTemplate(
-        input_variables=["firstResult", "question"],
-        template="""你是一位腎臟健康衛教醫生，請將系統提供的腎臟衛教回應，濃縮成簡短、易懂的大綱列點（3點以內），每點不超過15字，避免冗長解釋。請勿重複問題。請務必使用繁體中文作答。\n\n提供的資訊：\n{firstResult}\n\n使用者問題：{question}\n大綱列點：\n""")
-    formatted_prompt = outline_prompt.format(firstResult=firstResult, question=question)
-    
-    # 使用串流方式生成大綱
-    for chunk in llm_chinese.stream(formatted_prompt):
-        if hasattr(chunk, 'content') and chunk.content:
-            yield chunk.content
+# 無法確定是否與腎臟健康相關的問題，請使用者補充說明（不花費檢索與生成的成本）
+BORDERLINE_MESSAGE = ("不好意思，我不太確定這個問題與腎臟健康的關係。"
+                      "請補充說明您想了解的腎臟相關狀況，例如腎功能、飲食、透析或檢驗數值，我再為您解答。")
 
 def is_kidney_related(question):
     """檢查問題是否與腎臟健康相關"""
-    kidney_keywords = [
-        '腎', '腎臟', 'CKD', 'ckd', '慢性腎臟病', '腎功能', '腎病',
-        '尿', '透析', '洗腎', '腎衰竭', '尿毒', '腎炎',
-        '飲食', '蛋白尿', '血尿', '肌酸酐', 'eGFR', 'egfr',
-        '腎絲球', '腎小管', '腎元', '腎臟保健', '腎臟檢查',
-        '腎臟藥物', '腎臟飲食', '腎臟營養', '腎衰竭預防',
-        '洗腎', '血液透析', '腹膜透析', '腎臟移植'
-    ]
-    
-    # 檢查是否包含相關關鍵字
-    question_lower = question.lower()
-    return any(keyword.lower() in question_lower for keyword in kidney_keywords)
-
-async def query_graph_two_stage_stream(user_input):
-    """串流版本的兩階段RAG查詢：逐步生成回答"""
+    return classify_question(question).is_related
+
+async def query_graph_two_stage_stream(user_input, answer_mode=None, use_faq_store=True, patient=None):
+    """
+    串流版本的兩階段RAG查詢：逐步生成回答；串流與非串流端點共用這個引擎（非串流端點以 aggregate_answer 收集）
+    answer_mode: "refine"（鏈先生成草稿，再整合成詳細回答）、"direct"（略過草稿，直接以檢索內容串流詳細回答）
+                 或 "structured"（略過草稿，單次生成同時輸出大綱與詳細說明）
+    use_faq_store: 是否先查常見問題回答庫（重建回答庫時需略過）
+    patient: 病人資料（PatientContext）；檢索內容依分期 / 過敏原篩選排序，生成提示詞附上病人資料
+    """
+    answer_mode = answer_mode or ANSWER_MODE
     
     # 預先檢查問題相關性
-    if not is_kidney_related(user_input):
-        print(f"問題與腎臟健康不相關: {user_input}")
+    relevance = classify_question(user_input)
+    if relevance.route == "reject":
+        print(f"問題與腎臟健康不相關 (score={relevance.score:.2f}): {user_input}")
         
         off_topic_message = "不好意思，我是腎臟健康衛教機器人，專門回答腎臟相關問題。無法提供此問題的解答。"
         
@@ -365,22 +559,78 @@ async def query_graph_two_stage_stream(user_input):
         }
         return
     
+    if relevance.route == "borderline":
+        # 邊界問題不進入知識圖譜與 LLM，請使用者補充與腎臟健康的關係後再問
+        print(f"邊界問題 (score={relevance.score:.2f})，請使用者補充說明: {user_input}")
+        yield {"type": "outline_chunk", "content": BORDERLINE_MESSAGE}
+        yield {"type": "detail_chunk", "content": BORDERLINE_MESSAGE}
+        yield {
+            "type": "done",
+            "outline": BORDERLINE_MESSAGE,
+            "detail": BORDERLINE_MESSAGE
+        }
+        return
+    
+    # 常見問題直接回傳預先產生並檢核過的回答
+    faq_answer = faq_store.lookup(user_input) if use_faq_store else None
+    if faq_answer and patient is not None and not patient.accepts_faq(faq_answer):
+        # 回答不是針對病人的分期，或提到病人的過敏原時，改走個人化檢索
+        print(f"常見問題回答不適用於此病人，改為個人化查詢: {faq_answer['question']}")
+        faq_answer = None
+    if faq_answer:
+        print(f"命中常見問題回答庫（版本 {faq_answer['version']}）: {faq_answer['question']}")
+        yield {"type": "detail_chunk", "content": faq_answer["detail"]}
+        yield {"type": "outline_chunk", "content": faq_answer["outline"]}
+        yield {
+            "type": "done",
+            "outline": faq_answer["outline"],
+            "detail": faq_answer["detail"],
+            "faq_version": faq_answer["version"]
+        }
+        return
+
+    # 整個請求的期限；各階段逾時時降級回答
+    deadline = Deadline()
+    degraded = []
+    
+    # 相依服務斷路中時快速失敗，不再加重負擔
+    unavailable = dependency_unavailable()
+    if unavailable:
+        yield {"type": "error", "content": unavailable}
+        return
+    
     b_databaseProblem = False
-    graph = connectNeo4j()
+    try:
+        graph = await deadline.run_async("connect", aconnect_neo4j())
+    except StageTimeout:
+        neo4j_breaker.record_failure()
+        graph = None
     
     if graph is None:
         b_databaseProblem = True
-        yield {"type": "error", "content": "資料庫連結異常，請稍後再試。"}
+        yield {"type": "error", "content": DATABASE_UNAVAILABLE_MESSAGE}
         return
     
+    # 使用者中斷連線時（串流被關閉或取消）停止檢索與後續生成
+    cancel_token = CancellationToken()
+    stage = "retrieval"
+    detail_text = ""
+    outline_text = ""
+    parser = None
+    
     try:
         print(f"處理問題（串流）: {user_input}")
+        usage = PromptUsage()
         
         # 階段 1: 查詢資料庫
         yield {"type": "status", "content": "正在查詢資料庫..."}
         
-        # 使用現有邏輯查詢資料庫
-        result, _ = query_graph_two_stage(user_input)
+        # 使用現有邏輯查詢資料庫（非同步 driver，不佔用執行緒）
+        result, _ = await query_graph_two_stage(
+            user_input, cancel_token, answer_mode == "refine", deadline, patient, graph=graph
+        )
+        # 生成提示詞使用附上病人資料的問題（放在 human 訊息，system 提示詞不變）
+        answer_question = patient.personalize_question(user_input) if patient is not None else user_input
         
         # 檢查結果
         if b_databaseProblem:
@@ -392,56 +642,115 @@ async def query_graph_two_stage_stream(user_input):
         else:
             firstResult = result['result']
         
-        # 階段 2: 生成詳細回答（串流）
-        yield {"type": "status", "content": "正在生成詳細回答..."}
-        
-        detail_prompt = f"""你是一位腎臟健康衛教醫生，請根據下方系統提供的腎臟衛教回應進行整合，僅能根據提供的資訊回答：
-- 不可自我介紹（如「作為醫生...」等開場白）。
-- 不可要求使用者提供更多資訊。
-- 不可給出與 context 無關的泛泛建議。
-- 若資訊不足，請根據現有資訊盡量給出有幫助的建議，或簡要歸納 context 內容。
-- 若 context 完全無法回答，才簡短說明目前無法提供具體建議。
-請保持專業性以及語句清楚明瞭，務必使用繁體中文作答。
-
-提供的資訊：
-{firstResult}
-
-使用者問題：{user_input}
-有幫助的回答："""
-        
-        detail_text = ""
-        async for chunk in llm_chinese.astream(detail_prompt):
-            if hasattr(chunk, 'content') and chunk.content:
-                detail_text += chunk.content
-                yield {"type": "detail_chunk", "content": chunk.content}
-        
-        # 階段 3: 生成大綱（串流）
-        yield {"type": "status", "content": "正在生成摘要..."}
+        if answer_mode == "structured":
+            # 階段 2: 單次生成大綱與詳細說明（串流解析區段）
+            stage = "structured"
+            yield {"type": "status", "content": "正在生成回答..."}
+            
+            structured_prompt = budget_manager.prepare(
+                STRUCTURED_TEMPLATE, "firstResult", firstResult, usage=usage, stage="structured", system=SYSTEM_PROMPT, question=answer_question
+            )
+            
+            parser = SectionStreamParser()
+            try:
+                async for chunk in deadline.stream("structured", llm_chinese.astream(chat_messages(structured_prompt))):
+                    if hasattr(chunk, 'content') and chunk.content:
+                        for section, text in parser.feed(chunk.content):
+                            yield {"type": f"{section}_chunk", "content": text}
+            except StageTimeout:
+                # 逾時：保留已生成的部分；完全沒有輸出時視為模型服務異常
+                degraded.append("structured")
+                if not parser.texts["outline"] and not parser.texts["detail"]:
+                    llm_pool.breaker.record_failure()
+            for section, text in parser.flush():
+                yield {"type": f"{section}_chunk", "content": text}
+            
+            detail_text = parser.result("detail")
+            outline_text = parser.result("outline")
+        else:
+            # 階段 2: 生成詳細回答（串流）；剩餘時間不足時略過，只回傳大綱
+            outline_reserve = deadline.stage_timeouts.get("outline", 0)
+            if deadline.allows("detail", reserve=outline_reserve):
+                stage = "detail"
+                yield {"type": "status", "content": "正在生成詳細回答..."}
+            
+                detail_prompt = budget_manager.prepare(
+                    DETAIL_TEMPLATE, "firstResult", firstResult, usage=usage, stage="detail", system=SYSTEM_PROMPT, question=answer_question
+                )
+            
+                try:
+                    async for chunk in deadline.stream("detail", llm_chinese.astream(chat_messages(detail_prompt))):
+                        if hasattr(chunk, 'content') and chunk.content:
+                            detail_text += chunk.content
+                            yield {"type": "detail_chunk", "content": chunk.content}
+                except StageTimeout:
+                    # 逾時：保留已生成的部分詳細回答，繼續生成大綱
+                    degraded.append("detail")
+                    if not detail_text:
+                        llm_pool.breaker.record_failure()
+            else:
+                print(f"剩餘時間不足（{deadline.remaining():.1f}s），略過詳細回答，只生成大綱")
+                degraded.append("detail")
         
-        outline_prompt = f"""你是一位腎臟健康衛教醫生，請將系統提供的腎臟衛教回應，濃縮成簡短、易懂的大綱列點（3點以內），每點不超過15字，避免冗長解釋。請勿重複問題。請務必使用繁體中文作答。
-
-提供的資訊：
-{detail_text}
-
-使用者問題：{user_input}
-大綱列點：
-"""
+            # 階段 3: 生成大綱（串流）；沒有詳細回答時直接以檢索內容生成
+            if deadline.allows("outline"):
+                stage = "outline"
+                yield {"type": "status", "content": "正在生成摘要..."}
+            
+                outline_prompt = budget_manager.prepare(
+                    OUTLINE_TEMPLATE, "firstResult", detail_text or firstResult, usage=usage, stage="outline", system=SYSTEM_PROMPT, question=answer_question
+                )
+            
+                try:
+                    async for chunk in deadline.stream("outline", llm_chinese.astream(chat_messages(outline_prompt))):
+                        if hasattr(chunk, 'content') and chunk.content:
+                            outline_text += chunk.content
+
+                            yield {"type": "outline_chunk", "content": chunk.content}
+                except StageTimeout:
+                    degraded.append("outline")
+                    if not outline_text:
+                        llm_pool.breaker.record_failure()
+            else:
+                degraded.append("outline")
         
-        outline_text = ""
-        async for chunk in llm_chinese.astream(outline_prompt):
-            if hasattr(chunk, 'content') and chunk.content:
-                outline_text += chunk.content
-
-                yield {"type": "outline_chunk", "content": chunk.content}
+        # 模型沒有生成大綱（格式不符或逾時）時，從詳細回答 / 檢索內容擷取
+        if not outline_text.strip():
+            outline_text = fallback_outline(detail_text or firstResult)
+            if outline_text:
+                yield {"type": "outline_chunk", "content": outline_text}
         
         # 完成
         yield {
             "type": "done",
             "outline": outline_text,
-            "detail": detail_text
+            "detail": detail_text,
+            "prompt_tokens": usage.as_dict(),
+            "degraded": degraded
         }
         
+    except (asyncio.CancelledError, GeneratorExit):
+        cancel_token.cancel()
+        generated = count_tokens(outline_text if stage == "outline" else detail_text)
+        if parser is not None:
+            generated = count_tokens(parser.texts["outline"] + parser.texts["detail"])
+        record_cancellation(stage, generated)
+        raise
     except Exception as e:
         print(f"串流查詢失敗: {e}")
         yield {"type": "error", "content": f"系統發生錯誤：{str(e)}"}
 
+async def aggregate_answer(events):
+    """
+    收集回答引擎的事件，回傳最後的 done 事件（含 outline / detail）；
+    流程以 error 結束時，大綱與詳細回答都使用錯誤訊息
+    """
+    try:
+        async for event in events:
+            if event["type"] == "done":
+                return event
+            if event["type"] == "error":
+                return {"type": "error", "outline": event["content"], "detail": event["content"]}
+    finally:
+        await events.aclose()
+    return {"type": "error", "outline": "系統發生錯誤", "detail": "系統發生錯誤，請稍後再試。"}
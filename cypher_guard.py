@@ -0,0 +1,246 @@
+"""
+LLM 產生的 Cypher 在送進 Neo4j 前的檢查與修正
+- 拒絕寫入類子句、程序呼叫與多段語句（圖譜只供查詢）
+- 拒絕沒有共同變數的逗號模式（笛卡兒積）
+- 修正常見錯誤：反向的「包含」關係、沒有上限的可變長度路徑、缺少或過大的 LIMIT
+- 以 EXPLAIN 估計回傳列數，過大的查詢不執行
+被拒絕的查詢回傳空字串，檢索流程會以空 context 繼續，交由下一個備援查詢處理
+"""
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+
+MAX_LIMIT = 10
+MAX_PATH_LENGTH = 3
+MAX_ESTIMATED_ROWS = 50000
+
+# 只允許查詢用的子句開頭
+READ_CLAUSES = ("MATCH", "OPTIONAL", "WITH", "UNWIND", "RETURN")
+WRITE_KEYWORDS = ("CREATE", "MERGE", "DELETE", "DETACH", "SET", "REMOVE", "DROP", "FOREACH", "LOAD", "CALL")
+# 子句關鍵字才算寫入：排除屬性存取（n.set）、參數（$set）、map 鍵（{set: 1}）與別名（AS load）；LOAD 只在 LOAD CSV 時算
+_WRITE_CLAUSE = re.compile(
+    r"(?<![\w.$])(" + "|".join(k for k in WRITE_KEYWORDS if k != "LOAD") + r"|LOAD(?=\s+CSV\b))\b(?!\s*:)(?!\.)",
+    re.IGNORECASE,
+)
+_ALIAS = re.compile(r"\bAS\s+([A-Za-z_]\w*)", re.IGNORECASE)
+_BACKTICK_IDENTIFIER = re.compile(r"`[^`]*`")
+
+# 「包含」關係只能由 Category 指向其他節點
+CONTAINS_RELATION = "包含"
+
+_STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_CLAUSE_SPLIT = re.compile(r"\b(MATCH|OPTIONAL\s+MATCH|WHERE|WITH|RETURN|UNWIND|ORDER\s+BY|SKIP|LIMIT)\b", re.IGNORECASE)
+_NODE_VARIABLE = re.compile(r"\(\s*([A-Za-z_]\w*)")
+_REL_VARIABLE = re.compile(r"\[\s*([A-Za-z_]\w*)")
+# 關係模式 )-[...*...]-( 中的可變長度路徑（只比對節點之間的方括號，不會碰到串列或串列推導式）
+_VAR_LENGTH = re.compile(
+    r"(?<=\))(\s*<?-\s*)\[([^\[\]]*?)\*\s*(\d*)\s*(?:\.\.\s*(\d*))?([^\[\]]*)\](?=\s*->?\s*\()"
+)
+# 查詢結尾的 LIMIT（值可以是數字、參數或運算式）
+_LIMIT = re.compile(r"\bLIMIT\s+(\S.*?)\s*$", re.IGNORECASE | re.DOTALL)
+_NODE = r"\([^()]*\)"
+_CONTAINS_REL = rf"\[[^\]]*:\s*`?{CONTAINS_RELATION}`?[^\]]*\]"
+# (x)-[:包含]->(c:Category) 或 (c:Category)<-[:包含]-(x)：方向寫反
+_REVERSED_INTO_CATEGORY = re.compile(rf"({_NODE})\s*-\s*({_CONTAINS_REL})\s*->\s*(\([^()]*:\s*Category\b[^()]*\))")
+_REVERSED_FROM_CATEGORY = re.compile(rf"(\([^()]*:\s*Category\b[^()]*\))\s*<-\s*({_CONTAINS_REL})\s*-\s*({_NODE})")
+
+# 驗證統計
+cypher_stats: Dict[str, int] = {"checked": 0, "repaired": 0, "rejected": 0}
+rejection_reasons: Dict[str, int] = {}
+_stats_lock = threading.Lock()
+
+
+class CypherRejected(Exception):
+    """查詢不允許執行"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def _mask_strings(query: str) -> str:
+    """將字串常值替換成等長空白，避免字串內容被誤判成關鍵字"""
+    return _STRING_LITERAL.sub(lambda m: '"' + " " * (len(m.group()) - 2) + '"', query)
+
+
+def _check_read_only(masked: str):
+    if ";" in masked:
+        raise CypherRejected("multiple_statements")
+    masked = _BACKTICK_IDENTIFIER.sub(lambda m: " " * len(m.group()), masked)
+    aliases = {alias.upper() for alias in _ALIAS.findall(masked)}
+    for match in _WRITE_CLAUSE.finditer(masked):
+        keyword = match.group(1).upper()
+        # 以 AS 宣告成變數名稱的字（WITH n AS set ... set.name）不是子句
+        if keyword in aliases:
+            continue
+        raise CypherRejected(f"write_clause:{keyword}")
+    if not masked.lstrip().upper().startswith(READ_CLAUSES):
+        raise CypherRejected("not_a_read_query")
+
+
+def _check_cartesian(masked: str):
+    """同一個 MATCH 中以逗號分隔、彼此沒有共同變數的模式會造成笛卡兒積"""
+    parts = _CLAUSE_SPLIT.split(masked)
+    for index in range(1, len(parts) - 1, 2):
+        if not parts[index].upper().endswith("MATCH"):
+            continue
+        patterns = _split_top_level(parts[index + 1])
+        if len(patterns) < 2:
+            continue
+        variables = [set(_NODE_VARIABLE.findall(p)) | set(_REL_VARIABLE.findall(p)) for p in patterns]
+        connected = variables[0]
+        pending = variables[1:]
+        while pending:
+            joined = [v for v in pending if v & connected]
+            if not joined:
+                raise CypherRejected("cartesian_product")
+            for v in joined:
+                connected |= v
+                pending.remove(v)
+
+
+def _split_top_level(pattern: str) -> List[str]:
+    parts, depth, current = [], 0, ""
+    for char in pattern:
+        if char in "([{":
+            depth += 1
+        elif char in ")]}":
+            depth -= 1
+        if char == "," and depth == 0:
+            parts.append(current)
+            current = ""
+        else:
+            current += char
+    parts.append(current)
+    return [p for p in parts if p.strip()]
+
+
+def _bound_paths(query: str, masked: str) -> str:
+    """
+    關係模式中的可變長度路徑補上 / 壓低上限。
+    在遮蔽字串後的查詢上找位置（字串內容不會被誤判），再以原查詢的對應片段組回
+    """
+    pieces, last = [], 0
+    for match in _VAR_LENGTH.finditer(masked):
+        arrow = query[match.start(1):match.end(1)]
+        prefix = query[match.start(2):match.end(2)]
+        suffix = query[match.start(5):match.end(5)]
+        low, high = match.group(3), match.group(4)
+        low_value = int(low) if low else 1
+        if high is None and low:
+            # [*3] 代表固定長度
+            high_value = low_value
+        else:
+            high_value = min(int(high), MAX_PATH_LENGTH) if high else MAX_PATH_LENGTH
+        low_value = min(low_value, high_value)
+        pieces.append(query[last:match.start()])
+        pieces.append(f"{arrow}[{prefix}*{low_value}..{high_value}{suffix}]")
+        last = match.end()
+    pieces.append(query[last:])
+    return "".join(pieces)
+
+
+def _fix_contains_direction(query: str) -> str:
+    query = _REVERSED_INTO_CATEGORY.sub(lambda m: f"{m.group(3)}-{m.group(2)}->{m.group(1)}", query)
+    query = _REVERSED_FROM_CATEGORY.sub(lambda m: f"{m.group(1)}-{m.group(2)}->{m.group(3)}", query)
+    return query
+
+
+def _enforce_limit(query: str, max_limit: int) -> str:
+    """結尾沒有 LIMIT 時補上；LIMIT 過大或不是數字常值（參數、運算式）時改成 max_limit"""
+    match = _LIMIT.search(_mask_strings(query))
+    # LIMIT 之後還有其他子句（例如 WITH ... LIMIT 100 RETURN ...）時不是整個查詢的上限
+    if match is None or _CLAUSE_SPLIT.search(re.sub(r"[$.]\w+", "", match.group(1))):
+        return f"{query} LIMIT {max_limit}"
+    value = match.group(1)
+    if value.isdigit() and int(value) <= max_limit:
+        return query
+    return query[:match.start()] + f"LIMIT {max_limit}"
+
+
+def validate_cypher(query: str, max_limit: int = MAX_LIMIT) -> Tuple[str, bool]:
+    """
+    檢查並修正查詢，回傳 (修正後查詢, 是否有修正)；不允許執行時拋出 CypherRejected。
+    只做靜態檢查，成本估計見 guard_cypher
+    """
+    query = query.strip().strip("`").strip()
+    query = re.sub(r";\s*$", "", query)
+    original = query
+    if not query:
+        raise CypherRejected("empty")
+    masked = _mask_strings(query)
+    _check_read_only(masked)
+    _check_cartesian(masked)
+    query = _bound_paths(query, masked)
+    query = _fix_contains_direction(query)
+    query = _enforce_limit(query, max_limit)
+    return query, query != original
+
+
+def _max_estimated_rows(plan) -> float:
+    if not plan:
+        return 0.0
+    arguments = plan.get("args") or plan.get("arguments") or {}
+    rows = float(arguments.get("EstimatedRows", 0) or 0)
+    for child in plan.get("children", []):
+        rows = max(rows, _max_estimated_rows(child))
+    return rows
+
+
+def _has_operator(plan, name: str) -> bool:
+    if not plan:
+        return False
+    if name in (plan.get("operatorType") or ""):
+        return True
+    return any(_has_operator(child, name) for child in plan.get("children", []))
+
+
+def _record(outcome: str, reason: Optional[str] = None):
+    with _stats_lock:
+        cypher_stats[outcome] = cypher_stats.get(outcome, 0) + 1
+        if reason:
+            rejection_reasons[reason] = rejection_reasons.get(reason, 0) + 1
+
+
+def extract_cypher(text: str) -> str:
+    """取出模型回應中 ``` 區塊內的查詢（沒有區塊時使用整段回應）"""
+    match = re.search(r"```(?:cypher)?(.*?)```", text, re.DOTALL | re.IGNORECASE)
+    return (match.group(1) if match else text).strip()
+
+
+def check_plan(plan, max_estimated_rows: float = MAX_ESTIMATED_ROWS):
+    """檢查 EXPLAIN 的執行計畫；含笛卡兒積或估計列數過大時拋出 CypherRejected"""
+    if _has_operator(plan, "CartesianProduct"):
+        raise CypherRejected("cartesian_product")
+    if _max_estimated_rows(plan) > max_estimated_rows:
+        raise CypherRejected("estimated_rows")
+
+
+async def guard_cypher(query: str, graph, max_limit: int = MAX_LIMIT) -> str:
+    """
+    檢查、修正並以 EXPLAIN（只規劃不執行）估計成本，回傳可執行的查詢；不允許執行時回傳空字串。
+    graph.explain 與實際查詢一樣先參數化，規劃結果會留在執行計畫快取供接著的查詢使用
+    """
+    try:
+        checked, repaired = validate_cypher(query, max_limit)
+        try:
+            plan = await graph.explain(checked)
+        except Exception as e:
+            # 語法錯誤在規劃階段就會發現，不必真的執行
+            raise CypherRejected(f"explain_failed:{type(e).__name__}")
+        check_plan(plan)
+    except CypherRejected as e:
+        _record("rejected", e.reason)
+        print(f"Cypher 查詢被拒絕（{e.reason}）: {query}")
+        return ""
+    _record("checked")
+    if repaired:
+        _record("repaired")
+        print(f"Cypher 查詢已修正: {checked}")
+    return checked
+
+
+def guard_stats() -> dict:
+    with _stats_lock:
+        return {**cypher_stats, "rejection_reasons": dict(rejection_reasons)}
@@ -0,0 +1,93 @@
+"""
+Cypher 字串常值參數化
+LLM 產生的查詢把搜尋字詞直接寫在查詢內（CONTAINS "飲食"），Neo4j 會把每個字詞不同的查詢視為新查詢重新規劃。
+執行前把字串常值換成參數（CONTAINS $p0），相同結構的查詢就能共用 Neo4j 的執行計畫快取
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+from langchain_community.graphs import Neo4jGraph
+
+_STRING_LITERAL = re.compile(r"'((?:[^'\\]|\\.)*)'|\"((?:[^\"\\]|\\.)*)\"")
+_ESCAPE = re.compile(r"\\(.)")
+READ_CLAUSES = ("MATCH", "OPTIONAL", "WITH", "UNWIND", "RETURN")
+
+# 追蹤的查詢結構數上限（超過時淘汰最久未使用的）
+MAX_TRACKED_SHAPES = 1000
+
+
+def parameterize(query: str) -> Tuple[str, Dict[str, str]]:
+    """將字串常值換成 $p0、$p1…，回傳 (查詢模板, 參數)"""
+    params: Dict[str, str] = {}
+
+    def replace(match):
+        raw = match.group(1) if match.group(1) is not None else match.group(2)
+        name = f"p{len(params)}"
+        params[name] = _ESCAPE.sub(r"\1", raw)
+        return f"${name}"
+
+    return _STRING_LITERAL.sub(replace, query), params
+
+
+class PlanCacheStats:
+    """
+    以查詢結構（參數化後的模板）估計 Neo4j 執行計畫快取命中率：同一結構再次執行時會直接使用快取的計畫。
+    並比較首次與重複執行的 result_available_after（含規劃時間）
+    """
+
+    def __init__(self, max_shapes: int = MAX_TRACKED_SHAPES):
+        self.max_shapes = max_shapes
+        self.executions = 0
+        self.repeats = 0
+        self._first_ms = 0.0
+        self._repeat_ms = 0.0
+        self._shapes: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, template: str, available_after_ms: float):
+        with self._lock:
+            self.executions += 1
+            if template in self._shapes:
+                self.repeats += 1
+                self._repeat_ms += available_after_ms
+                self._shapes[template] += 1
+                self._shapes.move_to_end(template)
+            else:
+                self._first_ms += available_after_ms
+                self._shapes[template] = 1
+                if len(self._shapes) > self.max_shapes:
+                    self._shapes.popitem(last=False)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            first = self.executions - self.repeats
+            return {
+                "executions": self.executions,
+                "distinct_shapes": len(self._shapes),
+                "plan_cache_hit_rate": round(self.repeats / self.executions, 3) if self.executions else 0.0,
+                "first_available_after_ms": round(self._first_ms / first, 1) if first else None,
+                "repeat_available_after_ms": round(self._repeat_ms / self.repeats, 1) if self.repeats else None,
+            }
+
+
+plan_cache_stats = PlanCacheStats()
+
+
+class ParameterizedNeo4jGraph(Neo4jGraph):
+    """
+    執行查詢類語句前先參數化字串常值；結構描述等內部查詢維持原樣。
+    執行仍交給 Neo4jGraph.query（保留其逾時、結果整理與 CypherSyntaxError → ValueError 的處理）；
+    這條路徑拿不到 result_available_after，改以整個呼叫的耗時記錄
+    """
+
+    def query(self, query: str, params: dict = {}, **kwargs):
+        if params or kwargs or not query.lstrip().upper().startswith(READ_CLAUSES):
+            return super().query(query, params, **kwargs)
+        template, params = parameterize(query)
+        start = time.perf_counter()
+        records = super().query(template, params)
+        plan_cache_stats.record(template, (time.perf_counter() - start) * 1000)
+        return records
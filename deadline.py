@@ -0,0 +1,88 @@
+"""
+請求期限與各階段時間預算
+每個請求帶一個總期限，各階段（連線、檢索、生成）取「階段預算」與「剩餘時間」較小者作為逾時，
+逾時時由呼叫端降級（略過中文鏈、改用直接查詢、只回傳大綱等），讓延遲上限由設定決定
+"""
+import asyncio
+import threading
+import time
+from typing import AsyncIterator, Dict, Optional
+
+from config import REQUEST_DEADLINE, STAGE_TIMEOUTS
+
+# 剩餘時間不到階段預算的這個比例時，直接略過該階段
+MIN_STAGE_FRACTION = 0.5
+
+# 各階段逾時次數
+timeout_stats: Dict[str, int] = {}
+_stats_lock = threading.Lock()
+
+
+class StageTimeout(Exception):
+    """某階段超過時間預算"""
+
+    def __init__(self, stage: str, timeout: float):
+        super().__init__(f"{stage} 階段逾時（{timeout:.1f}s）")
+        self.stage = stage
+        self.timeout = timeout
+
+
+def record_timeout(stage: str):
+    with _stats_lock:
+        timeout_stats[stage] = timeout_stats.get(stage, 0) + 1
+    print(f"階段逾時: {stage}")
+
+
+class Deadline:
+    """單一請求的總期限"""
+
+    def __init__(self, seconds: float = REQUEST_DEADLINE, stage_timeouts: Optional[Dict[str, float]] = None):
+        self.expires_at = time.monotonic() + seconds
+        self.stage_timeouts = stage_timeouts or STAGE_TIMEOUTS
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def budget(self, stage: str) -> float:
+        """該階段可用的秒數：階段預算與剩餘時間取小"""
+        return min(self.stage_timeouts.get(stage, self.remaining()), self.remaining())
+
+    def allows(self, stage: str, reserve: float = 0.0) -> bool:
+        """扣除保留給後續階段的秒數後，剩餘時間是否還有該階段預算的一半以上"""
+        return self.remaining() - reserve >= self.stage_timeouts.get(stage, 0) * MIN_STAGE_FRACTION
+
+    async def run_async(self, stage: str, awaitable):
+        """等待協程，超過預算時拋出 StageTimeout"""
+        timeout = self.budget(stage)
+        try:
+            return await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError:
+            record_timeout(stage)
+            raise StageTimeout(stage, timeout) from None
+
+    async def stream(self, stage: str, chunks: AsyncIterator) -> AsyncIterator:
+        """逐一轉送串流內容；整個階段超過預算時關閉來源串流並拋出 StageTimeout"""
+        timeout = self.budget(stage)
+        stage_deadline = time.monotonic() + timeout
+        iterator = chunks.__aiter__()
+        try:
+            while True:
+                remaining = stage_deadline - time.monotonic()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                try:
+                    chunk = await asyncio.wait_for(iterator.__anext__(), remaining)
+                except StopAsyncIteration:
+                    return
+                yield chunk
+        except asyncio.TimeoutError:
+            record_timeout(stage)
+            raise StageTimeout(stage, timeout) from None
+        finally:
+            aclose = getattr(iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
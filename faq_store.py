@@ -0,0 +1,280 @@
+"""
+常見問題預先產生的回答庫
+離線工作（backend/scripts/build_faq_store.py）從問題紀錄挑出高頻問題群組、跑完整流程並檢核後，
+寫入有版本號的單一檔案；線上以 mmap 讀取，問題正規化後與收錄的問法完全相同才直接回傳大綱與詳細回答，
+不必查詢與生成（相似但不同的問題，例如分期、數量或食物不同，答案可能不同，因此線上不做模糊比對）。
+
+檔案格式：
+    MAGIC(4) | 標頭長度 uint32 | 標頭 JSON | 回答 JSON 區塊...
+標頭記錄版本號、知識圖譜指紋與每個問題群組的問法及其回答在檔案中的位置；
+回答只在命中時才從 mmap 讀出解析
+"""
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import unicodedata
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from config import FAQ_STORE_FILE, FAQ_MATCH_THRESHOLD
+
+MAGIC = b"FAQS"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<4sI")
+
+# 檔案變更檢查間隔（秒），離線重建後線上會自動載入新版本
+RELOAD_INTERVAL = 30.0
+
+
+def normalize_question(question: str) -> str:
+    """去除空白、全半形差異與結尾標點，讓同一問題的不同寫法對應到同一個鍵"""
+    text = unicodedata.normalize("NFKC", question or "").lower()
+    text = re.sub(r"\s+", "", text)
+    return text.rstrip("?？!！。.,，~～")
+
+
+def _bigrams(text: str) -> set:
+    return {text[i:i + 2] for i in range(len(text) - 1)} or {text}
+
+
+def similarity(a: str, b: str) -> float:
+    """兩個正規化問題的字元雙字組 Dice 相似度"""
+    grams_a, grams_b = _bigrams(a), _bigrams(b)
+    return 2 * len(grams_a & grams_b) / (len(grams_a) + len(grams_b))
+
+
+# 決定答案內容的字詞：兩個問法在這些字詞上不同時，即使字面相似也不能共用答案
+_NEGATIONS = ("不", "沒", "別", "勿")
+# 食物與數量名詞；依長度由長到短比對，避免「水腫」「水果」被當成「水」
+_ANSWER_TERMS = sorted([
+    "水", "水分", "水果", "水腫", "開水", "牛奶", "奶", "豆漿", "茶", "咖啡", "果汁", "湯", "酒",
+    "肉", "紅肉", "雞肉", "魚", "海鮮", "蛋", "蛋白", "蛋白質", "豆", "豆腐", "堅果", "香蕉", "楊桃",
+    "蔬菜", "青菜", "鹽", "醬油", "糖", "米", "飯", "麵", "麵包", "鉀", "磷", "鈉", "鈣",
+    "多少", "幾", "杯", "碗", "克", "公克", "毫升", "cc", "公斤", "次", "天", "週", "月", "年",
+], key=len, reverse=True)
+_NUMBERS = re.compile(r"\d+(?:\.\d+)?|[一二三四五六七八九十兩半]")
+
+
+def answer_signature(key: str) -> tuple:
+    """問題中決定答案的部分：數字 / 分期數字、否定詞與食物、數量名詞"""
+    numbers = tuple(sorted(_NUMBERS.findall(key)))
+    negations = tuple(sorted(n for n in _NEGATIONS if n in key))
+    terms = set()
+    i = 0
+    while i < len(key):
+        for term in _ANSWER_TERMS:
+            if key.startswith(term, i):
+                terms.add(term)
+                i += len(term)
+                break
+        else:
+            i += 1
+    return numbers, negations, tuple(sorted(terms))
+
+
+def cluster_questions(questions: Iterable[str], threshold: float = FAQ_MATCH_THRESHOLD) -> List[dict]:
+    """
+    將問題依出現次數由高到低貪婪分群：與既有群組代表問題夠相似、且數字 / 分期、否定詞與食物、數量名詞
+    完全相同才併入，否則成為新群組（併入的問法線上會直接命中，因此寧可少併也不能併錯）。
+    回傳依群組總次數排序的 [{"question": 代表問法, "variants": [...], "count": n}]
+    """
+    counts: Dict[str, int] = {}
+    originals: Dict[str, str] = {}
+    for question in questions:
+        key = normalize_question(question)
+        if not key:
+            continue
+        counts[key] = counts.get(key, 0) + 1
+        originals.setdefault(key, question.strip())
+
+    clusters: List[dict] = []
+    for key, count in sorted(counts.items(), key=lambda item: -item[1]):
+        signature = answer_signature(key)
+        for cluster in clusters:
+            if cluster["signature"] == signature and similarity(key, cluster["key"]) >= threshold:
+                cluster["variants"].append(key)
+                cluster["count"] += count
+                break
+        else:
+            clusters.append({"key": key, "question": originals[key], "variants": [key], "count": count,
+                             "signature": signature})
+    clusters.sort(key=lambda cluster: -cluster["count"])
+    for cluster in clusters:
+        del cluster["signature"]
+    return clusters
+
+
+def graph_fingerprint(graph) -> str:
+    """知識圖譜內容的雜湊；圖譜節點、屬性或關係有變動時即不同，用來判斷回答庫是否需要重建"""
+    nodes = graph.query(
+        "MATCH (n) RETURN labels(n) AS labels, properties(n) AS props"
+    )
+    relationships = graph.query(
+        "MATCH (a)-[r]->(b) RETURN type(r) AS type, properties(a) AS source, properties(b) AS target"
+    )
+    lines = sorted(json.dumps(row, ensure_ascii=False, sort_keys=True, default=str)
+                   for row in list(nodes) + list(relationships))
+    digest = hashlib.sha256()
+    for line in lines:
+        digest.update(line.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def write_store(path: str, entries: List[dict], graph_fingerprint: str, version: int) -> dict:
+    """
+    寫入新版本回答庫（先寫暫存檔再原子替換，線上讀取端不會看到寫到一半的檔案）。
+    entries: [{"question", "variants", "count", "outline", "detail", "ckd_stage"}]
+    ckd_stage 為問題針對的 CKD 分期（沒有特定分期時為 None），已設定分期的病人只會取得同一分期的回答
+    """
+    payload = bytearray()
+    index = []
+    for entry in entries:
+        answer = json.dumps({"outline": entry["outline"], "detail": entry["detail"]},
+                            ensure_ascii=False).encode("utf-8")
+        index.append({
+            "question": entry["question"],
+            "variants": entry["variants"],
+            "count": entry.get("count", 0),
+            "ckd_stage": entry.get("ckd_stage"),
+            "offset": len(payload),
+            "length": len(answer),
+        })
+        payload += answer
+
+    header = {
+        "format": FORMAT_VERSION,
+        "version": version,
+        "graph_fingerprint": graph_fingerprint,
+        "built_at": datetime.now().isoformat(),
+        "entries": index,
+    }
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, len(header_bytes)))
+        f.write(header_bytes)
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return header
+
+
+def read_header(path: str) -> Optional[dict]:
+    """只讀取回答庫標頭；檔案不存在或格式不符時回傳 None"""
+    try:
+        with open(path, "rb") as f:
+            magic, header_length = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != MAGIC:
+                return None
+            return json.loads(f.read(header_length).decode("utf-8"))
+    except (OSError, struct.error, ValueError):
+        return None
+
+
+class FAQStore:
+    """
+    以 mmap 讀取的常見問題回答庫；檔案被離線工作替換後自動載入新版本。
+    只以正規化後的問題查表（O(1)），不做模糊比對
+    """
+
+    def __init__(self, path: str = FAQ_STORE_FILE):
+        self.path = path
+        self.header: Optional[dict] = None
+        self.hits = 0
+        self.misses = 0
+        self._mmap: Optional[mmap.mmap] = None
+        self._data_offset = 0
+        self._exact: Dict[str, dict] = {}
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            self._close()
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, header_length = _HEADER.unpack_from(mapped, 0)
+            if magic != MAGIC:
+                raise ValueError("不是回答庫檔案")
+            header = json.loads(mapped[_HEADER.size:_HEADER.size + header_length].decode("utf-8"))
+        except (OSError, struct.error, ValueError) as e:
+            print(f"常見問題回答庫載入失敗: {e}")
+            return
+        self._close()
+        self._mmap = mapped
+        self._data_offset = _HEADER.size + header_length
+        self.header = header
+        self._exact = {variant: entry for entry in header["entries"] for variant in entry["variants"]}
+        self._mtime = mtime
+        print(f"常見問題回答庫已載入: 版本 {header['version']}，{len(header['entries'])} 題")
+
+    def _close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+        self._mmap = None
+        self.header = None
+        self._exact = {}
+        self._mtime = None
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at >= RELOAD_INTERVAL:
+            self._checked_at = now
+            self._load()
+
+    def _match(self, key: str) -> Optional[dict]:
+        return self._exact.get(key)
+
+    def lookup(self, question: str) -> Optional[dict]:
+        """回傳 {"outline", "detail", "question", "version", "ckd_stage"}；沒有相符的常見問題時回傳 None"""
+        with self._lock:
+            self._maybe_reload()
+            if self._mmap is None:
+                return None
+            key = normalize_question(question)
+            entry = self._match(key) if key else None
+            if entry is None:
+                self.misses += 1
+                return None
+            start = self._data_offset + entry["offset"]
+            answer = json.loads(self._mmap[start:start + entry["length"]].decode("utf-8"))
+            answer["version"] = self.header["version"]
+            self.hits += 1
+        answer["question"] = entry["question"]
+        answer["ckd_stage"] = entry.get("ckd_stage")
+        return answer
+
+    def matches(self, question: str, ckd_stage: Optional[int] = None) -> bool:
+        """
+        只判斷是否有相符的常見問題（不讀取回答、不計入統計），供排程判斷是否需要佔用名額；
+        指定 ckd_stage 時，回答必須標記為同一分期
+        """
+        with self._lock:
+            self._maybe_reload()
+            key = normalize_question(question)
+            entry = self._match(key) if self._mmap is not None and key else None
+            return entry is not None and (ckd_stage is None or entry.get("ckd_stage") == ckd_stage)
+
+    def stats(self) -> dict:
+        return {
+            "version": self.header["version"] if self.header else None,
+            "entries": len(self.header["entries"]) if self.header else 0,
+            "built_at": self.header["built_at"] if self.header else None,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
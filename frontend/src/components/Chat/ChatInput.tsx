@@ -67,6 +67,9 @@ export default function ChatInput({ sessionId }: Props) {
                             outline: outlineText,
                             detail: detailText
                         });
+                    } else if (event.type === 'title') {
+                        // Server-side title for a new session
+                        updateSession(sessionId, { name: event.content });
                     } else if (event.type === 'status') {
                         // Optionally show status updates
                         console.log('Status:', event.content);
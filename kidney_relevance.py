@@ -0,0 +1,199 @@
+"""
+問題相關性判斷
+以 Aho–Corasick 多模式比對關鍵字，並搭配字元 n-gram 單純貝氏分類器給出信心分數，
+在進入知識圖譜或 LLM 之前先過濾與腎臟健康無關的問題
+"""
+import math
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Set, Tuple
+
+from config import RELEVANCE_ACCEPT_THRESHOLD, RELEVANCE_REJECT_THRESHOLD
+
+# 強關鍵字：出現即可視為腎臟相關
+STRONG_KEYWORDS = [
+    '腎', '腎臟', '慢性腎臟病', '腎功能', '腎病', '腎衰竭', '腎炎', '腎絲球', '腎小管', '腎元',
+    '腎臟保健', '腎臟檢查', '腎臟藥物', '腎臟飲食', '腎臟營養', '腎衰竭預防', '腎臟移植',
+    '尿', '尿毒', '蛋白尿', '血尿', '透析', '洗腎', '血液透析', '腹膜透析', '肌酸酐',
+    'ckd', 'egfr', 'gfr', 'kidney', 'renal', 'dialysis', 'creatinine', 'bun', 'uacr',
+]
+
+# 弱關鍵字：常見於腎臟衛教，但單獨出現不足以判定
+WEAK_KEYWORDS = [
+    '飲食', '蛋白質', '鉀', '磷', '鈉', '鹽', '水腫', '血壓', '血糖', '糖尿病', '尿酸',
+    '痛風', '貧血', '止痛藥', '喝水', '水分', '低蛋白', '營養', '抽血', '檢驗',
+]
+
+STRONG_KEYWORD_SCORE = 0.95
+WEAK_KEYWORD_SCORE = 0.6
+
+# 分類器訓練語料（啟動時即時訓練，數量少、成本低）
+_ON_TOPIC_SAMPLES = [
+    '腎臟病患者飲食要注意什麼', '慢性腎臟病可以吃香蕉嗎', '洗腎的病人可以喝多少水',
+    'eGFR 是什麼意思', '肌酸酐太高怎麼辦', '蛋白尿代表什麼', '腹膜透析和血液透析差在哪',
+    '腎功能不好可以吃止痛藥嗎', '第三期腎臟病要限制蛋白質嗎', '高血鉀要避免哪些食物',
+    '磷太高會怎樣', '腳水腫跟腎臟有關嗎', '糖尿病會不會傷腎', '血壓高對腎臟的影響',
+    '如何預防腎衰竭', '腎臟移植後要注意什麼', '尿液有泡泡是正常的嗎', '低蛋白飲食怎麼吃',
+    '洗腎前要做哪些準備', '腎臟檢查需要空腹嗎', '透析病人可以運動嗎', '吃太鹹對腎臟不好嗎',
+    '腎病可以吃中藥嗎', '尿酸高會影響腎功能嗎', '慢性腎病貧血怎麼辦', '每天喝多少水對腎好',
+    'what does ckd stage 3 mean', 'kidney diet for dialysis patients', 'how to lower creatinine',
+]
+
+_OFF_TOPIC_SAMPLES = [
+    '今天天氣如何', '推薦一部好看的電影', '台積電股價會漲嗎', '怎麼寫 python 程式',
+    '明天會下雨嗎', '幫我寫一首詩', '日本旅遊景點推薦', '週末去哪裡玩', '最近有什麼新聞',
+    '籃球比賽誰贏了', '如何學好英文', '手機沒電怎麼辦', '推薦好吃的拉麵店', '怎麼煮咖啡',
+    '你叫什麼名字', '講個笑話', '世界上最高的山是哪座', '比特幣值得投資嗎', '如何申請護照',
+    '電腦開不了機', '貓咪為什麼一直叫', '怎麼準備面試', '高鐵票怎麼訂', '最新的 iphone 多少錢',
+    'what is the weather today', 'write me a poem', 'best laptop to buy', 'tell me a joke',
+]
+
+
+@dataclass
+class RelevanceResult:
+    """相關性判斷結果"""
+    score: float
+    route: str  # "accept" / "borderline" / "reject"
+    keywords: List[str] = field(default_factory=list)
+
+    @property
+    def is_related(self) -> bool:
+        """只有 accept 視為相關；borderline 由呼叫端另行處理（例如請使用者補充說明）"""
+        return self.route == "accept"
+
+
+class AhoCorasick:
+    """預先編譯的多模式字串比對器，單次掃描即可找出所有關鍵字"""
+
+    def __init__(self, patterns):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[Set[str]] = [set()]
+        for pattern in dict.fromkeys(patterns):  # 去除重複關鍵字並保留順序
+            self._add(pattern)
+        self._build()
+
+    def _add(self, pattern: str):
+        state = 0
+        for char in pattern:
+            nxt = self._goto[state].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][char] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(set())
+            state = nxt
+        self._output[state].add(pattern)
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[nxt] = self._goto[fallback].get(char, 0)
+                self._output[nxt] |= self._output[self._fail[nxt]]
+
+    def find_all(self, text: str) -> Set[str]:
+        """
+        回傳文字中出現的所有關鍵字；英文關鍵字須為完整單字
+        （前後不能緊接英文字母，避免 'bun' 比對到 'bundle'；'ckd3' 仍可比對到 'ckd'）
+        """
+        found = set()
+        state = 0
+        for end, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for pattern in self._output[state]:
+                if pattern not in found and _on_word_boundary(text, end - len(pattern) + 1, end + 1, pattern):
+                    found.add(pattern)
+        return found
+
+
+def _is_latin(char: str) -> bool:
+    return char.isascii() and char.isalpha()
+
+
+def _on_word_boundary(text: str, start: int, end: int, pattern: str) -> bool:
+    """中文關鍵字不受限制；英文關鍵字的前後字元不可為英文字母"""
+    if _is_latin(pattern[0]) and start > 0 and _is_latin(text[start - 1]):
+        return False
+    if _is_latin(pattern[-1]) and end < len(text) and _is_latin(text[end]):
+        return False
+    return True
+
+
+def _char_ngrams(text: str, n_values: Tuple[int, ...] = (1, 2)) -> List[str]:
+    text = ''.join(text.lower().split())
+    grams = []
+    for n in n_values:
+        grams.extend(text[i:i + n] for i in range(len(text) - n + 1))
+    return grams
+
+
+class NgramClassifier:
+    """字元 n-gram 多項式單純貝氏分類器（二元：相關 / 不相關）"""
+
+    def __init__(self, positive_samples, negative_samples):
+        self._log_prior, self._log_likelihood, self._log_unseen = {}, {}, {}
+        for label, samples in ((True, positive_samples), (False, negative_samples)):
+            counts: Dict[str, int] = {}
+            for sample in samples:
+                for gram in _char_ngrams(sample):
+                    counts[gram] = counts.get(gram, 0) + 1
+            self._log_prior[label] = math.log(len(samples))
+            self._log_likelihood[label] = counts
+        vocabulary = set(self._log_likelihood[True]) | set(self._log_likelihood[False])
+        for label in (True, False):
+            counts = self._log_likelihood[label]
+            denominator = sum(counts.values()) + len(vocabulary)
+            self._log_likelihood[label] = {
+                gram: math.log((count + 1) / denominator) for gram, count in counts.items()
+            }
+            self._log_unseen[label] = math.log(1 / denominator)
+        self._vocabulary = vocabulary
+
+    def predict_proba(self, text: str) -> float:
+        """回傳問題與腎臟健康相關的機率；未見過的 n-gram 不計分"""
+        grams = [gram for gram in _char_ngrams(text) if gram in self._vocabulary]
+        if not grams:
+            return 0.5
+        scores = {}
+        for label in (True, False):
+            likelihood = self._log_likelihood[label]
+            unseen = self._log_unseen[label]
+            scores[label] = self._log_prior[label] + sum(likelihood.get(g, unseen) for g in grams)
+        diff = max(min(scores[False] - scores[True], 50.0), -50.0)
+        return 1.0 / (1.0 + math.exp(diff))
+
+
+_strong_matcher = AhoCorasick(STRONG_KEYWORDS)
+_weak_matcher = AhoCorasick(WEAK_KEYWORDS)
+_classifier = NgramClassifier(_ON_TOPIC_SAMPLES, _OFF_TOPIC_SAMPLES)
+
+
+def classify_question(question: str) -> RelevanceResult:
+    """計算問題的相關性分數並決定路由"""
+    text = (question or '').lower()
+    strong = _strong_matcher.find_all(text)
+    weak = _weak_matcher.find_all(text)
+
+    keyword_score = 0.0
+    if strong:
+        keyword_score = STRONG_KEYWORD_SCORE
+    elif weak:
+        keyword_score = WEAK_KEYWORD_SCORE
+    score = max(keyword_score, _classifier.predict_proba(text)) if text.strip() else 0.0
+
+    if score >= RELEVANCE_ACCEPT_THRESHOLD:
+        route = "accept"
+    elif score >= RELEVANCE_REJECT_THRESHOLD:
+        route = "borderline"
+    else:
+        route = "reject"
+    return RelevanceResult(score=score, route=route, keywords=sorted(strong | weak))
@@ -0,0 +1,195 @@
+"""
+Ollama 模型連線管理
+以共用 HTTP 連線池建立聊天模型、明確設定 keep_alive，
+提供啟動時預熱模型以及健康狀態 / 延遲統計
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+import httpx
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_ollama import ChatOllama
+from ollama import AsyncClient
+
+from circuit_breaker import CircuitBreaker
+from config import OLLAMA_BASE_URL, OLLAMA_KEEP_ALIVE, OLLAMA_MAX_CONNECTIONS, OLLAMA_TIMEOUT
+
+# 每個模型保留最近幾次呼叫的延遲，用於計算 p50 / p95
+LATENCY_WINDOW = 200
+
+
+class LLMStats(BaseCallbackHandler):
+    """以 LangChain callback 收集單一模型的呼叫次數、錯誤、延遲與首字延遲，並回報給斷路器"""
+
+    def __init__(self, model: str, breaker: Optional[CircuitBreaker] = None):
+        self.model = model
+        self.breaker = breaker
+        self.calls = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.last_error: Optional[str] = None
+        self.last_success_at: Optional[float] = None
+        self.warmed_up = False
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._first_token = deque(maxlen=LATENCY_WINDOW)
+        # Ollama 回報的 prompt 處理量；命中 KV cache 的前綴不會計入 prompt_eval_count
+        self._prompt_eval_seconds = deque(maxlen=LATENCY_WINDOW)
+        self._prompt_eval_tokens = deque(maxlen=LATENCY_WINDOW)
+        self._running: Dict[UUID, List[Optional[float]]] = {}
+        self._lock = threading.Lock()
+
+    def _start(self, run_id: UUID):
+        with self._lock:
+            self.calls += 1
+            self._running[run_id] = [time.perf_counter(), None]
+        if self.breaker:
+            # 半開時由實際的模型呼叫擔任試探請求
+            self.breaker.start_call()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs: Any):
+        self._start(run_id)
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, **kwargs: Any):
+        self._start(run_id)
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any):
+        with self._lock:
+            timing = self._running.get(run_id)
+            if timing and timing[1] is None:
+                timing[1] = time.perf_counter()
+                self._first_token.append(timing[1] - timing[0])
+
+    @staticmethod
+    def _ollama_metadata(response) -> dict:
+        """取出 Ollama 最後一個回應附帶的統計欄位（prompt_eval_count / prompt_eval_duration 等）"""
+        try:
+            generation = response.generations[0][0]
+        except (AttributeError, IndexError):
+            return {}
+        metadata = dict(generation.generation_info or {})
+        message = getattr(generation, "message", None)
+        if message is not None:
+            metadata.update(message.response_metadata or {})
+        return metadata
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any):
+        metadata = self._ollama_metadata(response)
+        with self._lock:
+            timing = self._running.pop(run_id, None)
+            if timing:
+                elapsed = time.perf_counter() - timing[0]
+                self._latencies.append(elapsed)
+                self.total_seconds += elapsed
+            if "prompt_eval_duration" in metadata:
+                self._prompt_eval_seconds.append(metadata["prompt_eval_duration"] / 1e9)
+                self._prompt_eval_tokens.append(metadata.get("prompt_eval_count") or 0)
+            self.last_success_at = time.time()
+        if self.breaker:
+            self.breaker.record_success()
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        with self._lock:
+            self._running.pop(run_id, None)
+            # 使用者中斷或逾時關閉串流不算模型錯誤（逾時由呼叫端另外回報斷路器）
+            if isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+                return
+            self.errors += 1
+            self.last_error = str(error)
+        if self.breaker:
+            self.breaker.record_failure()
+
+    @staticmethod
+    def _percentile(values, ratio: float) -> Optional[float]:
+        if not values:
+            return None
+        ordered = sorted(values)
+        return round(ordered[min(int(len(ordered) * ratio), len(ordered) - 1)], 3)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            latencies = list(self._latencies)
+            first_token = list(self._first_token)
+            prompt_eval_seconds = list(self._prompt_eval_seconds)
+            prompt_eval_tokens = list(self._prompt_eval_tokens)
+            in_flight = len(self._running)
+        return {
+            "model": self.model,
+            "warmed_up": self.warmed_up,
+            "calls": self.calls,
+            "errors": self.errors,
+            "total_seconds": round(self.total_seconds, 3),
+            "in_flight": in_flight,
+            "last_error": self.last_error,
+            "last_success_at": self.last_success_at,
+            "latency_p50": self._percentile(latencies, 0.5),
+            "latency_p95": self._percentile(latencies, 0.95),
+            "first_token_p50": self._percentile(first_token, 0.5),
+            "prompt_eval_p50": self._percentile(prompt_eval_seconds, 0.5),
+            "prompt_eval_tokens_p50": self._percentile(prompt_eval_tokens, 0.5),
+        }
+
+
+class LLMClientPool:
+    """建立共用連線池的 ChatOllama 實例並追蹤其統計資料"""
+
+    def __init__(self, base_url: str = OLLAMA_BASE_URL, keep_alive: str = OLLAMA_KEEP_ALIVE,
+                 max_connections: int = OLLAMA_MAX_CONNECTIONS, timeout: float = OLLAMA_TIMEOUT):
+        self.base_url = base_url
+        self.keep_alive = keep_alive
+        self._client_kwargs = {
+            "limits": httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=300,
+            ),
+            "timeout": httpx.Timeout(timeout, connect=5.0),
+        }
+        self.models: Dict[str, ChatOllama] = {}
+        self.stats: Dict[str, LLMStats] = {}
+        # 所有模型共用同一個 Ollama 服務，因此共用一個斷路器
+        self.breaker = CircuitBreaker("ollama")
+
+    def chat_model(self, model: str, **kwargs) -> ChatOllama:
+        """取得（或建立）指定模型的 ChatOllama；同一模型共用同一組 HTTP 連線"""
+        if model not in self.models:
+            stats = LLMStats(model, self.breaker)
+            self.stats[model] = stats
+            self.models[model] = ChatOllama(
+                model=model,
+                base_url=self.base_url,
+                keep_alive=self.keep_alive,
+                client_kwargs=self._client_kwargs,
+                callbacks=[stats],
+                **kwargs
+            )
+        return self.models[model]
+
+    async def warm_up(self):
+        """預先載入所有模型到記憶體（空提示詞只載入模型，不產生 token）"""
+        client = AsyncClient(host=self.base_url, **self._client_kwargs)
+        for model, stats in self.stats.items():
+            start = time.perf_counter()
+            try:
+                await client.generate(model=model, prompt="", keep_alive=self.keep_alive)
+                stats.warmed_up = True
+                print(f"模型預熱完成: {model} ({time.perf_counter() - start:.2f}s)")
+            except Exception as e:
+                stats.last_error = str(e)
+                self.breaker.record_failure()
+                print(f"模型預熱失敗: {model} - {e}")
+
+    def health(self) -> dict:
+        return {
+            "base_url": self.base_url,
+            "keep_alive": self.keep_alive,
+            "breaker": self.breaker.snapshot(),
+            "models": [stats.snapshot() for stats in self.stats.values()],
+        }
+
+
+# Global LLM client pool
+llm_pool = LLMClientPool()
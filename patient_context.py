@@ -0,0 +1,176 @@
+"""
+病人個人化檢索
+依病人資料（CKD 分期、過敏原、體重）篩選與排序知識圖譜的檢索內容，並在生成提示詞中附上病人資料，
+讓第一次回答就符合病人狀況。病人資料隨請求傳入（由 API 層從個人資料快取讀取），不另外查詢資料庫；
+固定的 system 提示詞維持不變，以保留提示詞前綴快取
+"""
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, List, Optional, Tuple
+
+from context_format import format_record_lines
+
+# 過敏原欄位的分隔符號（逗號、頓號、分號、空白）
+_ALLERGY_SEPARATORS = re.compile(r"[,，、;；/\s]+")
+# 提到過敏原但屬於警示內容（避免 / 禁忌 / 過敏）的檢索內容仍保留，讓回答可以提醒病人；
+# 警示詞必須與過敏原在同一個子句，或（過敏原是這筆內容的主題時）警示的對象就是主題本身
+_CAUTION_WORDS = ("避免", "禁忌", "禁止", "不宜", "不可", "勿", "過敏", "avoid", "allerg", "contraindicat")
+_CLAUSE = re.compile(r"[^。；;，,！!？?：:\n]+")
+# 「過敏者避免食用」「不宜攝取」這類沒有另外指明對象、指向主題本身的警示
+_SUBJECT_CAUTION = re.compile(
+    r"(?:過敏|allerg)|(?:避免|禁止|不宜|不可|勿|avoid)\s*(?:食用|攝取|使用|服用|接觸|吃|喝|eating|using)?\s*$",
+    re.IGNORECASE,
+)
+# 含有過敏原字元但不是該過敏原的詞（例如「蛋」不能比對到「蛋白質」）
+_NOT_ALLERGEN_TERMS = ("蛋白質", "蛋白尿", "白蛋白", "蛋白", "乳酸")
+_STAGE_NUMERALS = "一二三四五"
+
+
+def _stage_pattern(stage: int) -> re.Pattern:
+    """比對「第3期 / 第三期 / 3期 / stage 3 / CKD 3 / G3a」等分期寫法"""
+    numeral = _STAGE_NUMERALS[stage - 1]
+    return re.compile(
+        rf"(?:第\s*(?:{stage}|{numeral})\s*期|(?<![\d.]){stage}\s*期|stage\s*{stage}(?![\d.])"
+        rf"|ckd\s*(?:stage\s*)?{stage}(?![\d.])|(?<![a-z0-9])g{stage}[ab]?(?![a-z0-9]))",
+        re.IGNORECASE,
+    )
+
+
+_STAGE_PATTERNS = {stage: _stage_pattern(stage) for stage in range(1, 6)}
+
+
+def mentioned_stage(text: str) -> Optional[int]:
+    """文字中提到的 CKD 分期；沒有提到或提到多個分期時回傳 None"""
+    stages = [stage for stage, pattern in _STAGE_PATTERNS.items() if pattern.search(text or "")]
+    return stages[0] if len(stages) == 1 else None
+
+
+def _record_text(record: Any) -> str:
+    return " ".join(format_record_lines([record])) if not isinstance(record, str) else record
+
+
+@lru_cache(maxsize=256)
+def _allergen_pattern(allergen: str) -> re.Pattern:
+    """英文過敏原須為完整單字（可加複數 s / es，egg 不比對 eggplant）；中文過敏原另以詞表排除複合詞"""
+    if allergen.isascii():
+        return re.compile(rf"(?<![a-z]){re.escape(allergen)}(?:e?s)?(?![a-z])")
+    return re.compile(re.escape(allergen))
+
+
+def _allergen_spans(text: str, allergen: str) -> List[Tuple[int, int]]:
+    """過敏原在（已轉小寫的）文字中出現的位置，不含落在非過敏原詞（蛋白質等）中的出現"""
+    excluded = [
+        (m.start(), m.end())
+        for term in _NOT_ALLERGEN_TERMS if allergen in term and term != allergen
+        for m in re.finditer(re.escape(term), text)
+    ]
+    return [
+        (m.start(), m.end()) for m in _allergen_pattern(allergen).finditer(text)
+        if not any(start <= m.start() and m.end() <= end for start, end in excluded)
+    ]
+
+
+@dataclass(frozen=True)
+class PatientContext:
+    """一位病人影響檢索與回答的資料"""
+
+    ckd_stage: Optional[int] = None
+    allergies: Tuple[str, ...] = ()
+    weight: Optional[float] = None
+
+    @classmethod
+    def from_profile(cls, profile: Optional[dict]) -> Optional["PatientContext"]:
+        """由儲存的個人資料建立；沒有個人資料或沒有可用欄位時回傳 None（不個人化）"""
+        if not profile:
+            return None
+        stage = profile.get("ckd_stage")
+        stage = stage if isinstance(stage, int) and stage in _STAGE_PATTERNS else None
+        allergies = tuple(dict.fromkeys(
+            a.strip().lower() for a in _ALLERGY_SEPARATORS.split(profile.get("allergies") or "")
+            if a.strip() and a.strip() not in ("無", "none", "沒有")
+        ))
+        weight = profile.get("weight") or None
+        if stage is None and not allergies:
+            return None
+        return cls(ckd_stage=stage, allergies=allergies, weight=weight)
+
+    @property
+    def key(self) -> str:
+        """
+        影響回答內容的欄位（與 note() 放進提示詞的欄位相同），用於區分合併請求與快取；
+        資料完全相同的病人才共用同一次查詢
+        """
+        weight = f"{self.weight:g}" if self.weight else ""
+        return f"stage={self.ckd_stage or ''};weight={weight};allergies={','.join(sorted(self.allergies))}"
+
+    def note(self) -> str:
+        """附在使用者問題後的病人資料說明"""
+        parts = []
+        if self.ckd_stage:
+            parts.append(f"慢性腎臟病第{self.ckd_stage}期")
+        if self.weight:
+            parts.append(f"體重{self.weight:g}公斤")
+        if self.allergies:
+            parts.append(f"過敏：{'、'.join(self.allergies)}（回答不可建議含有這些過敏原的食物或藥物）")
+        return "（病人資料：" + "；".join(parts) + "）"
+
+    def personalize_question(self, question: str) -> str:
+        """生成回答用的問題：原問題加上病人資料（Cypher 生成仍使用原問題）"""
+        return f"{question}\n{self.note()}"
+
+    def accepts_faq(self, answer: dict) -> bool:
+        """
+        通用的常見問題回答是否適用於這位病人：有分期時只接受標記為同一分期的回答，
+        回答提到病人的過敏原時不接受（改走個人化查詢）
+        """
+        if self.ckd_stage and answer.get("ckd_stage") != self.ckd_stage:
+            return False
+        return not self.mentions_allergen(answer.get("outline", "") + answer.get("detail", ""))
+
+    def mentions_allergen(self, text: str) -> bool:
+        text = text.lower()
+        return any(_allergen_spans(text, allergen) for allergen in self.allergies)
+
+    def is_unsafe(self, text: str) -> bool:
+        """
+        內容提到病人的過敏原，且並非針對該過敏原的警示：
+        每一處過敏原所在的子句都要有警示詞；過敏原是內容主題（「：」之前）時，
+        也接受沒有另外指明對象的警示（「過敏者避免食用」），但「避免高鉀水果」這種針對其他東西的不算
+        """
+        lowered = text.lower()
+        subject_end = min((i for i in (lowered.find("："), lowered.find(":")) if i >= 0), default=-1)
+        clauses = [(m.start(), m.end(), m.group()) for m in _CLAUSE.finditer(lowered)]
+        subject_cautioned = any(_SUBJECT_CAUTION.search(clause) for start, _, clause in clauses
+                                if start > subject_end >= 0)
+        for allergen in self.allergies:
+            for start, end in _allergen_spans(lowered, allergen):
+                clause = next((c for c_start, c_end, c in clauses if c_start <= start and end <= c_end), "")
+                if any(word in clause for word in _CAUTION_WORDS):
+                    continue
+                if start < subject_end and subject_cautioned:
+                    continue
+                return True
+        return False
+
+    def stage_priority(self, text: str) -> int:
+        """1：提到病人的分期；-1：只提到其他分期；0：未提到分期"""
+        if not self.ckd_stage:
+            return 0
+        if _STAGE_PATTERNS[self.ckd_stage].search(text):
+            return 1
+        if any(pattern.search(text) for stage, pattern in _STAGE_PATTERNS.items() if stage != self.ckd_stage):
+            return -1
+        return 0
+
+    def filter_records(self, records: List[Any]) -> List[Any]:
+        """
+        去除建議病人過敏原的檢索內容，並將符合病人分期的內容排在前面、只適用其他分期的排在後面
+        （穩定排序，同優先度時保留資料庫回傳的順序）
+        """
+        texts = [(record, _record_text(record)) for record in records]
+        kept = [(record, text) for record, text in texts if not self.is_unsafe(text)]
+        if len(kept) < len(texts):
+            print(f"個人化檢索：排除 {len(texts) - len(kept)} 筆含過敏原的內容")
+        kept.sort(key=lambda item: -self.stage_priority(item[1]))
+        return [record for record, _ in kept]
@@ -0,0 +1,88 @@
+"""
+結構化回答的串流解析
+單次生成同時輸出大綱與詳細說明（以區段標記分隔），串流時逐步拆成 outline / detail 片段
+"""
+from typing import Dict, List, Optional, Tuple
+
+OUTLINE_MARKER = "【大綱】"
+DETAIL_MARKER = "【詳細說明】"
+
+SECTION_MARKERS = {
+    OUTLINE_MARKER: "outline",
+    DETAIL_MARKER: "detail",
+}
+
+
+class SectionStreamParser:
+    """
+    將串流文字依區段標記拆分；標記可能被切在兩個 chunk 之間，
+    因此緩衝區尾端可能是標記開頭的文字會先保留到下一個 chunk
+    """
+
+    def __init__(self, markers: Dict[str, str] = None, default_section: str = "detail"):
+        self.markers = markers or SECTION_MARKERS
+        self.section: Optional[str] = None
+        self.default_section = default_section
+        self.texts: Dict[str, str] = {name: "" for name in self.markers.values()}
+        self._buffer = ""
+
+    def _emit(self, text: str, out: List[Tuple[str, str]]):
+        if not text:
+            return
+        section = self.section or self.default_section
+        # 區段開頭的換行不輸出
+        if not self.texts[section]:
+            text = text.lstrip()
+            if not text:
+                return
+        self.texts[section] += text
+        out.append((section, text))
+
+    def _pending_prefix_length(self) -> int:
+        """緩衝區結尾可能構成標記開頭的最長長度"""
+        longest = 0
+        for marker in self.markers:
+            for length in range(1, len(marker)):
+                if self._buffer.endswith(marker[:length]):
+                    longest = max(longest, length)
+        return longest
+
+    def feed(self, chunk: str) -> List[Tuple[str, str]]:
+        """加入一段串流文字，回傳可以輸出的 (section, text) 片段"""
+        out: List[Tuple[str, str]] = []
+        self._buffer += chunk
+        while True:
+            positions = [(self._buffer.find(m), m) for m in self.markers if m in self._buffer]
+            if not positions:
+                break
+            index, marker = min(positions)
+            self._emit(self._buffer[:index], out)
+            self.section = self.markers[marker]
+            self._buffer = self._buffer[index + len(marker):]
+        keep = self._pending_prefix_length()
+        ready = self._buffer[:len(self._buffer) - keep] if keep else self._buffer
+        self._emit(ready, out)
+        self._buffer = self._buffer[len(ready):]
+        return out
+
+    def flush(self) -> List[Tuple[str, str]]:
+        """串流結束時輸出剩餘緩衝"""
+        out: List[Tuple[str, str]] = []
+        self._emit(self._buffer, out)
+        self._buffer = ""
+        return out
+
+    def result(self, section: str) -> str:
+        return self.texts.get(section, "").strip()
+
+
+def fallback_outline(detail: str, max_points: int = 3, max_length: int = 15) -> str:
+    """模型未輸出大綱區段時，從詳細說明擷取前幾句作為大綱"""
+    sentences = []
+    for part in detail.replace("\n", "。").split("。"):
+        part = part.strip(" -•*、，")
+        if part:
+            sentences.append(f"- {part[:max_length]}")
+        if len(sentences) >= max_points:
+            break
+    return "\n".join(sentences)
@@ -0,0 +1,165 @@
+"""
+提示詞 token 預算管理
+模型 num_ctx 僅 2048，需在送出前對檢索內容排序、去重並裁切，
+避免 Ollama 靜默截斷上下文或拉長 prefill 時間
+"""
+import math
+import re
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# CJK 字元在 Llama 3 系 tokenizer 中大多為一字一 token；其餘以 BPE 平均約 4 字元一 token 估算
+_CJK_RANGE = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef'
+_CJK_PATTERN = re.compile(f'[{_CJK_RANGE}]')
+_WORD_PATTERN = re.compile(f'[A-Za-z0-9]+|[^\\sA-Za-z0-9{_CJK_RANGE}]')
+
+# 保留給聊天模板特殊 token 與估算誤差的餘裕
+SAFETY_MARGIN = 48
+
+
+def count_tokens(text: str) -> int:
+    """估算文字的 token 數（不需載入 tokenizer，成本為單次正規表示式掃描）"""
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    rest = _CJK_PATTERN.sub(' ', text)
+    other = sum(math.ceil(len(word) / 4) for word in _WORD_PATTERN.findall(rest))
+    return cjk + other
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r'\s+', '', text).lower()
+
+
+def _bigrams(text: str) -> set:
+    text = _normalize(text)
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """將文字裁切到不超過 max_tokens，盡量在換行或句號處截斷"""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(text[:mid]) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    cut = text[:low]
+    boundary = max(cut.rfind('\n'), cut.rfind('。'), cut.rfind('. '))
+    if boundary > len(cut) // 2:
+        cut = cut[:boundary + 1]
+    return cut
+
+
+@dataclass
+class PromptUsage:
+    """單次請求各階段的提示詞 token 統計"""
+    stages: Dict[str, Dict[str, int]] = field(default_factory=dict)
+
+    def record(self, stage: str, prompt_tokens: int, context_tokens: int = 0, dropped: int = 0):
+        self.stages[stage] = {
+            "prompt_tokens": prompt_tokens,
+            "context_tokens": context_tokens,
+            "dropped_items": dropped,
+        }
+        print(f"[token] {stage}: prompt={prompt_tokens} context={context_tokens} dropped={dropped}")
+
+    @property
+    def total_prompt_tokens(self) -> int:
+        return sum(stage["prompt_tokens"] for stage in self.stages.values())
+
+    def as_dict(self) -> dict:
+        return {"total": self.total_prompt_tokens, "stages": self.stages}
+
+
+class TokenBudgetManager:
+    """依模型上下文長度計算各階段可用的 context 預算，並排序、去重、裁切檢索內容"""
+
+    def __init__(self, num_ctx: int, num_predict: int, safety_margin: int = SAFETY_MARGIN):
+        self.num_ctx = num_ctx
+        self.num_predict = num_predict
+        self.safety_margin = safety_margin
+
+    def context_budget(self, template: str, **fixed_fields) -> int:
+        """扣除模板、固定欄位與輸出長度後，留給 context 的 token 數"""
+        overhead = count_tokens(template) + sum(count_tokens(str(v)) for v in fixed_fields.values())
+        return max(self.num_ctx - self.num_predict - self.safety_margin - overhead, 0)
+
+    def fit_items(self, items: Iterable[str], question: str, budget: int,
+                  separator: str = "\n", priority: Optional[Callable[[str], float]] = None) -> Tuple[str, int]:
+        """
+        依與問題的相關程度排序並去重，貪婪放入預算內；最後一筆放不下時裁切填滿。
+        priority 不為 None 時先依其值（高者優先）排序，再依相關程度排序（例如病人分期相符的內容優先）。
+        回傳 (合併後的 context, 被捨棄的筆數)
+        """
+        items = list(items)
+        seen = set()
+        unique: List[str] = []
+        for item in items:
+            key = _normalize(item)
+            if key and key not in seen:
+                seen.add(key)
+                unique.append(item)
+
+        question_grams = _bigrams(question)
+
+        def relevance(text: str) -> float:
+            grams = _bigrams(text)
+            if not grams or not question_grams:
+                return 0.0
+            return len(grams & question_grams) / len(question_grams)
+
+        # 穩定排序：相關度相同時保留原本（資料庫回傳）的順序
+        if priority is None:
+            ranked = sorted(unique, key=relevance, reverse=True)
+        else:
+            ranked = sorted(unique, key=lambda text: (priority(text), relevance(text)), reverse=True)
+
+        selected: List[str] = []
+        used = 0
+        separator_tokens = count_tokens(separator)
+        for item in ranked:
+            cost = count_tokens(item) + (separator_tokens if selected else 0)
+            if used + cost <= budget:
+                selected.append(item)
+                used += cost
+                continue
+            remaining = budget - used - (separator_tokens if selected else 0)
+            if remaining > 16:
+                selected.append(truncate_to_tokens(item, remaining))
+                used = budget
+            break
+
+        return separator.join(selected), len(items) - len(selected)
+
+    def fit_text(self, text: str, question: str, budget: int) -> Tuple[str, int]:
+        """將單段長文字依段落切開後套用 fit_items，並保持原段落順序"""
+        paragraphs = [p for p in re.split(r'\n\s*\n|\n', text or "") if p.strip()]
+        if count_tokens(text) <= budget:
+            return text, 0
+        fitted, dropped = self.fit_items(paragraphs, question, budget)
+        kept = fitted.split("\n")
+        order = {p: i for i, p in enumerate(paragraphs)}
+        kept.sort(key=lambda p: order.get(p, len(paragraphs)))
+        return "\n".join(kept), dropped
+
+    def prepare(self, template: str, context_field: str, context: str,
+                usage: Optional[PromptUsage] = None, stage: str = "", system: str = "", **fields) -> str:
+        """
+        裁切 context 使整份提示詞符合預算，回傳格式化後的提示詞並記錄 token 數。
+        system 為另外送出的固定 system 訊息，只計入預算，不包含在回傳的提示詞中
+        """
+        system_tokens = count_tokens(system)
+        empty_prompt = template.format(**{context_field: ""}, **fields)
+        budget = max(self.num_ctx - self.num_predict - self.safety_margin
+                     - system_tokens - count_tokens(empty_prompt), 0)
+        fitted, dropped = self.fit_text(context, fields.get("question", ""), budget)
+        prompt = template.format(**{context_field: fitted}, **fields)
+        if usage is not None:
+            usage.record(stage, system_tokens + count_tokens(prompt), count_tokens(fitted), dropped)
+        return prompt
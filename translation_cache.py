@@ -0,0 +1,180 @@
+"""
+問題翻譯（中文 → 英文）快取
+以正規化後的問題為鍵，記憶體內為有上限的 LRU；被淘汰的項目寫入磁碟上的 JSONL 檔，
+記憶體未命中時再從磁碟讀回，服務重啟後仍可沿用先前的翻譯。
+翻譯在背景執行，不阻塞檢索；同一問題同時有多個請求時只翻譯一次
+"""
+import asyncio
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional
+
+from config import TRANSLATION_CACHE_SIZE, TRANSLATION_CACHE_FILE
+from faq_store import normalize_question
+
+# 磁碟檔案最多保留的翻譯數；載入時超過即壓縮成最新的這些項目
+MAX_SPILL_ENTRIES = 20000
+
+
+class TranslationCache:
+    """記憶體 LRU + 磁碟溢出的翻譯快取"""
+
+    def __init__(self, max_entries: int = TRANSLATION_CACHE_SIZE, spill_path: Optional[str] = TRANSLATION_CACHE_FILE):
+        self.max_entries = max_entries
+        self.spill_path = spill_path
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        # 磁碟上每個鍵最新一筆的位置
+        self._spilled: Dict[str, int] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._lock = threading.Lock()
+        self._load_spill()
+
+    def _load_spill(self):
+        if not self.spill_path or not os.path.exists(self.spill_path):
+            return
+        entries: "OrderedDict[str, str]" = OrderedDict()
+        lines = 0
+        try:
+            with open(self.spill_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        item = json.loads(line)
+                    except ValueError:
+                        continue
+                    entries.pop(item["key"], None)
+                    entries[item["key"]] = item["translation"]
+        except OSError as e:
+            print(f"翻譯快取載入失敗: {e}")
+            return
+        try:
+            if lines > len(entries) or len(entries) > MAX_SPILL_ENTRIES:
+                self._rewrite_spill(list(entries.items())[-MAX_SPILL_ENTRIES:])
+            else:
+                self._index_spill()
+        except OSError as e:
+            print(f"翻譯快取整理失敗: {e}")
+            self._spilled = {}
+            return
+        print(f"翻譯快取已載入: 磁碟 {len(self._spilled)} 筆")
+
+    def _rewrite_spill(self, items):
+        """去除重複與過舊的項目後原子替換磁碟檔"""
+        tmp_path = f"{self.spill_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for key, translation in items:
+                f.write(json.dumps({"key": key, "translation": translation}, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.spill_path)
+        self._index_spill()
+
+    def _index_spill(self):
+        self._spilled = {}
+        with open(self.spill_path, "rb") as f:
+            offset = 0
+            for line in f:
+                try:
+                    self._spilled[json.loads(line)["key"]] = offset
+                except (ValueError, KeyError):
+                    pass
+                offset += len(line)
+
+    def _read_spilled(self, key: str) -> Optional[str]:
+        offset = self._spilled.get(key)
+        if offset is None:
+            return None
+        try:
+            with open(self.spill_path, "rb") as f:
+                f.seek(offset)
+                return json.loads(f.readline())["translation"]
+        except (OSError, ValueError, KeyError):
+            self._spilled.pop(key, None)
+            return None
+
+    def _spill(self, key: str, translation: str):
+        if not self.spill_path or key in self._spilled:
+            return
+        line = (json.dumps({"key": key, "translation": translation}, ensure_ascii=False) + "\n").encode("utf-8")
+        try:
+            with open(self.spill_path, "ab") as f:
+                offset = f.seek(0, os.SEEK_END)
+                f.write(line)
+            self._spilled[key] = offset
+        except OSError as e:
+            print(f"翻譯快取寫入磁碟失敗: {e}")
+
+    def get(self, question: str) -> Optional[str]:
+        key = normalize_question(question)
+        with self._lock:
+            translation = self._memory.get(key)
+            if translation is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return translation
+            translation = self._read_spilled(key)
+            if translation is not None:
+                self.disk_hits += 1
+                self._store(key, translation)
+                return translation
+            self.misses += 1
+            return None
+
+    def put(self, question: str, translation: str):
+        key = normalize_question(question)
+        if not key or not translation:
+            return
+        with self._lock:
+            self._store(key, translation)
+
+    def _store(self, key: str, translation: str):
+        self._memory[key] = translation
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            evicted_key, evicted = self._memory.popitem(last=False)
+            self._spill(evicted_key, evicted)
+
+    def translate_in_background(self, question: str, translate: Callable[[str], Awaitable[str]]) -> asyncio.Task:
+        """
+        在背景翻譯並寫入快取，回傳翻譯工作；同一問題已在翻譯中時回傳同一個工作。
+        工作不隨單一請求取消，翻譯完成後後續請求即可命中快取
+        """
+        key = normalize_question(question)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._translate(question, key, translate))
+            self._inflight[key] = task
+        return task
+
+    async def _translate(self, question: str, key: str, translate: Callable[[str], Awaitable[str]]) -> Optional[str]:
+        try:
+            translation = await translate(question)
+        except Exception as e:
+            print(f"問題翻譯失敗: {e}")
+            return None
+        finally:
+            self._inflight.pop(key, None)
+        self.put(question, translation)
+        return translation
+
+    def flush(self):
+        """將記憶體中的翻譯寫入磁碟（服務關閉時呼叫，重啟後可沿用）"""
+        with self._lock:
+            for key, translation in self._memory.items():
+                self._spill(key, translation)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "memory_entries": len(self._memory),
+                "disk_entries": len(self._spilled),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "inflight": len(self._inflight),
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+            }